@@ -3,38 +3,24 @@ import os
 import base64
 import uuid
 from datetime import datetime, date as date_type
-import psycopg2
+from core import get_db, instrumented, json_response, is_demo_request, TTLCache, run_batch, revoke_user_tokens
 
 PROTECTED_CODE = 'АД-001'
 
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+STATS_CACHE_TTL = int(os.environ.get('AHO_STATS_CACHE_TTL', '30'))
+
+_stats_cache = TTLCache(STATS_CACHE_TTL)
+
+FUNCTION_NAME = 'aho'
+READ_ACTIONS = ('list', 'batches', 'stats', 'medical-status', 'medical-itr-stats', 'export-all', 'housing-stats')
+
 
+def invalidate_stats_cache():
+    """Сброс кэша статистики АХО после изменений въезда/выезда/расселения"""
+    _stats_cache.clear()
+
+
+@instrumented(FUNCTION_NAME, READ_ACTIONS)
 def handler(event, context):
     """АХО — загрузка списков, контроль въезда/выезда, расселение, статистика"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -45,6 +31,9 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'POST' and action == 'upload':
         return upload_excel(body)
     elif method == 'GET' and action == 'list':
@@ -93,6 +82,10 @@ def handler(event, context):
         return create_rooms_batch(body)
     elif method == 'GET' and action == 'housing-stats':
         return get_housing_stats(params)
+    elif method == 'GET' and action == 'free-beds':
+        return get_free_beds(params)
+    elif method == 'POST' and action == 'allocate-batch':
+        return allocate_batch(body)
 
     return json_response(404, {'error': 'Маршрут не найден'})
 
@@ -271,6 +264,7 @@ def upload_excel(body):
     ))
 
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
 
@@ -393,6 +387,7 @@ def check_in(body):
         """ % (row[1].replace("'", "''"), row[0]))
 
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
 
@@ -418,6 +413,8 @@ def check_out(body):
         conn.close()
         return json_response(404, {'error': 'Запись не найдена'})
 
+    release_beds(cur, "a.id = %d" % int(arrival_id))
+
     if row[0]:
         cur.execute("""
             UPDATE personnel SET status = 'departed', updated_at = NOW() WHERE id = %d
@@ -428,123 +425,389 @@ def check_out(body):
         """ % (row[1].replace("'", "''"), row[0]))
 
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
 
     return json_response(200, {'message': '%s — выезд зафиксирован' % row[1]})
 
 
+def release_beds(cur, arrival_where):
+    """Освобождение мест в реестре заселения для заездов, подходящих под условие"""
+    cur.execute("""
+        WITH rel AS (
+            UPDATE room_occupancy o SET released_at = NOW()
+            WHERE o.released_at IS NULL
+              AND o.arrival_id IN (SELECT a.id FROM aho_arrivals a WHERE %s)
+            RETURNING o.room_id
+        )
+        UPDATE rooms r SET occupied = GREATEST(r.occupied - c.cnt, 0), updated_at = NOW()
+        FROM (SELECT room_id, COUNT(*) AS cnt FROM rel GROUP BY room_id) c
+        WHERE r.id = c.room_id
+    """ % arrival_where)
+
+
+def find_free_beds(cur, building_id, count, lock=False):
+    """Подбор комнат со свободными местами в здании — сначала заполненные, чтобы селить плотно"""
+    cur.execute("""
+        SELECT r.id, r.room_number, r.floor, r.capacity, r.occupied
+        FROM rooms r
+        WHERE r.building_id = %d AND r.is_active = TRUE AND r.occupied < r.capacity
+        ORDER BY r.occupied DESC, r.floor, r.room_number
+        LIMIT %d
+        %s
+    """ % (building_id, count, 'FOR UPDATE' if lock else ''))
+
+    rooms = []
+    remaining = count
+    for r in cur.fetchall():
+        if remaining <= 0:
+            break
+        free = r[3] - r[4]
+        take = min(free, remaining)
+        remaining -= take
+        rooms.append({
+            'id': r[0], 'room_number': r[1], 'floor': r[2],
+            'capacity': r[3], 'occupied': r[4], 'free': free, 'take': take,
+        })
+    return rooms
+
+
 def assign_room(body):
     arrival_id = body.get('id')
-    room = body.get('room', '')
-    building = body.get('building', '')
+    room = str(body.get('room', '') or '').strip()
+    building = str(body.get('building', '') or '').strip()
+    room_id = body.get('room_id')
+    building_id = body.get('building_id')
 
-    if not arrival_id or not room:
+    if not arrival_id or not (room or room_id):
         return json_response(400, {'error': 'ID и номер комнаты обязательны'})
+    try:
+        arrival_id = int(arrival_id)
+        room_id = int(room_id) if room_id else None
+        building_id = int(building_id) if building_id else None
+    except (ValueError, TypeError):
+        return json_response(400, {'error': 'id, room_id и building_id должны быть числами'})
 
     conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT id, capacity, occupied FROM rooms WHERE room_number = '%s'" % room.replace("'", "''"))
-    room_row = cur.fetchone()
-    if room_row and room_row[2] >= room_row[1]:
+    safe_room = room.replace("'", "''")
+    if room_id:
+        room_where = "r.id = %d" % room_id
+    elif building_id:
+        room_where = "r.building_id = %d AND r.room_number = '%s'" % (building_id, safe_room)
+    elif building:
+        room_where = "b.name = '%s' AND r.room_number = '%s'" % (building.replace("'", "''"), safe_room)
+    else:
+        room_where = "r.room_number = '%s'" % safe_room
+
+    cur.execute("""
+        SELECT r.id, r.capacity, r.occupied, r.room_number, b.name
+        FROM rooms r
+        JOIN buildings b ON r.building_id = b.id
+        WHERE %s AND r.is_active = TRUE
+        FOR UPDATE OF r
+    """ % room_where)
+    room_rows = cur.fetchall()
+
+    if len(room_rows) > 1:
         cur.close()
         conn.close()
-        return json_response(400, {'error': 'Комната %s заполнена (%d/%d)' % (room, room_row[2], room_row[1])})
+        return json_response(400, {'error': 'Комната %s есть в нескольких зданиях — укажите здание' % room})
+    if not room_rows:
+        cur.close()
+        conn.close()
+        return json_response(404, {'error': 'Комната %s не найдена' % room if room else 'Комната не найдена'})
+    room_row = room_rows[0]
 
-    cur.execute("""
-        UPDATE aho_arrivals SET room = '%s', building = '%s', updated_at = NOW()
-        WHERE id = %d RETURNING personnel_id, full_name
-    """ % (room.replace("'", "''"), building.replace("'", "''"), int(arrival_id)))
+    cur.execute("SELECT personnel_id, full_name FROM aho_arrivals WHERE id = %d FOR UPDATE" % int(arrival_id))
     row = cur.fetchone()
-
     if not row:
         cur.close()
         conn.close()
         return json_response(404, {'error': 'Запись не найдена'})
 
+    room = room_row[3]
+    building = room_row[4]
+    cur.execute("""
+        SELECT room_id FROM room_occupancy WHERE arrival_id = %d AND released_at IS NULL
+    """ % int(arrival_id))
+    current = cur.fetchone()
+    if current and current[0] == room_row[0]:
+        cur.close()
+        conn.close()
+        return json_response(200, {'message': '%s уже заселён в комнату %s' % (row[1], room)})
+    if room_row[2] >= room_row[1]:
+        cur.close()
+        conn.close()
+        return json_response(400, {'error': 'Комната %s заполнена (%d/%d)' % (room, room_row[2], room_row[1])})
+
+    release_beds(cur, "a.id = %d" % int(arrival_id))
+
+    cur.execute("""
+        INSERT INTO room_occupancy (room_id, arrival_id, personnel_id)
+        VALUES (%d, %d, %s)
+    """ % (room_row[0], int(arrival_id), row[0] if row[0] else 'NULL'))
+    cur.execute("UPDATE rooms SET occupied = occupied + 1, updated_at = NOW() WHERE id = %d" % room_row[0])
+
+    cur.execute("""
+        UPDATE aho_arrivals SET room = '%s', building = '%s', updated_at = NOW()
+        WHERE id = %d
+    """ % (room.replace("'", "''"), building.replace("'", "''"), int(arrival_id)))
+
     if row[0]:
         cur.execute("""
             UPDATE personnel SET room = '%s', updated_at = NOW() WHERE id = %d
         """ % (room.replace("'", "''"), row[0]))
 
-    if room_row:
-        cur.execute("UPDATE rooms SET occupied = occupied + 1 WHERE id = %d" % room_row[0])
-
     cur.execute("""
         INSERT INTO events (event_type, description, personnel_id)
         VALUES ('housing', '%s — заселён в комнату %s', %s)
     """ % (row[1].replace("'", "''"), room.replace("'", "''"), row[0] if row[0] else 'NULL'))
 
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
 
     return json_response(200, {'message': '%s заселён в комнату %s' % (row[1], room)})
 
 
-def get_stats(event):
+def get_free_beds(params):
+    if not params.get('building_id'):
+        return json_response(400, {'error': 'Не указан building_id'})
+    try:
+        building_id = int(params['building_id'])
+        count = max(int(params.get('count', '1') or 1), 1)
+    except ValueError:
+        return json_response(400, {'error': 'building_id и count должны быть числами'})
+
     conn = get_db()
     cur = conn.cursor()
+    rooms = find_free_beds(cur, building_id, count)
+    cur.close()
+    conn.close()
 
-    demo_val = 'TRUE' if is_demo_request(event) else 'FALSE'
+    found = sum(r['take'] for r in rooms)
+    return json_response(200, {
+        'building_id': building_id,
+        'requested': count,
+        'found': found,
+        'rooms': rooms,
+    })
 
-    cur.execute("SELECT COUNT(*) FROM aho_arrivals a LEFT JOIN personnel p ON a.personnel_id = p.id WHERE a.is_hidden = FALSE AND (p.id IS NULL OR p.is_demo_data = %s)" % demo_val)
-    total = cur.fetchone()[0]
 
-    cur.execute("SELECT a.arrival_status, COUNT(*) FROM aho_arrivals a LEFT JOIN personnel p ON a.personnel_id = p.id WHERE a.is_hidden = FALSE AND (p.id IS NULL OR p.is_demo_data = %s) GROUP BY a.arrival_status" % demo_val)
-    by_status = {r[0]: r[1] for r in cur.fetchall()}
+def allocate_batch(body):
+    """Авторасселение партии: все ожидаемые/прибывшие без места — по свободным койкам за одну транзакцию.
 
-    cur.execute("SELECT COUNT(*) FROM aho_arrivals a LEFT JOIN personnel p ON a.personnel_id = p.id WHERE a.is_hidden = FALSE AND a.room IS NOT NULL AND a.room != '' AND (p.id IS NULL OR p.is_demo_data = %s)" % demo_val)
-    housed = cur.fetchone()[0]
+    Комнат берётся не больше, чем людей (в каждой есть хотя бы одно место), и блокируются только
+    они; комнаты, занятые параллельным заселением, пропускаются (SKIP LOCKED).
+    """
+    batch_id = str(body.get('batch_id', '') or '').strip()
+    if not batch_id:
+        return json_response(400, {'error': 'Укажите партию (batch_id)'})
 
-    cur.execute("SELECT COUNT(*) FROM aho_arrivals a LEFT JOIN personnel p ON a.personnel_id = p.id WHERE a.is_hidden = FALSE AND (a.room IS NULL OR a.room = '') AND (p.id IS NULL OR p.is_demo_data = %s)" % demo_val)
-    not_housed = cur.fetchone()[0]
+    try:
+        building_ids = [int(b) for b in (body.get('building_ids') or [])]
+    except (TypeError, ValueError):
+        return json_response(400, {'error': 'building_ids должен быть списком ID зданий'})
+    only_preferred = bool(body.get('only_preferred', False))
+    group_by = body.get('group_by', 'organization')
+    if group_by not in ('organization', 'department', 'none'):
+        return json_response(400, {'error': 'group_by: organization, department или none'})
+    dry_run = bool(body.get('dry_run', False))
+
+    conn = get_db()
+    cur = conn.cursor()
 
     cur.execute("""
-        SELECT p.medical_status, COUNT(*)
+        SELECT a.id, a.personnel_id, a.full_name, COALESCE(a.organization, ''), COALESCE(a.department, '')
         FROM aho_arrivals a
-        JOIN personnel p ON a.personnel_id = p.id
-        WHERE a.arrival_status = 'arrived' AND a.is_hidden = FALSE AND p.is_demo_data = %s
-        GROUP BY p.medical_status
-    """ % demo_val)
-    medical = {r[0]: r[1] for r in cur.fetchall()}
+        WHERE a.batch_id = '%s' AND a.is_hidden = FALSE
+          AND a.arrival_status IN ('expected', 'arrived')
+          AND NOT EXISTS (
+              SELECT 1 FROM room_occupancy o WHERE o.arrival_id = a.id AND o.released_at IS NULL
+          )
+        ORDER BY a.id
+        FOR UPDATE OF a
+    """ % batch_id.replace("'", "''"))
+    arrivals = cur.fetchall()
+
+    if not arrivals:
+        cur.close()
+        conn.close()
+        return json_response(200, {'message': 'Все из партии уже расселены', 'allocated': 0, 'unallocated': 0, 'assignments': []})
 
-    cur.execute("""
-        SELECT COUNT(*) FROM aho_arrivals a LEFT JOIN personnel p ON a.personnel_id = p.id
-        WHERE a.is_hidden = FALSE AND a.arrival_date = CURRENT_DATE AND (p.id IS NULL OR p.is_demo_data = %s)
-    """ % demo_val)
-    today_expected = cur.fetchone()[0]
+    if building_ids:
+        pref_array = "ARRAY[%s]::int[]" % ','.join(str(b) for b in building_ids)
+        building_filter = "AND r.building_id = ANY(%s)" % pref_array if only_preferred else ""
+        pref_order = "array_position(%s, r.building_id) NULLS LAST," % pref_array
+    else:
+        building_filter = ""
+        pref_order = ""
 
     cur.execute("""
-        SELECT COUNT(*) FROM aho_arrivals a LEFT JOIN personnel p ON a.personnel_id = p.id
-        WHERE a.is_hidden = FALSE AND a.departure_date = CURRENT_DATE AND (p.id IS NULL OR p.is_demo_data = %s)
-    """ % demo_val)
-    today_departing = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM aho_batches WHERE is_hidden = FALSE")
-    total_batches = cur.fetchone()[0]
-
-    cur.execute("SELECT COALESCE(SUM(capacity), 0), COALESCE(SUM(occupied), 0) FROM rooms")
-    rooms_row = cur.fetchone()
+        SELECT r.id, r.building_id, b.name, r.room_number, r.capacity - r.occupied
+        FROM rooms r
+        JOIN buildings b ON r.building_id = b.id
+        WHERE r.is_active = TRUE AND b.is_active = TRUE AND r.occupied < r.capacity %s
+        ORDER BY %s b.sort_order, b.id, r.occupied DESC, r.floor, r.room_number
+        LIMIT %d
+        %s
+    """ % (building_filter, pref_order, len(arrivals), '' if dry_run else 'FOR UPDATE OF r SKIP LOCKED'))
+    rooms = [list(r) for r in cur.fetchall()]
+
+    buildings_order = []
+    rooms_by_building = {}
+    for rm in rooms:
+        if rm[1] not in rooms_by_building:
+            buildings_order.append(rm[1])
+            rooms_by_building[rm[1]] = []
+        rooms_by_building[rm[1]].append(rm)
+
+    groups = {}
+    for a in arrivals:
+        key = '' if group_by == 'none' else (a[3] if group_by == 'organization' else a[4])
+        groups.setdefault(key, []).append(a)
+    ordered_groups = sorted(groups.values(), key=lambda g: (-len(g), g[0][3], g[0][4]))
+
+    def free_in(bid):
+        return sum(rm[4] for rm in rooms_by_building[bid])
+
+    assignments = []
+    unallocated = []
+    for members in ordered_groups:
+        members = sorted(members, key=lambda m: m[2])
+        home = next((bid for bid in buildings_order if free_in(bid) >= len(members)), None)
+        order = [home] + [bid for bid in buildings_order if bid != home] if home else buildings_order
+        queue = list(members)
+        for bid in order:
+            for rm in rooms_by_building[bid]:
+                while rm[4] > 0 and queue:
+                    person = queue.pop(0)
+                    rm[4] -= 1
+                    assignments.append((person, rm))
+                if not queue:
+                    break
+            if not queue:
+                break
+        unallocated.extend(queue)
+
+    if assignments and not dry_run:
+        values = ',\n'.join(
+            "(%d, %d, %s::int, '%s', '%s', '%s')" % (
+                person[0], rm[0], person[1] if person[1] else 'NULL',
+                rm[3].replace("'", "''"), rm[2].replace("'", "''"), person[2].replace("'", "''"),
+            )
+            for person, rm in assignments
+        )
+        cur.execute("""
+            WITH v(arrival_id, room_id, personnel_id, room, building, full_name) AS (
+                VALUES %s
+            ), occ AS (
+                INSERT INTO room_occupancy (room_id, arrival_id, personnel_id)
+                SELECT room_id, arrival_id, personnel_id FROM v
+            ), cnt AS (
+                UPDATE rooms r SET occupied = r.occupied + c.n, updated_at = NOW()
+                FROM (SELECT room_id, COUNT(*) AS n FROM v GROUP BY room_id) c
+                WHERE r.id = c.room_id
+            ), arr AS (
+                UPDATE aho_arrivals a SET room = v.room, building = v.building, updated_at = NOW()
+                FROM v WHERE a.id = v.arrival_id
+            ), per AS (
+                UPDATE personnel p SET room = v.room, updated_at = NOW()
+                FROM v WHERE p.id = v.personnel_id
+            )
+            INSERT INTO events (event_type, description, personnel_id)
+            SELECT 'housing', v.full_name || ' — заселён в комнату ' || v.room || ' (авторасселение)', v.personnel_id
+            FROM v
+        """ % values)
+        conn.commit()
+        invalidate_stats_cache()
+    else:
+        conn.rollback()
 
     cur.close()
     conn.close()
 
+    by_building = {}
+    for person, rm in assignments:
+        by_building[rm[2]] = by_building.get(rm[2], 0) + 1
+
     return json_response(200, {
-        'total': total,
-        'by_status': by_status,
-        'housed': housed,
-        'not_housed': not_housed,
-        'medical': medical,
-        'today_expected': today_expected,
-        'today_departing': today_departing,
-        'total_batches': total_batches,
-        'rooms_capacity': rooms_row[0],
-        'rooms_occupied': rooms_row[1],
+        'message': '%sРасселено %d из %d чел.' % ('Предпросмотр: ' if dry_run else '', len(assignments), len(arrivals)),
+        'batch_id': batch_id,
+        'dry_run': dry_run,
+        'allocated': len(assignments),
+        'unallocated': len(unallocated),
+        'by_building': by_building,
+        'assignments': [{
+            'id': person[0], 'full_name': person[2], 'organization': person[3],
+            'department': person[4], 'room_id': rm[0], 'room': rm[3], 'building': rm[2],
+        } for person, rm in assignments],
+        'unallocated_list': [{'id': p[0], 'full_name': p[2], 'organization': p[3]} for p in unallocated],
     })
 
 
+def get_stats(event):
+    demo = is_demo_request(event)
+    cached = _stats_cache.get(demo)
+    if cached:
+        return json_response(200, cached)
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    demo_val = 'TRUE' if demo else 'FALSE'
+
+    cur.execute("""
+        WITH arr AS (
+            SELECT a.arrival_status, a.room, a.arrival_date, a.departure_date,
+                   p.id AS person_id, p.medical_status
+            FROM aho_arrivals a
+            LEFT JOIN personnel p ON a.personnel_id = p.id
+            WHERE a.is_hidden = FALSE AND (p.id IS NULL OR p.is_demo_data = %s)
+        )
+        SELECT
+            COUNT(*),
+            COUNT(*) FILTER (WHERE room IS NOT NULL AND room != ''),
+            COUNT(*) FILTER (WHERE room IS NULL OR room = ''),
+            COUNT(*) FILTER (WHERE arrival_date = CURRENT_DATE),
+            COUNT(*) FILTER (WHERE departure_date = CURRENT_DATE),
+            (SELECT COALESCE(json_agg(json_build_array(s.arrival_status, s.cnt)), '[]')
+             FROM (SELECT arrival_status, COUNT(*) AS cnt FROM arr GROUP BY arrival_status) s),
+            (SELECT COALESCE(json_agg(json_build_array(m.medical_status, m.cnt)), '[]')
+             FROM (SELECT medical_status, COUNT(*) AS cnt FROM arr
+                   WHERE arrival_status = 'arrived' AND person_id IS NOT NULL
+                   GROUP BY medical_status) m),
+            (SELECT COUNT(*) FROM aho_batches WHERE is_hidden = FALSE),
+            (SELECT COALESCE(SUM(capacity), 0) FROM rooms),
+            (SELECT COALESCE(SUM(occupied), 0) FROM rooms)
+        FROM arr
+    """ % demo_val)
+    r = cur.fetchone()
+
+    cur.close()
+    conn.close()
+
+    result = {
+        'total': r[0],
+        'by_status': {k: v for k, v in r[5]},
+        'housed': r[1],
+        'not_housed': r[2],
+        'medical': {k: v for k, v in r[6]},
+        'today_expected': r[3],
+        'today_departing': r[4],
+        'total_batches': r[7],
+        'rooms_capacity': r[8],
+        'rooms_occupied': r[9],
+    }
+    _stats_cache.set(demo, result)
+
+    return json_response(200, result)
+
+
 def get_medical_status(params, event):
     batch_id = params.get('batch_id', '')
     status_filter = params.get('medical', '')
@@ -702,73 +965,77 @@ def get_template():
 
 
 def mass_check_in(body):
-    ids = body.get('ids', [])
-    batch_id = body.get('batch_id', '')
-    if not ids and not batch_id:
-        return json_response(400, {'error': 'Укажите список ID или партию'})
-
-    conn = get_db()
-    cur = conn.cursor()
+    return mass_update_status(body, 'expected', 'arrived', 'check_in_at', 'check_in', 'массовый въезд (АХО)', 'Въезд')
 
-    if batch_id and not ids:
-        cur.execute("SELECT id FROM aho_arrivals WHERE batch_id = '%s' AND arrival_status = 'expected'" % batch_id.replace("'", "''"))
-        ids = [r[0] for r in cur.fetchall()]
 
-    count = 0
-    for aid in ids:
-        cur.execute("""
-            UPDATE aho_arrivals SET arrival_status = 'arrived', check_in_at = NOW(), updated_at = NOW()
-            WHERE id = %d AND arrival_status = 'expected' RETURNING personnel_id, full_name
-        """ % int(aid))
-        row = cur.fetchone()
-        if row:
-            count += 1
-            if row[0]:
-                cur.execute("UPDATE personnel SET status = 'arrived', updated_at = NOW() WHERE id = %d" % row[0])
-                cur.execute("""
-                    INSERT INTO events (event_type, description, personnel_id)
-                    VALUES ('check_in', '%s — массовый въезд (АХО)', %d)
-                """ % (row[1].replace("'", "''"), row[0]))
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return json_response(200, {'message': 'Въезд зафиксирован: %d чел.' % count, 'count': count})
+def mass_check_out(body):
+    return mass_update_status(body, 'arrived', 'departed', 'check_out_at', 'check_out', 'массовый выезд (АХО)', 'Выезд')
 
 
-def mass_check_out(body):
+def mass_update_status(body, from_status, to_status, ts_column, event_type, event_suffix, label):
+    """Массовая смена статуса тремя запросами: заезды, персонал, журнал событий"""
     ids = body.get('ids', [])
     batch_id = body.get('batch_id', '')
     if not ids and not batch_id:
         return json_response(400, {'error': 'Укажите список ID или партию'})
 
+    try:
+        ids = sorted(set(int(i) for i in ids))
+    except (TypeError, ValueError):
+        return json_response(400, {'error': 'ID должны быть числами'})
+
+    if ids:
+        target = "id = ANY(ARRAY[%s]::int[])" % ','.join(str(i) for i in ids)
+    else:
+        target = "batch_id = '%s'" % batch_id.replace("'", "''")
+
     conn = get_db()
     cur = conn.cursor()
 
-    if batch_id and not ids:
-        cur.execute("SELECT id FROM aho_arrivals WHERE batch_id = '%s' AND arrival_status = 'arrived'" % batch_id.replace("'", "''"))
-        ids = [r[0] for r in cur.fetchall()]
+    cur.execute("""
+        UPDATE aho_arrivals SET arrival_status = '%s', %s = NOW(), updated_at = NOW()
+        WHERE %s AND arrival_status = '%s'
+        RETURNING id, personnel_id, full_name
+    """ % (to_status, ts_column, target, from_status))
+    rows = cur.fetchall()
+
+    if to_status == 'departed' and rows:
+        release_beds(cur, "a.id = ANY(ARRAY[%s]::int[])" % ','.join(str(r[0]) for r in rows))
 
-    count = 0
-    for aid in ids:
+    person_rows = [r for r in rows if r[1]]
+    if person_rows:
+        person_ids = ','.join(str(r[1]) for r in person_rows)
         cur.execute("""
-            UPDATE aho_arrivals SET arrival_status = 'departed', check_out_at = NOW(), updated_at = NOW()
-            WHERE id = %d AND arrival_status = 'arrived' RETURNING personnel_id, full_name
-        """ % int(aid))
-        row = cur.fetchone()
-        if row:
-            count += 1
-            if row[0]:
-                cur.execute("UPDATE personnel SET status = 'departed', updated_at = NOW() WHERE id = %d" % row[0])
-                cur.execute("""
-                    INSERT INTO events (event_type, description, personnel_id)
-                    VALUES ('check_out', '%s — массовый выезд (АХО)', %d)
-                """ % (row[1].replace("'", "''"), row[0]))
+            UPDATE personnel SET status = '%s', updated_at = NOW()
+            WHERE id = ANY(ARRAY[%s]::int[])
+        """ % (to_status, person_ids))
+
+        values = ',\n'.join(
+            "('%s', '%s — %s', %d)" % (event_type, r[2].replace("'", "''"), event_suffix, r[1])
+            for r in person_rows
+        )
+        cur.execute("""
+            INSERT INTO events (event_type, description, personnel_id)
+            VALUES %s
+        """ % values)
 
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
-    return json_response(200, {'message': 'Выезд зафиксирован: %d чел.' % count, 'count': count})
+
+    count = len(rows)
+    updated_ids = set(r[0] for r in rows)
+    skipped_ids = [i for i in ids if i not in updated_ids]
+
+    return json_response(200, {
+        'message': '%s зафиксирован: %d чел.' % (label, count),
+        'count': count,
+        'requested': len(ids) if ids else count,
+        'skipped': len(skipped_ids),
+        'skipped_ids': skipped_ids,
+        'persons_updated': len(person_rows),
+    })
 
 
 def get_itr_positions():
@@ -941,6 +1208,7 @@ def perform_reset(body):
         """ % affected)
 
     elif reset_type == 'aho_arrivals':
+        release_beds(cur, "a.is_hidden = FALSE AND a.arrival_status IN ('expected', 'arrived')")
         cur.execute("""
             UPDATE aho_arrivals SET is_hidden = TRUE, updated_at = NOW()
             WHERE is_hidden = FALSE AND arrival_status IN ('expected', 'arrived')
@@ -959,6 +1227,7 @@ def perform_reset(body):
         """ % affected)
 
     elif reset_type == 'aho_departures':
+        release_beds(cur, "a.is_hidden = FALSE AND a.arrival_status = 'departed'")
         cur.execute("""
             UPDATE aho_arrivals SET is_hidden = TRUE, updated_at = NOW()
             WHERE is_hidden = FALSE AND arrival_status = 'departed'
@@ -978,6 +1247,8 @@ def perform_reset(body):
             SELECT COUNT(*) FROM aho_arrivals WHERE arrival_status IN ('expected', 'arrived')
         """)
         affected = cur.fetchone()[0]
+        release_beds(cur, "a.arrival_status IN ('expected', 'arrived')")
+        cur.execute("DELETE FROM room_occupancy WHERE arrival_id IN (SELECT id FROM aho_arrivals WHERE arrival_status IN ('expected', 'arrived'))")
         cur.execute("DELETE FROM aho_arrivals WHERE arrival_status IN ('expected', 'arrived')")
         cur.execute("DELETE FROM aho_batches WHERE batch_id NOT IN (SELECT DISTINCT batch_id FROM aho_arrivals)")
         cur.execute("""
@@ -994,6 +1265,8 @@ def perform_reset(body):
             SELECT COUNT(*) FROM aho_arrivals WHERE arrival_status = 'departed'
         """)
         affected = cur.fetchone()[0]
+        release_beds(cur, "a.arrival_status = 'departed'")
+        cur.execute("DELETE FROM room_occupancy WHERE arrival_id IN (SELECT id FROM aho_arrivals WHERE arrival_status = 'departed')")
         cur.execute("DELETE FROM aho_arrivals WHERE arrival_status = 'departed'")
         cur.execute("DELETE FROM aho_batches WHERE batch_id NOT IN (SELECT DISTINCT batch_id FROM aho_arrivals)")
         cur.execute("""
@@ -1042,7 +1315,7 @@ def perform_reset(body):
 
     elif reset_type == 'full':
         counts = {}
-        for table in ['aho_arrivals', 'aho_batches', 'medical_checks', 'events', 'notifications',
+        for table in ['room_occupancy', 'aho_arrivals', 'aho_batches', 'medical_checks', 'events', 'notifications',
                        'dispatcher_messages', 'medical_reset_log', 'lanterns', 'rooms',
                        'lamp_room_issues', 'lamp_room_denials', 'lamp_room_equipment',
                        'security_checks', 'checkpoint_passes']:
@@ -1053,6 +1326,7 @@ def perform_reset(body):
         cur.execute("SELECT COUNT(*) FROM personnel WHERE full_name NOT IN (SELECT full_name FROM users WHERE role = 'admin') AND personal_code != '%s'" % PROTECTED_CODE)
         counts['personnel'] = cur.fetchone()[0]
         cur.execute("DELETE FROM sessions WHERE user_id NOT IN (SELECT id FROM users WHERE role = 'admin')")
+        revoke_user_tokens(cur, "role != 'admin'")
         cur.execute("DELETE FROM personnel WHERE full_name NOT IN (SELECT full_name FROM users WHERE role = 'admin') AND personal_code != '%s'" % PROTECTED_CODE)
         cur.execute("DELETE FROM users WHERE role != 'admin'")
 
@@ -1062,6 +1336,7 @@ def perform_reset(body):
             VALUES ('full', 'Полный сброс системы. Администраторы сохранены. Удалено: %d записей', %d)
         """ % (affected, affected))
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
 
@@ -1096,6 +1371,7 @@ def export_all_data():
         'events': ['id','event_type','description','personnel_id','user_id','metadata','is_hidden','created_at'],
         'lanterns': ['id','lantern_number','rescuer_number','status','assigned_to','issued_at','returned_at','condition'],
         'rooms': ['id','room_number','building','capacity','occupied','status'],
+        'room_occupancy': ['id','room_id','arrival_id','personnel_id','assigned_at','released_at'],
         'notifications': ['id','type','title','message','person_name','person_code','is_read','created_at'],
         'reset_log': ['id','reset_type','description','affected_rows','performed_by','performed_at'],
     }
@@ -1127,11 +1403,13 @@ def get_buildings():
     cur = conn.cursor()
     cur.execute("""
         SELECT b.id, b.name, b.number, b.total_rooms, b.total_capacity, b.sort_order, b.is_active,
-               (SELECT COUNT(*) FROM rooms r WHERE r.building_id = b.id AND r.is_active = TRUE) as actual_rooms,
-               (SELECT COALESCE(SUM(r.capacity), 0) FROM rooms r WHERE r.building_id = b.id AND r.is_active = TRUE) as actual_capacity,
-               (SELECT COUNT(*) FROM aho_arrivals a WHERE a.building = b.name AND a.arrival_status = 'arrived' AND a.room != '' AND a.room IS NOT NULL) as occupied_people
+               COUNT(r.id) as actual_rooms,
+               COALESCE(SUM(r.capacity), 0) as actual_capacity,
+               COALESCE(SUM(r.occupied), 0) as occupied_people
         FROM buildings b
+        LEFT JOIN rooms r ON r.building_id = b.id AND r.is_active = TRUE
         WHERE b.is_active = TRUE
+        GROUP BY b.id
         ORDER BY b.sort_order, b.id
     """)
     rows = cur.fetchall()
@@ -1216,7 +1494,7 @@ def get_rooms(params):
     cur = conn.cursor()
     cur.execute("""
         SELECT r.id, r.room_number, r.capacity, r.floor, r.notes, r.is_active,
-               b.name as building_name
+               b.name as building_name, r.occupied
         FROM rooms r
         JOIN buildings b ON r.building_id = b.id
         WHERE r.building_id = %d AND r.is_active = TRUE
@@ -1224,14 +1502,6 @@ def get_rooms(params):
     """ % int(building_id))
     rows = cur.fetchall()
 
-    cur.execute("""
-        SELECT a.room, COUNT(*) FROM aho_arrivals a
-        JOIN buildings b ON a.building = b.name
-        WHERE b.id = %d AND a.arrival_status = 'arrived' AND a.room IS NOT NULL AND a.room != ''
-        GROUP BY a.room
-    """ % int(building_id))
-    occupied_map = {r[0]: r[1] for r in cur.fetchall()}
-
     cur.close()
     conn.close()
 
@@ -1242,7 +1512,7 @@ def get_rooms(params):
             'id': r[0], 'room_number': room_num, 'capacity': r[2],
             'floor': r[3], 'notes': r[4] or '', 'is_active': r[5],
             'building_name': r[6],
-            'occupied': occupied_map.get(room_num, 0),
+            'occupied': r[7],
         })
     return json_response(200, {'rooms': rooms})
 
@@ -1262,20 +1532,30 @@ def create_room(body):
     safe_num = room_number.replace("'", "''")
     safe_notes = notes.replace("'", "''")
 
-    cur.execute("SELECT id FROM rooms WHERE building_id = %d AND room_number = '%s'" % (int(building_id), safe_num))
-    if cur.fetchone():
+    cur.execute("""
+        WITH ins AS (
+            INSERT INTO rooms (building_id, room_number, capacity, floor, notes)
+            VALUES (%d, '%s', %d, %d, '%s')
+            ON CONFLICT (building_id, room_number) DO NOTHING
+            RETURNING id, capacity
+        ), upd AS (
+            UPDATE buildings SET
+                total_rooms = COALESCE(total_rooms, 0) + 1,
+                total_capacity = COALESCE(total_capacity, 0) + (SELECT capacity FROM ins),
+                updated_at = NOW()
+            WHERE id = %d AND EXISTS (SELECT 1 FROM ins)
+        )
+        SELECT id FROM ins
+    """ % (int(building_id), safe_num, capacity, floor, safe_notes, int(building_id)))
+    row = cur.fetchone()
+    if not row:
         cur.close()
         conn.close()
         return json_response(400, {'error': 'Комната %s уже существует в этом здании' % room_number})
+    room_id = row[0]
 
-    cur.execute("""
-        INSERT INTO rooms (building_id, room_number, capacity, floor, notes)
-        VALUES (%d, '%s', %d, %d, '%s') RETURNING id
-    """ % (int(building_id), safe_num, capacity, floor, safe_notes))
-    room_id = cur.fetchone()[0]
-
-    update_building_totals(cur, int(building_id))
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
 
@@ -1308,14 +1588,13 @@ def update_room(body):
         return json_response(400, {'error': 'Нечего обновлять'})
 
     sets.append("updated_at = NOW()")
-    cur.execute("UPDATE rooms SET %s WHERE id = %d" % (', '.join(sets), int(room_id)))
-
-    cur.execute("SELECT building_id FROM rooms WHERE id = %d" % int(room_id))
+    cur.execute("UPDATE rooms SET %s WHERE id = %d RETURNING building_id" % (', '.join(sets), int(room_id)))
     row = cur.fetchone()
-    if row:
+    if row and row[0]:
         update_building_totals(cur, row[0])
 
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
 
@@ -1323,58 +1602,83 @@ def update_room(body):
 
 
 def create_rooms_batch(body):
+    """Пакетное добавление комнат одним запросом, итоги здания обновляются приращением"""
     building_id = body.get('building_id')
     rooms_list = body.get('rooms', [])
 
     if not building_id or not rooms_list:
         return json_response(400, {'error': 'Укажите building_id и список rooms'})
 
-    conn = get_db()
-    cur = conn.cursor()
-    created = 0
-
+    bid = int(building_id)
+    values = []
+    seen = set()
     for rm in rooms_list:
         room_number = str(rm.get('room_number', '')).strip()
-        capacity = int(rm.get('capacity', 2))
-        floor = int(rm.get('floor', 1))
-        notes = str(rm.get('notes', '')).strip()
-
-        if not room_number:
+        if not room_number or room_number in seen:
             continue
+        seen.add(room_number)
+        values.append("(%d, '%s', %d, %d, '%s')" % (
+            bid,
+            room_number.replace("'", "''"),
+            int(rm.get('capacity', 2)),
+            int(rm.get('floor', 1)),
+            str(rm.get('notes', '')).strip().replace("'", "''"),
+        ))
 
-        safe_num = room_number.replace("'", "''")
-        safe_notes = notes.replace("'", "''")
+    if not values:
+        return json_response(200, {'created': 0, 'skipped': len(rooms_list), 'message': 'Добавлено комнат: 0'})
 
-        cur.execute("SELECT id FROM rooms WHERE building_id = %d AND room_number = '%s'" % (int(building_id), safe_num))
-        if cur.fetchone():
-            continue
+    conn = get_db()
+    cur = conn.cursor()
 
-        cur.execute("""
+    cur.execute("""
+        WITH ins AS (
             INSERT INTO rooms (building_id, room_number, capacity, floor, notes)
-            VALUES (%d, '%s', %d, %d, '%s')
-        """ % (int(building_id), safe_num, capacity, floor, safe_notes))
-        created += 1
+            VALUES %s
+            ON CONFLICT (building_id, room_number) DO NOTHING
+            RETURNING capacity
+        ), totals AS (
+            SELECT COUNT(*) AS cnt, COALESCE(SUM(capacity), 0) AS cap FROM ins
+        ), upd AS (
+            UPDATE buildings b SET
+                total_rooms = COALESCE(b.total_rooms, 0) + t.cnt,
+                total_capacity = COALESCE(b.total_capacity, 0) + t.cap,
+                updated_at = NOW()
+            FROM totals t
+            WHERE b.id = %d AND t.cnt > 0
+        )
+        SELECT cnt FROM totals
+    """ % (',\n'.join(values), bid))
+    created = cur.fetchone()[0]
 
-    update_building_totals(cur, int(building_id))
     conn.commit()
+    invalidate_stats_cache()
     cur.close()
     conn.close()
 
-    return json_response(200, {'created': created, 'message': 'Добавлено комнат: %d' % created})
+    return json_response(200, {
+        'created': created,
+        'skipped': len(rooms_list) - created,
+        'message': 'Добавлено комнат: %d' % created,
+    })
 
 
 def update_building_totals(cur, building_id):
     cur.execute("""
-        UPDATE buildings SET
-            total_rooms = (SELECT COUNT(*) FROM rooms WHERE building_id = %d AND is_active = TRUE),
-            total_capacity = (SELECT COALESCE(SUM(capacity), 0) FROM rooms WHERE building_id = %d AND is_active = TRUE),
+        UPDATE buildings b SET
+            total_rooms = t.cnt,
+            total_capacity = t.cap,
             updated_at = NOW()
-        WHERE id = %d
-    """ % (building_id, building_id, building_id))
+        FROM (
+            SELECT COUNT(*) AS cnt, COALESCE(SUM(capacity), 0) AS cap
+            FROM rooms WHERE building_id = %d AND is_active = TRUE
+        ) t
+        WHERE b.id = %d
+    """ % (building_id, building_id))
 
 
 def get_housing_stats(params):
-    """Статистика расселения: общежития, места, жильцы"""
+    """Статистика расселения из реестра занятости комнат: общежития, места, жильцы"""
     detail = params.get('detail', '')
     building_id = params.get('building_id', '')
 
@@ -1383,11 +1687,13 @@ def get_housing_stats(params):
 
     cur.execute("""
         SELECT b.id, b.name, b.number,
-               (SELECT COUNT(*) FROM rooms r WHERE r.building_id = b.id AND r.is_active = TRUE) as rooms_count,
-               (SELECT COALESCE(SUM(r.capacity), 0) FROM rooms r WHERE r.building_id = b.id AND r.is_active = TRUE) as total_beds,
-               (SELECT COUNT(*) FROM aho_arrivals a WHERE a.building = b.name AND a.arrival_status = 'arrived' AND a.room IS NOT NULL AND a.room != '') as occupied_beds
+               COUNT(r.id) as rooms_count,
+               COALESCE(SUM(r.capacity), 0) as total_beds,
+               COALESCE(SUM(r.occupied), 0) as occupied_beds
         FROM buildings b
+        LEFT JOIN rooms r ON r.building_id = b.id AND r.is_active = TRUE
         WHERE b.is_active = TRUE
+        GROUP BY b.id
         ORDER BY b.sort_order, b.id
     """)
     brows = cur.fetchall()
@@ -1426,40 +1732,36 @@ def get_housing_stats(params):
         bname = bname_row[0] if bname_row else ''
 
         cur.execute("""
-            SELECT r.id, r.room_number, r.capacity, r.floor
+            SELECT r.id, r.room_number, r.capacity, r.floor, r.occupied
             FROM rooms r
             WHERE r.building_id = %d AND r.is_active = TRUE
             ORDER BY r.floor, r.room_number
         """ % bid)
         room_rows = cur.fetchall()
 
-        safe_bname = bname.replace("'", "''")
         cur.execute("""
-            SELECT a.room, a.id, a.full_name, a.position, a.organization, a.personal_code
-            FROM aho_arrivals a
-            WHERE a.building = '%s' AND a.arrival_status = 'arrived'
-              AND a.room IS NOT NULL AND a.room != '' AND a.is_hidden = FALSE
-            ORDER BY a.room, a.full_name
-        """ % safe_bname)
+            SELECT o.room_id, a.id, a.full_name, a.position, a.organization, a.personal_code
+            FROM room_occupancy o
+            JOIN rooms r ON r.id = o.room_id
+            JOIN aho_arrivals a ON a.id = o.arrival_id
+            WHERE r.building_id = %d AND o.released_at IS NULL
+            ORDER BY a.full_name
+        """ % bid)
         residents = cur.fetchall()
 
         res_map = {}
         for res in residents:
-            rm = res[0]
-            if rm not in res_map:
-                res_map[rm] = []
-            res_map[rm].append({
+            res_map.setdefault(res[0], []).append({
                 'id': res[1], 'full_name': res[2], 'position': res[3] or '',
                 'organization': res[4] or '', 'personal_code': res[5] or '',
             })
 
         rooms_detail = []
         for rr in room_rows:
-            rnum = rr[1]
-            room_residents = res_map.get(rnum, [])
+            room_residents = res_map.get(rr[0], [])
             rooms_detail.append({
-                'id': rr[0], 'room_number': rnum, 'capacity': rr[2], 'floor': rr[3],
-                'occupied': len(room_residents), 'free': rr[2] - len(room_residents),
+                'id': rr[0], 'room_number': rr[1], 'capacity': rr[2], 'floor': rr[3],
+                'occupied': rr[4], 'free': rr[2] - rr[4],
                 'residents': room_residents,
             })
 
@@ -1471,11 +1773,13 @@ def get_housing_stats(params):
     if detail == 'all-residents':
         cur.execute("""
             SELECT a.id, a.full_name, a.position, a.organization, a.personal_code,
-                   a.room, a.building
-            FROM aho_arrivals a
-            WHERE a.arrival_status = 'arrived' AND a.is_hidden = FALSE
-              AND a.room IS NOT NULL AND a.room != ''
-            ORDER BY a.building, a.room, a.full_name
+                   r.room_number, b.name
+            FROM room_occupancy o
+            JOIN rooms r ON r.id = o.room_id
+            JOIN buildings b ON b.id = r.building_id
+            JOIN aho_arrivals a ON a.id = o.arrival_id
+            WHERE o.released_at IS NULL AND a.is_hidden = FALSE
+            ORDER BY b.name, r.room_number, a.full_name
         """)
         all_res = cur.fetchall()
         result['all_residents'] = [{
@@ -1,36 +1,68 @@
 import json
 import os
 import hashlib
+import hmac
+import base64
 import secrets
-import psycopg2
-from datetime import datetime, timedelta, date as date_type
+import time
+from datetime import datetime, timedelta
+from core import get_db, instrumented, json_response, parse_qr_code, run_batch, TOKEN_SECRET, SIGNED_TOKEN_PREFIX, b64url, b64url_decode, sign_token_body, get_auth_token, verify_signed_token, revoke_token, revoke_user_tokens, TOKEN_MAX_DAYS
 
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+FUNCTION_NAME = 'auth'
+
+PASSWORD_SCHEME = os.environ.get('AUTH_PASSWORD_SCHEME', 'scrypt')
+SCRYPT_N = int(os.environ.get('AUTH_SCRYPT_N', '16384'))
+SCRYPT_R = int(os.environ.get('AUTH_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('AUTH_SCRYPT_P', '1'))
+PBKDF2_ITERATIONS = int(os.environ.get('AUTH_PBKDF2_ITERATIONS', '310000'))
+
+
+def scrypt_digest(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p + (1 << 20), dklen=32)
 
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+    """Хэш пароля с солью по текущей схеме: scrypt$n$r$p$соль$хэш или pbkdf2_sha256$итерации$соль$хэш"""
+    salt = secrets.token_bytes(16)
+    if PASSWORD_SCHEME == 'pbkdf2':
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PBKDF2_ITERATIONS)
+        return 'pbkdf2_sha256$%d$%s$%s' % (PBKDF2_ITERATIONS, b64url(salt), b64url(digest))
+    digest = scrypt_digest(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return 'scrypt$%d$%d$%d$%s$%s' % (SCRYPT_N, SCRYPT_R, SCRYPT_P, b64url(salt), b64url(digest))
+
+
+def verify_password(password, stored):
+    """Проверка пароля по сохранённому хэшу любой поддерживаемой схемы, включая старый sha256 без соли"""
+    if not stored:
+        return False
+    parts = stored.split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            digest = scrypt_digest(password, b64url_decode(parts[4]), int(parts[1]), int(parts[2]), int(parts[3]))
+            return hmac.compare_digest(b64url(digest), parts[5])
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), b64url_decode(parts[2]), int(parts[1]))
+            return hmac.compare_digest(b64url(digest), parts[3])
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+
+_dummy_hash = []
+
+
+def dummy_password_hash():
+    """Хэш случайного пароля для сравнения при неизвестном email — чтобы время ответа не выдавало, есть ли такой пользователь"""
+    if not _dummy_hash:
+        _dummy_hash.append(hash_password(secrets.token_hex(16)))
+    return _dummy_hash[0]
+
+
+def password_needs_rehash(stored):
+    """Хэш создан не текущей схемой или с другой стоимостью"""
+    if PASSWORD_SCHEME == 'pbkdf2':
+        return not stored.startswith('pbkdf2_sha256$%d$' % PBKDF2_ITERATIONS)
+    return not stored.startswith('scrypt$%d$%d$%d$' % (SCRYPT_N, SCRYPT_R, SCRYPT_P))
 
 ALL_PAGES = ['dashboard', 'personnel', 'dispatcher', 'medical', 'lampa', 'scanner', 'security', 'checkpoint', 'aho', 'ohs', 'reports', 'profile', 'admin']
 
@@ -47,23 +79,182 @@ DEFAULT_PERMISSIONS = {
 }
 
 
-def get_auth_token(event):
-    headers = event.get('headers') or {}
-    for key in ['X-Authorization', 'x-authorization', 'Authorization', 'authorization']:
-        val = headers.get(key, '')
-        if val:
-            return val.replace('Bearer ', '') if val.startswith('Bearer ') else val
-    return ''
+SESSION_DAYS = TOKEN_MAX_DAYS
+SESSION_CACHE_TTL = int(os.environ.get('AUTH_SESSION_CACHE_TTL', '60'))
+SESSION_NEGATIVE_TTL = int(os.environ.get('AUTH_SESSION_NEGATIVE_TTL', '10'))
+SESSION_CACHE_MAX = 5000
+SESSION_SLIDE_THRESHOLD = timedelta(days=1)
+SWEEP_INTERVAL = int(os.environ.get('AUTH_SWEEP_INTERVAL', '600'))
+SWEEP_BATCH = 1000
+SWEEP_MAX_BATCHES = 20
+
+_session_cache = {}
+_permissions_cache = {}
+_sweep_state = {'last': 0.0}
+
+
+def cache_session(token, principal, session_expires=None):
+    """Кэш токен → пользователь; отрицательный результат (None) живёт меньше"""
+    if len(_session_cache) >= SESSION_CACHE_MAX:
+        _session_cache.clear()
+    ttl = SESSION_CACHE_TTL if principal else SESSION_NEGATIVE_TTL
+    if session_expires is not None:
+        ttl = min(ttl, max((session_expires - datetime.now()).total_seconds(), 0))
+    _session_cache[token] = (time.monotonic() + ttl, principal)
+
+
+def forget_user_sessions(user_id):
+    for token in [t for t, (_, p) in _session_cache.items() if p and p['id'] == user_id]:
+        _session_cache.pop(token, None)
+
+
+def resolve_session(token):
+    """Пользователь по токену сессии: из кэша или одним запросом к БД со скользящим продлением"""
+    if token.startswith(SIGNED_TOKEN_PREFIX):
+        return resolve_signed_token(token)
+
+    cached = _session_cache.get(token)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    conn = get_db(primary=True)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT u.id, u.email, u.full_name, u.position, u.department, u.personal_code, u.qr_code, u.role,
+               u.organization, u.organization_type, s.expires_at, s.is_demo
+        FROM users u
+        JOIN sessions s ON s.user_id = u.id
+        WHERE s.token = '%s' AND s.expires_at > NOW() AND u.is_active = TRUE
+    """ % token.replace("'", "''"))
+    row = cur.fetchone()
 
+    if not row:
+        cur.close()
+        conn.close()
+        cache_session(token, None)
+        return None
+
+    expires_at = row[10]
+    if not row[11] and expires_at - datetime.now() < SESSION_SLIDE_THRESHOLD:
+        expires_at = datetime.now() + timedelta(days=SESSION_DAYS)
+        cur.execute("UPDATE sessions SET expires_at = '%s' WHERE token = '%s'" % (expires_at.isoformat(), token.replace("'", "''")))
+        conn.commit()
+
+    cur.close()
+    conn.close()
+
+    principal = {
+        'id': row[0], 'email': row[1], 'full_name': row[2],
+        'position': row[3], 'department': row[4],
+        'personal_code': row[5], 'qr_code': row[6], 'role': row[7],
+        'organization': row[8] or '', 'organization_type': row[9] or '',
+        'is_demo': row[11],
+    }
+    cache_session(token, principal, expires_at)
+    return principal
+
+
+def resolve_signed_token(token):
+    """Пользователь по подписанному токену; профиль догружается из users и кэшируется"""
+    payload = verify_signed_token(token)
+    if not payload:
+        return None
 
-def load_permissions(cur):
+    cached = _session_cache.get(token)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, email, full_name, position, department, personal_code, qr_code, role,
+               organization, organization_type
+        FROM users WHERE id = %d AND is_active = TRUE
+    """ % int(payload['uid']))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+
+    if not row:
+        cache_session(token, None)
+        return None
+
+    principal = {
+        'id': row[0], 'email': row[1], 'full_name': row[2],
+        'position': row[3], 'department': row[4],
+        'personal_code': row[5], 'qr_code': row[6], 'role': payload['role'],
+        'organization': row[8] or '', 'organization_type': row[9] or '',
+        'is_demo': payload.get('demo', False),
+    }
+    cache_session(token, principal, datetime.fromtimestamp(payload['exp']))
+    return principal
+
+
+def sweep_expired_sessions(cur, force=False):
+    """Пакетное удаление просроченных сессий, не чаще раза в SWEEP_INTERVAL на инстанс"""
+    now = time.monotonic()
+    if not force and now - _sweep_state['last'] < SWEEP_INTERVAL:
+        return 0
+    _sweep_state['last'] = now
+
+    deleted = 0
+    for _ in range(SWEEP_MAX_BATCHES):
+        cur.execute("""
+            DELETE FROM sessions WHERE id IN (
+                SELECT id FROM sessions WHERE expires_at < NOW() LIMIT %d
+            )
+        """ % SWEEP_BATCH)
+        deleted += cur.rowcount
+        if cur.rowcount < SWEEP_BATCH:
+            break
+    return deleted
+
+
+def issue_signed_token(user_id, role, is_demo, expires):
+    """Подписанный токен: id, роль, признак демо и срок действия под HMAC-SHA256"""
+    payload = {
+        'uid': user_id, 'role': role, 'demo': bool(is_demo),
+        'iat': int(time.time() * 1000), 'exp': int(expires.timestamp()),
+        'jti': secrets.token_hex(8),
+    }
+    body = b64url(json.dumps(payload, separators=(',', ':')).encode())
+    return SIGNED_TOKEN_PREFIX + body + '.' + sign_token_body(body)
+
+
+def create_session(cur, user_id, role, expires, is_demo=False):
+    """Новая сессия: подписанный токен при заданном AUTH_TOKEN_SECRET, иначе запись в sessions"""
+    if TOKEN_SECRET:
+        return issue_signed_token(user_id, role, is_demo, expires)
+    token = secrets.token_hex(32)
+    cur.execute("""
+        INSERT INTO sessions (user_id, token, expires_at, is_demo)
+        VALUES (%d, '%s', '%s', %s)
+    """ % (user_id, token, expires.isoformat(), 'TRUE' if is_demo else 'FALSE'))
+    return token
+
+
+def load_permissions(cur=None):
+    cached = _permissions_cache.get('value')
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    if cur is None:
+        conn = get_db()
+        own_cur = conn.cursor()
+        perms = load_permissions(own_cur)
+        own_cur.close()
+        conn.close()
+        return perms
     cur.execute("SELECT value FROM settings WHERE key = 'role_permissions'")
     row = cur.fetchone()
     if row:
-        return row[0] if isinstance(row[0], dict) else json.loads(row[0])
-    return DEFAULT_PERMISSIONS
+        perms = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+    else:
+        perms = DEFAULT_PERMISSIONS
+    _permissions_cache['value'] = (time.monotonic() + SESSION_CACHE_TTL, perms)
+    return perms
 
 
+@instrumented(FUNCTION_NAME)
 def handler(event, context):
     """Авторизация и управление пользователями системы Горный контроль"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -74,6 +265,9 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'POST' and action == 'register':
         return register(body)
     elif method == 'POST' and action == 'login':
@@ -85,7 +279,7 @@ def handler(event, context):
     elif method == 'POST' and action == 'logout':
         return logout(event)
     elif method == 'GET' and action == 'users':
-        return list_users(event)
+        return list_users(event, params)
     elif method == 'PUT' and action == 'role':
         return update_role(event, body)
     elif method == 'GET' and action == 'permissions':
@@ -94,6 +288,8 @@ def handler(event, context):
         return save_permissions(event, body)
     elif method == 'POST' and action == 'create-user':
         return create_user(event, body)
+    elif method == 'POST' and action == 'users-bulk':
+        return bulk_upsert_users(event, body)
     elif method == 'DELETE' and action == 'delete-user':
         return delete_user(event, body)
     elif method == 'PUT' and action == 'update-user':
@@ -112,6 +308,10 @@ def handler(event, context):
         return demo_validate(event)
     elif method == 'GET' and action == 'demo-default':
         return demo_default()
+    elif method == 'POST' and action == 'sessions-sweep':
+        return sweep_sessions(event)
+    elif method == 'GET' and action == 'hash-benchmark':
+        return hash_benchmark(event, params)
 
     return json_response(404, {'error': 'Маршрут не найден'})
 
@@ -160,12 +360,8 @@ def register(body):
     row = cur.fetchone()
     user_id = row[0]
 
-    token = secrets.token_hex(32)
-    expires = datetime.now() + timedelta(days=7)
-    cur.execute("""
-        INSERT INTO sessions (user_id, token, expires_at)
-        VALUES (%d, '%s', '%s')
-    """ % (user_id, token, expires.isoformat()))
+    expires = datetime.now() + timedelta(days=SESSION_DAYS)
+    token = create_session(cur, user_id, 'operator', expires)
 
     conn.commit()
     cur.close()
@@ -197,36 +393,38 @@ def login(body):
     conn = get_db()
     cur = conn.cursor()
 
-    password_hash = hash_password(password)
     cur.execute("""
-        SELECT id, email, full_name, position, department, personal_code, qr_code, role, is_active, organization, organization_type
-        FROM users WHERE email = '%s' AND password_hash = '%s'
-    """ % (email.replace("'", "''"), password_hash))
+        SELECT id, email, full_name, position, department, personal_code, qr_code, role, is_active, organization, organization_type,
+               password_hash
+        FROM users WHERE email = '%s'
+    """ % email.replace("'", "''"))
     row = cur.fetchone()
 
     if not row:
+        verify_password(password, dummy_password_hash())
+    if not row or not verify_password(password, row[11]):
         cur.close()
         conn.close()
         return json_response(401, {'error': 'Неверный email или пароль'})
 
+    if password_needs_rehash(row[11]):
+        cur.execute("UPDATE users SET password_hash = '%s' WHERE id = %d" % (hash_password(password), row[0]))
+
     if not row[8]:
         cur.close()
         conn.close()
         return json_response(403, {'error': 'Учётная запись отключена'})
 
     role = row[7]
-    token = secrets.token_hex(32)
-    expires = datetime.now() + timedelta(days=7)
-    cur.execute("""
-        INSERT INTO sessions (user_id, token, expires_at)
-        VALUES (%d, '%s', '%s')
-    """ % (row[0], token, expires.isoformat()))
+    expires = datetime.now() + timedelta(days=SESSION_DAYS)
+    token = create_session(cur, row[0], role, expires)
 
     if role == 'admin':
         allowed = ALL_PAGES[:]
     else:
         allowed = load_permissions(cur).get(role, DEFAULT_PERMISSIONS.get(role, ['dashboard', 'profile']))
 
+    sweep_expired_sessions(cur)
     conn.commit()
     cur.close()
     conn.close()
@@ -242,13 +440,6 @@ def login(body):
         'allowed_pages': allowed
     })
 
-def parse_qr_code(raw):
-    try:
-        data = json.loads(raw)
-        return data.get('code', raw)
-    except (json.JSONDecodeError, AttributeError):
-        return raw.strip()
-
 def login_by_code(body):
     raw_code = body.get('code', '').strip()
     code = parse_qr_code(raw_code).upper()
@@ -276,18 +467,15 @@ def login_by_code(body):
         return json_response(403, {'error': 'Учётная запись отключена'})
 
     role = row[7]
-    token = secrets.token_hex(32)
-    expires = datetime.now() + timedelta(days=7)
-    cur.execute("""
-        INSERT INTO sessions (user_id, token, expires_at)
-        VALUES (%d, '%s', '%s')
-    """ % (row[0], token, expires.isoformat()))
+    expires = datetime.now() + timedelta(days=SESSION_DAYS)
+    token = create_session(cur, row[0], role, expires)
 
     if role == 'admin':
         allowed = ALL_PAGES[:]
     else:
         allowed = load_permissions(cur).get(role, DEFAULT_PERMISSIONS.get(role, ['dashboard', 'profile']))
 
+    sweep_expired_sessions(cur)
     conn.commit()
     cur.close()
     conn.close()
@@ -308,38 +496,22 @@ def get_me(event):
     if not token:
         return json_response(401, {'error': 'Требуется авторизация'})
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT u.id, u.email, u.full_name, u.position, u.department, u.personal_code, u.qr_code, u.role, u.organization, u.organization_type
-        FROM users u
-        JOIN sessions s ON s.user_id = u.id
-        WHERE s.token = '%s' AND s.expires_at > NOW() AND u.is_active = TRUE
-    """ % token.replace("'", "''"))
-    row = cur.fetchone()
-
-    if not row:
-        cur.close()
-        conn.close()
+    principal = resolve_session(token)
+    if not principal:
         return json_response(401, {'error': 'Сессия истекла'})
 
-    role = row[7]
+    role = principal['role']
     if role == 'admin':
         allowed = ALL_PAGES[:]
     else:
-        perms = load_permissions(cur)
-        allowed = perms.get(role, DEFAULT_PERMISSIONS.get(role, ['dashboard', 'profile']))
-
-    cur.close()
-    conn.close()
+        allowed = load_permissions().get(role, DEFAULT_PERMISSIONS.get(role, ['dashboard', 'profile']))
 
     return json_response(200, {
         'user': {
-            'id': row[0], 'email': row[1], 'full_name': row[2],
-            'position': row[3], 'department': row[4],
-            'personal_code': row[5], 'qr_code': row[6], 'role': role,
-            'organization': row[8] or '', 'organization_type': row[9] or ''
+            'id': principal['id'], 'email': principal['email'], 'full_name': principal['full_name'],
+            'position': principal['position'], 'department': principal['department'],
+            'personal_code': principal['personal_code'], 'qr_code': principal['qr_code'], 'role': role,
+            'organization': principal['organization'], 'organization_type': principal['organization_type']
         },
         'allowed_pages': allowed
     })
@@ -347,9 +519,14 @@ def get_me(event):
 def logout(event):
     token = get_auth_token(event)
     if token:
+        _session_cache.pop(token, None)
+        payload = verify_signed_token(token)
         conn = get_db()
         cur = conn.cursor()
-        cur.execute("DELETE FROM sessions WHERE token = '%s'" % token.replace("'", "''"))
+        if payload:
+            revoke_token(cur, payload)
+        else:
+            cur.execute("DELETE FROM sessions WHERE token = '%s'" % token.replace("'", "''"))
         conn.commit()
         cur.close()
         conn.close()
@@ -361,34 +538,114 @@ def get_current_user(event):
     token = get_auth_token(event)
     if not token:
         return None
+    principal = resolve_session(token)
+    if not principal:
+        return None
+    return {'id': principal['id'], 'role': principal['role']}
+
+
+def sweep_sessions(event):
+    caller = get_current_user(event)
+    if not caller or caller['role'] != 'admin':
+        return json_response(403, {'error': 'Доступ только для администраторов'})
+
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT u.id, u.role FROM users u
-        JOIN sessions s ON s.user_id = u.id
-        WHERE s.token = '%s' AND s.expires_at > NOW() AND u.is_active = TRUE
-    """ % token.replace("'", "''"))
-    row = cur.fetchone()
+    deleted = sweep_expired_sessions(cur, force=True)
+    conn.commit()
     cur.close()
     conn.close()
-    if not row:
-        return None
-    return {'id': row[0], 'role': row[1]}
 
+    return json_response(200, {'message': 'Удалено просроченных сессий: %d' % deleted, 'deleted': deleted})
+
+
+def hash_benchmark(event, params):
+    """Замер стоимости хэширования на этом окружении для подбора AUTH_SCRYPT_N / AUTH_PBKDF2_ITERATIONS.
+
+    Возвращает время текущих настроек и ряд удвоений стоимости до бюджета target_ms.
+    """
+    caller = get_current_user(event)
+    if not caller or caller['role'] != 'admin':
+        return json_response(403, {'error': 'Доступ только для администраторов'})
+
+    target_ms = min(max(int(params.get('target_ms', 250) or 250), 10), 2000)
+    salt = secrets.token_bytes(16)
+
+    def measure(cost):
+        started = time.perf_counter()
+        if PASSWORD_SCHEME == 'pbkdf2':
+            hashlib.pbkdf2_hmac('sha256', b'benchmark', salt, cost)
+        else:
+            scrypt_digest('benchmark', salt, cost, SCRYPT_R, SCRYPT_P)
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    current = PBKDF2_ITERATIONS if PASSWORD_SCHEME == 'pbkdf2' else SCRYPT_N
+    ladder = []
+    cost = 100000 if PASSWORD_SCHEME == 'pbkdf2' else 4096
+    while True:
+        ms = measure(cost)
+        ladder.append({'cost': cost, 'ms': ms})
+        if ms * 2 > target_ms or len(ladder) >= 8:
+            break
+        cost *= 2
+    within = [step['cost'] for step in ladder if step['ms'] <= target_ms]
+
+    return json_response(200, {
+        'scheme': PASSWORD_SCHEME,
+        'current_cost': current,
+        'current_ms': min(measure(current) for _ in range(3)),
+        'target_ms': target_ms,
+        'ladder': ladder,
+        'recommended_cost': within[-1] if within else ladder[0]['cost']
+    })
+
+
+USERS_PAGE_MAX = 200
 
-def list_users(event):
+
+def list_users(event, params):
+    """Список пользователей с фильтрами q, role, is_active, organization.
+
+    Постранично при заданных page/per_page, иначе — целиком, как раньше.
+    """
     caller = get_current_user(event)
     if not caller or caller['role'] != 'admin':
         return json_response(403, {'error': 'Доступ только для администраторов'})
 
+    where = "WHERE 1=1"
+    q = params.get('q', '').strip()
+    if q:
+        safe = q.replace("'", "''").replace('%', '\\%').replace('_', '\\_')
+        where += " AND (full_name ILIKE '%%%s%%' OR email ILIKE '%%%s%%' OR personal_code ILIKE '%%%s%%')" % (safe, safe, safe)
+    role = params.get('role', '')
+    if role in VALID_ROLES:
+        where += " AND role = '%s'" % role
+    if params.get('is_active') in ('true', 'false'):
+        where += " AND is_active = %s" % params['is_active'].upper()
+    organization = params.get('organization', '').strip()
+    if organization:
+        where += " AND organization = '%s'" % organization.replace("'", "''")
+
+    paged = 'page' in params or 'per_page' in params
+    page = max(int(params.get('page', 1) or 1), 1)
+    per_page = min(max(int(params.get('per_page', 50) or 50), 1), USERS_PAGE_MAX)
+    limit = " LIMIT %d OFFSET %d" % (per_page, (page - 1) * per_page) if paged else ''
+
     conn = get_db()
     cur = conn.cursor()
     cur.execute("""
         SELECT id, email, full_name, position, department, personal_code, role, is_active, organization, organization_type,
-               created_at
-        FROM users ORDER BY id
-    """)
+               created_at, COUNT(*) OVER ()
+        FROM users %s ORDER BY id%s
+    """ % (where, limit))
     rows = cur.fetchall()
+    if rows:
+        total = rows[0][11]
+    elif paged and page > 1:
+        cur.execute("SELECT COUNT(*) FROM users %s" % where)
+        total = cur.fetchone()[0]
+    else:
+        total = 0
     cur.close()
     conn.close()
 
@@ -403,7 +660,17 @@ def list_users(event):
             'created_at': r[10]
         })
 
-    return json_response(200, {'users': users})
+    result = {'users': users, 'total': total}
+    if paged:
+        result.update({'page': page, 'per_page': per_page, 'pages': (total + per_page - 1) // per_page})
+    return json_response(200, result)
+
+
+ROLE_LABELS = {
+    'admin': 'Администратор', 'operator': 'Оператор',
+    'dispatcher': 'Диспетчер', 'doctor': 'Врач',
+    'aho_specialist': 'Специалист АХО', 'security': 'СБ'
+}
 
 
 def update_role(event, body):
@@ -437,18 +704,14 @@ def update_role(event, body):
         return json_response(403, {'error': 'Нельзя изменять роль администратора'})
 
     cur.execute("UPDATE users SET role = '%s' WHERE id = %d" % (new_role, int(user_id)))
+    revoke_user_tokens(cur, 'id = %d' % int(user_id))
     conn.commit()
+    forget_user_sessions(int(user_id))
     cur.close()
     conn.close()
 
-    role_labels = {
-        'admin': 'Администратор', 'operator': 'Оператор',
-        'dispatcher': 'Диспетчер', 'doctor': 'Врач',
-        'aho_specialist': 'Специалист АХО', 'security': 'СБ'
-    }
-
     return json_response(200, {
-        'message': 'Роль изменена: %s → %s' % (role_labels.get(old_role, old_role), role_labels.get(new_role, new_role)),
+        'message': 'Роль изменена: %s → %s' % (ROLE_LABELS.get(old_role, old_role), ROLE_LABELS.get(new_role, new_role)),
         'user_id': int(user_id),
         'old_role': old_role,
         'new_role': new_role
@@ -488,6 +751,7 @@ def save_permissions(event, body):
         ON CONFLICT (key) DO UPDATE SET value = '%s'::jsonb, updated_at = NOW()
     """ % (perms_json.replace("'", "''"), perms_json.replace("'", "''")))
     conn.commit()
+    _permissions_cache.clear()
     cur.close()
     conn.close()
 
@@ -575,6 +839,237 @@ def create_user(event, body):
     })
 
 
+USERS_BULK_MAX = 1000
+USERS_BULK_PASSWORD_MAX = int(os.environ.get('AUTH_USERS_BULK_PASSWORD_MAX', '100'))
+USER_PROFILE_FIELDS = ['full_name', 'position', 'department', 'role', 'organization', 'organization_type']
+
+USER_IMPORT_HEADERS = {
+    'фио': 'full_name', 'ф.и.о': 'full_name', 'ф.и.о.': 'full_name', 'full_name': 'full_name',
+    'email': 'email', 'e-mail': 'email', 'почта': 'email',
+    'пароль': 'password', 'password': 'password',
+    'роль': 'role', 'role': 'role',
+    'должность': 'position', 'position': 'position',
+    'подразделение': 'department', 'отдел': 'department', 'department': 'department',
+    'организация': 'organization', 'organization': 'organization',
+    'тип организации': 'organization_type', 'organization_type': 'organization_type',
+    'личный номер': 'personal_code', 'личный код': 'personal_code', 'personal_code': 'personal_code',
+}
+
+
+def parse_user_rows(body):
+    """Строки пользователей: JSON-массив users либо файл CSV/XLSX в base64 (file, file_name)"""
+    if isinstance(body.get('users'), list):
+        return body['users']
+    if not body.get('file'):
+        return []
+
+    file_bytes = base64.b64decode(body['file'])
+    if body.get('file_name', '').lower().endswith('.xlsx'):
+        import openpyxl
+        from io import BytesIO
+        wb = openpyxl.load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
+        table = [list(row) for row in wb.active.iter_rows(values_only=True)]
+        wb.close()
+    else:
+        import csv
+        from io import StringIO
+        text = file_bytes.decode('utf-8-sig')
+        first_line = text.split('\n', 1)[0]
+        delimiter = ';' if first_line.count(';') > first_line.count(',') else ','
+        table = list(csv.reader(StringIO(text), delimiter=delimiter))
+
+    if not table:
+        return []
+    headers = [USER_IMPORT_HEADERS.get(str(cell or '').strip().lower(), '') for cell in table[0]]
+    rows = []
+    for raw in table[1:]:
+        if all(cell is None or str(cell).strip() == '' for cell in raw):
+            continue
+        rows.append({h: str(cell or '').strip() for h, cell in zip(headers, raw) if h})
+    return rows
+
+
+def sql_text(value):
+    return "'%s'" % value.replace("'", "''") if value else 'NULL'
+
+
+def bulk_upsert_users(event, body):
+    """Массовое заведение пользователей: вставка новых и обновление найденных по email или личному номеру.
+
+    Всё применяется в одной транзакции: одна вставка и одно обновление на весь набор.
+    В ответе — результат по каждой строке в исходном порядке. Строк с паролем не больше
+    USERS_BULK_PASSWORD_MAX: хэш scrypt стоит ~50 мс, и тысяча паролей не уложилась бы в таймаут функции.
+    """
+    caller = get_current_user(event)
+    if not caller or caller['role'] != 'admin':
+        return json_response(403, {'error': 'Доступ только для администраторов'})
+
+    try:
+        rows = parse_user_rows(body)
+    except Exception as e:
+        return json_response(400, {'error': 'Ошибка чтения файла: ' + str(e)[:100]})
+    if not rows:
+        return json_response(400, {'error': 'Нет пользователей для загрузки'})
+    if len(rows) > USERS_BULK_MAX:
+        return json_response(400, {'error': 'Не более %d пользователей за раз' % USERS_BULK_MAX})
+    with_password = sum(1 for row in rows if isinstance(row, dict) and str(row.get('password') or '').strip())
+    if with_password > USERS_BULK_PASSWORD_MAX:
+        return json_response(400, {'error': 'Не более %d строк с паролем за раз (в файле %d) — разбейте загрузку на части'
+                                            % (USERS_BULK_PASSWORD_MAX, with_password)})
+
+    results = [None] * len(rows)
+    items = []
+    seen = set()
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict):
+            results[i] = {'row': i + 1, 'status': 'error', 'error': 'Строка должна быть объектом с полями пользователя'}
+            continue
+        email = str(row.get('email') or '').strip().lower()
+        code = str(row.get('personal_code') or '').strip()
+        role = str(row.get('role') or '').strip()
+        if not email and not code:
+            results[i] = {'row': i + 1, 'status': 'error', 'error': 'Нужен email или личный номер'}
+        elif role and role not in VALID_ROLES:
+            results[i] = {'row': i + 1, 'email': email, 'status': 'error', 'error': 'Недопустимая роль'}
+        elif (email and ('e', email) in seen) or (code and ('c', code) in seen):
+            results[i] = {'row': i + 1, 'email': email, 'status': 'error', 'error': 'Повтор в загружаемом списке'}
+        else:
+            seen.update([('e', email)] if email else [])
+            seen.update([('c', code)] if code else [])
+            items.append((i, email, code, row))
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    emails = [email for _, email, _, _ in items if email]
+    codes = [code for _, _, code, _ in items if code]
+    cur.execute("""
+        SELECT id, email, personal_code, role FROM users
+        WHERE LOWER(email) = ANY(ARRAY[%s]::text[]) OR personal_code = ANY(ARRAY[%s]::text[])
+    """ % (','.join(sql_text(e) for e in emails), ','.join(sql_text(c) for c in codes)))
+    existing = cur.fetchall()
+    by_email = {(r[1] or '').lower(): r for r in existing}
+    by_code = {r[2]: r for r in existing}
+
+    creates = []
+    updates = []
+    touched = set()
+    for i, email, code, row in items:
+        target = by_email.get(email) or by_code.get(code)
+        if target:
+            if target[0] in touched:
+                results[i] = {'row': i + 1, 'email': email, 'status': 'error', 'error': 'Повтор в загружаемом списке'}
+                continue
+            if target[3] == 'admin' and target[0] != caller['id']:
+                results[i] = {'row': i + 1, 'email': email, 'status': 'error', 'error': 'Нельзя изменять данные администратора'}
+                continue
+            touched.add(target[0])
+            fields = {f: str(row[f]).strip() for f in USER_PROFILE_FIELDS if str(row.get(f) or '').strip()}
+            if email and email != (target[1] or '').lower() and email not in by_email:
+                fields['email'] = email
+            if row.get('password'):
+                fields['password_hash'] = hash_password(str(row['password']))
+            updates.append((i, target, fields))
+        else:
+            if not row.get('full_name') or not email or not row.get('password'):
+                results[i] = {'row': i + 1, 'email': email, 'status': 'error',
+                              'error': 'Для нового пользователя нужны ФИО, email и пароль'}
+                continue
+            creates.append((i, email, code, row))
+
+    if creates:
+        names = [str(row['full_name']).strip().lower() for _, _, code, row in creates if not code]
+        known = {}
+        if names:
+            cur.execute("""
+                SELECT DISTINCT ON (LOWER(TRIM(full_name))) LOWER(TRIM(full_name)), personal_code, qr_code
+                FROM personnel WHERE LOWER(TRIM(full_name)) = ANY(ARRAY[%s]::text[])
+                ORDER BY LOWER(TRIM(full_name)), id
+            """ % ','.join(sql_text(n) for n in names))
+            known = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+        cur.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users")
+        next_id = cur.fetchone()[0]
+
+        planned = []
+        for i, email, code, row in creates:
+            if code:
+                qr_code = None
+            elif str(row['full_name']).strip().lower() in known:
+                code, qr_code = known[str(row['full_name']).strip().lower()]
+            else:
+                code, qr_code = 'УС-%03d' % next_id, 'QR-US-%03d' % next_id
+                next_id += 1
+            planned.append((i, email, code, qr_code, row))
+
+        cur.execute("SELECT personal_code FROM users WHERE personal_code = ANY(ARRAY[%s]::text[])"
+                    % ','.join(sql_text(p[2]) for p in planned))
+        taken = {r[0] for r in cur.fetchall()}
+        values = []
+        inserted = {}
+        for i, email, code, qr_code, row in planned:
+            if code in taken:
+                results[i] = {'row': i + 1, 'email': email, 'status': 'error',
+                              'error': 'Пользователь с таким личным номером уже существует'}
+                continue
+            taken.add(code)
+            inserted[email] = i
+            values.append("(%s, '%s', %s, %s, %s, %s, %s, '%s', %s, %s)" % (
+                sql_text(email), hash_password(str(row['password'])), sql_text(str(row['full_name']).strip()),
+                sql_text(str(row.get('position') or '').strip()), sql_text(str(row.get('department') or '').strip()),
+                sql_text(code), sql_text(qr_code or ''),
+                str(row.get('role') or '').strip() or 'operator',
+                sql_text(str(row.get('organization') or '').strip()),
+                sql_text(str(row.get('organization_type') or '').strip())
+            ))
+        if values:
+            cur.execute("""
+                INSERT INTO users (email, password_hash, full_name, position, department, personal_code, qr_code,
+                                   role, organization, organization_type)
+                SELECT email, password_hash, full_name, COALESCE(position, ''), COALESCE(department, ''),
+                       personal_code, qr_code, role, COALESCE(organization, ''), COALESCE(organization_type, '')
+                FROM (VALUES %s) v(email, password_hash, full_name, position, department, personal_code, qr_code,
+                                   role, organization, organization_type)
+                RETURNING id, email, personal_code
+            """ % ', '.join(values))
+            for user_id, email, code in cur.fetchall():
+                i = inserted[email]
+                results[i] = {'row': i + 1, 'email': email, 'status': 'created', 'id': user_id, 'personal_code': code}
+
+    revoked = []
+    changed = [(i, target, fields) for i, target, fields in updates if fields]
+    if changed:
+        columns = USER_PROFILE_FIELDS + ['email', 'password_hash']
+        cur.execute("""
+            UPDATE users u SET %s, updated_at = NOW()
+            FROM (VALUES %s) v(id, %s)
+            WHERE u.id = v.id
+        """ % (
+            ', '.join('%s = COALESCE(v.%s, u.%s)' % (c, c, c) for c in columns),
+            ', '.join('(%d, %s)' % (target[0], ', '.join(sql_text(fields.get(c, '')) + '::text' for c in columns))
+                      for _, target, fields in changed),
+            ', '.join(columns)
+        ))
+        for _, target, fields in changed:
+            if target[0] != caller['id'] and ('role' in fields or 'password_hash' in fields):
+                revoke_user_tokens(cur, 'id = %d' % target[0])
+                revoked.append(target[0])
+    for i, target, fields in updates:
+        results[i] = {'row': i + 1, 'email': fields.get('email', target[1]),
+                      'status': 'updated' if fields else 'unchanged', 'id': target[0]}
+
+    conn.commit()
+    for user_id in revoked:
+        forget_user_sessions(user_id)
+    cur.close()
+    conn.close()
+
+    summary = {}
+    for r in results:
+        summary[r['status']] = summary.get(r['status'], 0) + 1
+
+    return json_response(200, {'total': len(rows), 'summary': summary, 'results': results})
+
+
 def delete_user(event, body):
     caller = get_current_user(event)
     if not caller or caller['role'] != 'admin':
@@ -604,8 +1099,10 @@ def delete_user(event, body):
 
     name = row[1]
     cur.execute("DELETE FROM sessions WHERE user_id = %d" % int(user_id))
+    revoke_user_tokens(cur, 'id = %d' % int(user_id))
     cur.execute("UPDATE users SET is_active = FALSE, email = email || '_deleted_' || '%d' WHERE id = %d" % (int(user_id), int(user_id)))
     conn.commit()
+    forget_user_sessions(int(user_id))
     cur.close()
     conn.close()
 
@@ -662,7 +1159,10 @@ def update_user(event, body):
         return json_response(400, {'error': 'Нечего обновлять'})
 
     cur.execute("UPDATE users SET %s WHERE id = %d" % (', '.join(updates), int(user_id)))
+    if int(user_id) != caller['id'] and any(f in body for f in ('role', 'is_active', 'password')):
+        revoke_user_tokens(cur, 'id = %d' % int(user_id))
     conn.commit()
+    forget_user_sessions(int(user_id))
     cur.close()
     conn.close()
 
@@ -811,16 +1311,17 @@ def demo_enter(body):
 
     cur.execute("UPDATE demo_links SET visit_count = visit_count + 1 WHERE id = %d" % row[0])
 
-    session_token = secrets.token_hex(32)
+    cur.execute("SELECT id FROM users WHERE role = 'admin' AND is_active = TRUE ORDER BY id LIMIT 1")
+    admin_row = cur.fetchone()
+    if not admin_row:
+        cur.close()
+        conn.close()
+        return json_response(503, {'error': 'Демо-доступ временно недоступен'})
+
     expires = datetime.now() + timedelta(hours=24)
-    cur.execute("""
-        INSERT INTO sessions (user_id, token, expires_at, is_demo)
-        VALUES (
-            (SELECT id FROM users WHERE role = 'admin' AND is_active = TRUE ORDER BY id LIMIT 1),
-            '%s', '%s', TRUE
-        )
-    """ % (session_token, expires.isoformat()))
+    session_token = create_session(cur, admin_row[0], 'admin', expires, is_demo=True)
 
+    sweep_expired_sessions(cur)
     conn.commit()
     cur.close()
     conn.close()
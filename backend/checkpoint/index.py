@@ -1,36 +1,13 @@
 import json
-import os
-from datetime import datetime, date as date_type
-import psycopg2
-
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+from datetime import datetime, timezone
+from core import CATEGORY_LABELS, ORG_TYPE_LABELS, get_db, instrumented, json_response, is_demo_request, parse_qr_code, idempotent, run_batch, scan_auth_error, journal_stats
 
+FUNCTION_NAME = 'checkpoint'
+READ_ACTIONS = ('journal', 'stats', 'on-site', 'export')
+
+SCAN_ROLES = ('admin', 'checkpoint_officer', 'security')
+
+@instrumented(FUNCTION_NAME, READ_ACTIONS)
 def handler(event, context):
     """КПП — фиксация входа/выхода через сканер, журнал проходов, связь с АХО"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -41,8 +18,19 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'POST' and action == 'pass':
-        return register_pass(body)
+        denied = scan_auth_error(event, SCAN_ROLES)
+        if denied:
+            return denied
+        return idempotent(event, body, 'checkpoint.pass', register_pass)
+    elif method == 'POST' and action == 'pass-batch':
+        denied = scan_auth_error(event, SCAN_ROLES)
+        if denied:
+            return denied
+        return register_pass_batch(body)
     elif method == 'GET' and action == 'journal':
         return get_journal(params, event)
     elif method == 'GET' and action == 'stats':
@@ -54,146 +42,246 @@ def handler(event, context):
 
     return json_response(404, {'error': 'Маршрут не найден'})
 
-def parse_qr_code(raw):
-    try:
-        data = json.loads(raw)
-        return data.get('code', raw)
-    except (json.JSONDecodeError, AttributeError):
-        return raw.strip()
-
-def register_pass(body):
-    raw_code = body.get('code', '').strip()
-    direction = body.get('direction', 'in')
-    checkpoint_name = body.get('checkpoint_name', 'КПП-1')
-    notes = body.get('notes', '')
-
-    if not raw_code:
-        return json_response(400, {'error': 'Код не указан'})
-    if direction not in ('in', 'out'):
-        return json_response(400, {'error': 'direction должен быть in или out'})
+def apply_pass(cur, code, direction, checkpoint_name, notes, scanned_at=None, client_key=None):
+    """Фиксирует проход одним выражением: поиск сотрудника, запись прохода, статусы, койка, событие.
 
-    code = parse_qr_code(raw_code)
+    scanned_at — время сканирования для проходов, пришедших с терминала с опозданием,
+    client_key — ключ идемпотентности терминала. Статусы сотрудника и заезда меняет только
+    проход новее последнего учтённого: досланный старый скан попадает лишь в журнал.
+    Возвращает (http-статус, тело ответа); коммит остаётся за вызывающим.
+    """
     safe_code = code.replace("'", "''")
+    safe_checkpoint = checkpoint_name.replace("'", "''")
+    safe_notes = notes.replace("'", "''")
+    ts = "'%s'::timestamp" % scanned_at.isoformat() if scanned_at else 'NOW()'
+    key = "'%s'" % client_key.replace("'", "''") if client_key else 'NULL'
 
-    conn = get_db()
-    cur = conn.cursor()
+    if direction == 'in':
+        new_status = 'arrived'
+        arrival_update = """arr AS (
+            UPDATE aho_arrivals SET arrival_status = 'arrived', check_in_at = %s, updated_at = NOW()
+            WHERE personnel_id IN (SELECT id FROM decision WHERE allowed AND latest)
+              AND arrival_status = 'expected' AND is_hidden = FALSE
+            RETURNING id
+        )""" % ts
+        event_desc = "'КПП: ' || d.full_name || ' — вход через %s'" % safe_checkpoint
+    else:
+        new_status = 'departed'
+        arrival_update = """dep AS (
+            UPDATE aho_arrivals SET arrival_status = 'departed', check_out_at = %s, updated_at = NOW()
+            WHERE personnel_id IN (SELECT id FROM decision WHERE allowed AND latest)
+              AND arrival_status = 'arrived' AND is_hidden = FALSE
+            RETURNING id
+        ), rel AS (
+            UPDATE room_occupancy o SET released_at = NOW()
+            FROM dep WHERE o.arrival_id = dep.id AND o.released_at IS NULL
+            RETURNING o.room_id
+        ), beds AS (
+            UPDATE rooms r SET occupied = GREATEST(r.occupied - c.cnt, 0), updated_at = NOW()
+            FROM (SELECT room_id, COUNT(*) AS cnt FROM rel GROUP BY room_id) c
+            WHERE r.id = c.room_id
+            RETURNING r.id
+        )""" % ts
+        event_desc = "'КПП: ' || d.full_name || ' — выход через %s'" % safe_checkpoint
 
     cur.execute("""
-        SELECT p.id, p.personal_code, p.full_name, p.position, p.department,
-               p.category, p.status, p.medical_status, p.organization, p.organization_type
-        FROM personnel p
-        WHERE (p.personal_code = '%s' OR p.qr_code = '%s') AND p.is_hidden = FALSE
-        LIMIT 1
-    """ % (safe_code, safe_code))
+        WITH person AS (
+            SELECT p.id, p.personal_code, p.full_name, p.position, p.department,
+                   p.category, p.organization, p.organization_type,
+                   COALESCE(p.medical_status IN ('passed', 'expiring'), FALSE) AS medical_ok, p.is_demo_data
+            FROM personnel p
+            WHERE (p.personal_code = '%(code)s' OR p.qr_code = '%(code)s') AND p.is_hidden = FALSE
+            LIMIT 1
+            FOR UPDATE
+        ), decision AS (
+            SELECT person.*, %(allowed)s AS allowed,
+                   NOT EXISTS (
+                       SELECT 1 FROM checkpoint_passes cp
+                       WHERE cp.personnel_id = person.id AND cp.created_at > %(ts)s
+                         AND (cp.direction = 'out' OR cp.medical_ok)
+                   ) AS latest
+            FROM person
+        ), pass AS (
+            INSERT INTO checkpoint_passes (personnel_id, personal_code, full_name, direction, checkpoint_name,
+                                           medical_ok, notes, created_at, client_key, is_demo_data)
+            SELECT id, '%(code)s', full_name, '%(direction)s', '%(checkpoint)s', medical_ok,
+                   CASE WHEN allowed THEN '%(notes)s' ELSE 'ОТКАЗ: медосмотр не пройден' END,
+                   %(ts)s, %(key)s, is_demo_data
+            FROM decision
+            RETURNING id
+        ), pers AS (
+            UPDATE personnel p SET status = '%(status)s', updated_at = NOW()
+            FROM decision d WHERE p.id = d.id AND d.allowed AND d.latest
+            RETURNING p.id
+        ), %(arrival_update)s, ev AS (
+            INSERT INTO events (event_type, description, personnel_id, created_at)
+            SELECT CASE WHEN d.allowed THEN 'checkpoint_%(direction)s' ELSE 'checkpoint_denied' END,
+                   CASE WHEN d.allowed THEN %(event_desc)s
+                        ELSE 'КПП: ' || d.full_name || ' — ОТКАЗ во входе (медосмотр)' END,
+                   d.id, %(ts)s
+            FROM decision d
+            RETURNING id
+        )
+        SELECT d.id, d.personal_code, d.full_name, d.position, d.department,
+               d.category, d.organization, d.organization_type, d.medical_ok, d.allowed,
+               (SELECT id FROM pass)
+        FROM decision d
+    """ % {
+        'code': safe_code, 'direction': direction, 'checkpoint': safe_checkpoint,
+        'notes': safe_notes, 'status': new_status, 'arrival_update': arrival_update,
+        'event_desc': event_desc, 'allowed': 'medical_ok' if direction == 'in' else 'TRUE',
+        'ts': ts, 'key': key
+    })
     row = cur.fetchone()
 
     if not row:
-        cur.close()
-        conn.close()
-        return json_response(404, {'error': 'Сотрудник с кодом %s не найден' % code})
+        return 404, {'error': 'Сотрудник с кодом %s не найден' % code}
 
-    person_id = row[0]
     person_name = row[2]
-    safe_name = person_name.replace("'", "''")
-    medical_ok = row[7] in ('passed', 'expiring')
-
-    if direction == 'in' and not medical_ok:
-        cur.execute("""
-            INSERT INTO checkpoint_passes (personnel_id, personal_code, full_name, direction, checkpoint_name, medical_ok, notes)
-            VALUES (%d, '%s', '%s', 'in', '%s', FALSE, 'ОТКАЗ: медосмотр не пройден')
-        """ % (person_id, safe_code, safe_name, checkpoint_name.replace("'", "''")))
+    medical_ok = row[8]
 
-        cur.execute("""
-            INSERT INTO events (event_type, description, personnel_id)
-            VALUES ('checkpoint_denied', 'КПП: %s — ОТКАЗ во входе (медосмотр)', %d)
-        """ % (safe_name, person_id))
-
-        conn.commit()
-        cur.close()
-        conn.close()
-
-        return json_response(200, {
+    if not row[9]:
+        return 200, {
             'result': 'denied',
+            'pass_id': row[10],
             'message': 'ОТКАЗ: медосмотр не пройден',
             'person_name': person_name,
             'medical_ok': False,
             'direction': direction
-        })
+        }
 
-    cur.execute("""
-        INSERT INTO checkpoint_passes (personnel_id, personal_code, full_name, direction, checkpoint_name, medical_ok, notes)
-        VALUES (%d, '%s', '%s', '%s', '%s', %s, '%s')
-        RETURNING id
-    """ % (person_id, safe_code, safe_name, direction, checkpoint_name.replace("'", "''"),
-           'TRUE' if medical_ok else 'FALSE', notes.replace("'", "''")))
-    pass_id = cur.fetchone()[0]
+    return 200, {
+        'result': 'allowed',
+        'pass_id': row[10],
+        'message': 'Вход зафиксирован' if direction == 'in' else 'Выход зафиксирован',
+        'direction': direction,
+        'person_name': person_name,
+        'medical_ok': medical_ok,
+        'person': {
+            'id': row[0],
+            'personal_code': row[1],
+            'full_name': row[2],
+            'position': row[3] or '—',
+            'department': row[4] or '—',
+            'category': CATEGORY_LABELS.get(row[5], row[5]),
+            'organization': row[6] or '—',
+            'organization_type': ORG_TYPE_LABELS.get(row[7] or '', row[7] or '—')
+        }
+    }
 
-    if direction == 'in':
-        new_status = 'arrived'
-        event_type = 'checkpoint_in'
-        event_desc = 'КПП: %s — вход через %s' % (safe_name, checkpoint_name.replace("'", "''"))
+def register_pass(body):
+    raw_code = body.get('code', '').strip()
+    direction = body.get('direction', 'in')
+    checkpoint_name = body.get('checkpoint_name', 'КПП-1')
+    notes = body.get('notes', '')
 
-        cur.execute("""
-            UPDATE personnel SET status = 'arrived', updated_at = NOW() WHERE id = %d
-        """ % person_id)
+    if not raw_code:
+        return json_response(400, {'error': 'Код не указан'})
+    if direction not in ('in', 'out'):
+        return json_response(400, {'error': 'direction должен быть in или out'})
 
-        cur.execute("""
-            UPDATE aho_arrivals SET arrival_status = 'arrived', check_in_at = NOW(), updated_at = NOW()
-            WHERE personnel_id = %d AND arrival_status = 'expected' AND is_hidden = FALSE
-        """ % person_id)
+    code = parse_qr_code(raw_code)
 
-    else:
-        new_status = 'departed'
-        event_type = 'checkpoint_out'
-        event_desc = 'КПП: %s — выход через %s' % (safe_name, checkpoint_name.replace("'", "''"))
+    conn = get_db()
+    cur = conn.cursor()
 
-        cur.execute("""
-            UPDATE personnel SET status = 'departed', updated_at = NOW() WHERE id = %d
-        """ % person_id)
+    status, result = apply_pass(cur, code, direction, checkpoint_name, notes)
 
-        cur.execute("""
-            UPDATE aho_arrivals SET arrival_status = 'departed', check_out_at = NOW(), updated_at = NOW()
-            WHERE personnel_id = %d AND arrival_status = 'arrived' AND is_hidden = FALSE
-        """ % person_id)
+    conn.commit()
+    cur.close()
+    conn.close()
 
-    cur.execute("""
-        INSERT INTO events (event_type, description, personnel_id)
-        VALUES ('%s', '%s', %d)
-    """ % (event_type, event_desc, person_id))
+    return json_response(status, result)
+
+PASS_BATCH_MAX = 1000
+
+def parse_scanned_at(value):
+    """Время сканирования терминала в UTC без зоны, как хранятся метки в журнале"""
+    ts = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+def register_pass_batch(body):
+    """Приём накопленных терминалом КПП проходов после восстановления связи.
+
+    Сканы применяются в одной транзакции в порядке времени сканирования. Каждый скан несёт
+    клиентский ключ key: уже принятые ключи не применяются повторно и возвращаются как duplicate.
+    """
+    import psycopg2
+
+    scans = body.get('scans') or []
+    default_checkpoint = body.get('checkpoint_name', 'КПП-1')
+
+    if not isinstance(scans, list) or not scans:
+        return json_response(400, {'error': 'Нет проходов для загрузки'})
+    if len(scans) > PASS_BATCH_MAX:
+        return json_response(400, {'error': 'Не более %d проходов за раз' % PASS_BATCH_MAX})
+
+    results = [None] * len(scans)
+    queue = []
+    for i, scan in enumerate(scans):
+        if not isinstance(scan, dict):
+            results[i] = {'key': '', 'status': 'error', 'error': 'Скан должен быть объектом'}
+            continue
+        key = str(scan.get('key') or '').strip()
+        raw_code = str(scan.get('code') or '').strip()
+        direction = scan.get('direction', 'in')
+        if not key:
+            results[i] = {'key': key, 'status': 'error', 'error': 'Не указан key'}
+        elif not raw_code:
+            results[i] = {'key': key, 'status': 'error', 'error': 'Код не указан'}
+        elif direction not in ('in', 'out'):
+            results[i] = {'key': key, 'status': 'error', 'error': 'direction должен быть in или out'}
+        else:
+            try:
+                scanned_at = parse_scanned_at(scan.get('scanned_at')) if scan.get('scanned_at') else None
+            except ValueError:
+                results[i] = {'key': key, 'status': 'error', 'error': 'Некорректное время scanned_at'}
+                continue
+            queue.append((scanned_at or datetime.utcnow(), i, key, parse_qr_code(raw_code), direction, scan))
+    queue.sort(key=lambda item: (item[0], item[1]))
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    keys = list({item[2] for item in queue})
+    seen = {}
+    if keys:
+        cur.execute("""
+            SELECT client_key, id FROM checkpoint_passes WHERE client_key = ANY(ARRAY[%s])
+        """ % ','.join("'%s'" % k.replace("'", "''") for k in keys))
+        seen = dict(cur.fetchall())
+
+    for scanned_at, i, key, code, direction, scan in queue:
+        if key in seen:
+            results[i] = {'key': key, 'status': 'duplicate', 'pass_id': seen[key]}
+            continue
+        cur.execute("SAVEPOINT scan")
+        try:
+            status, result = apply_pass(cur, code, direction, scan.get('checkpoint_name') or default_checkpoint,
+                                        scan.get('notes', ''), scanned_at=scanned_at, client_key=key)
+        except psycopg2.IntegrityError:
+            cur.execute("ROLLBACK TO SAVEPOINT scan")
+            results[i] = {'key': key, 'status': 'duplicate'}
+            continue
+        cur.execute("RELEASE SAVEPOINT scan")
+        if status == 200:
+            seen[key] = result['pass_id']
+            results[i] = {'key': key, 'status': result['result'], 'pass_id': result.get('pass_id'),
+                          'person_name': result['person_name'], 'direction': direction}
+        else:
+            results[i] = {'key': key, 'status': 'not_found', 'error': result['error']}
 
     conn.commit()
     cur.close()
     conn.close()
 
-    category_labels = {
-        'mine': 'Рудничный', 'contractor': 'Подрядчик',
-        'business_trip': 'Командированный', 'guest': 'Гость'
-    }
-    org_type_labels = {
-        'rudnik': 'Рудник', 'guest': 'Гость',
-        'contractor': 'Подрядная организация', 'gov': 'Гос.органы'
-    }
-
-    dir_label = 'Вход зафиксирован' if direction == 'in' else 'Выход зафиксирован'
+    summary = {}
+    for r in results:
+        summary[r['status']] = summary.get(r['status'], 0) + 1
 
-    return json_response(200, {
-        'result': 'allowed',
-        'pass_id': pass_id,
-        'message': dir_label,
-        'direction': direction,
-        'person_name': person_name,
-        'medical_ok': medical_ok,
-        'person': {
-            'id': row[0],
-            'personal_code': row[1],
-            'full_name': row[2],
-            'position': row[3] or '—',
-            'department': row[4] or '—',
-            'category': category_labels.get(row[5], row[5]),
-            'organization': row[8] or '—',
-            'organization_type': org_type_labels.get(row[9] or '', row[9] or '—')
-        }
-    })
+    return json_response(200, {'total': len(scans), 'summary': summary, 'results': results})
 
 def get_journal(params, event):
     date_from = params.get('date_from', '')
@@ -255,44 +343,29 @@ def get_stats(event):
     conn = get_db()
     cur = conn.cursor()
 
-    demo_val = 'TRUE' if is_demo_request(event) else 'FALSE'
-    demo_join = "JOIN personnel p ON cp.personnel_id = p.id AND p.is_demo_data = %s" % demo_val
-
-    cur.execute("SELECT COUNT(*) FROM checkpoint_passes cp %s WHERE cp.direction = 'in' AND cp.created_at::date = CURRENT_DATE" % demo_join)
-    today_in = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM checkpoint_passes cp %s WHERE cp.direction = 'out' AND cp.created_at::date = CURRENT_DATE" % demo_join)
-    today_out = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM checkpoint_passes cp %s WHERE cp.medical_ok = FALSE AND cp.created_at::date = CURRENT_DATE" % demo_join)
-    today_denied = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM checkpoint_passes cp LEFT JOIN personnel p ON cp.personnel_id = p.id WHERE (p.id IS NULL OR p.is_demo_data = %s)" % demo_val)
-    total_passes = cur.fetchone()[0]
-
-    cur.execute("""
-        SELECT COUNT(DISTINCT cp.personnel_id)
-        FROM checkpoint_passes cp
-        JOIN personnel p ON cp.personnel_id = p.id AND p.is_demo_data = %s
-        WHERE cp.direction = 'in' AND cp.created_at::date = CURRENT_DATE
-        AND cp.personnel_id NOT IN (
-            SELECT DISTINCT cp2.personnel_id FROM checkpoint_passes cp2
-            WHERE cp2.direction = 'out' AND cp2.created_at::date = CURRENT_DATE
-            AND cp2.personnel_id IS NOT NULL
-        )
-        AND cp.personnel_id IS NOT NULL
-    """ % demo_val)
-    currently_on_site = cur.fetchone()[0]
+    stats = journal_stats(cur, 'checkpoint_passes', is_demo_request(event), [
+        ('today_in', "direction = 'in'"),
+        ('today_out', "direction = 'out'"),
+        ('today_denied', 'medical_ok = FALSE'),
+    ], extras=[
+        ('currently_on_site', """(
+            SELECT COUNT(*) FROM (
+                SELECT DISTINCT ON (personnel_id) direction
+                FROM today WHERE personnel_id IS NOT NULL AND (direction = 'out' OR medical_ok)
+                ORDER BY personnel_id, created_at DESC
+            ) last_pass WHERE last_pass.direction = 'in'
+        )"""),
+    ])
 
     cur.close()
     conn.close()
 
     return json_response(200, {
-        'today_in': today_in,
-        'today_out': today_out,
-        'today_denied': today_denied,
-        'total_passes': total_passes,
-        'currently_on_site': currently_on_site
+        'today_in': stats['today_in'],
+        'today_out': stats['today_out'],
+        'today_denied': stats['today_denied'],
+        'total_passes': stats['total'],
+        'currently_on_site': stats['currently_on_site']
     })
 
 def get_on_site(params, event):
@@ -310,6 +383,7 @@ def get_on_site(params, event):
         FROM checkpoint_passes cp
         LEFT JOIN personnel p ON cp.personnel_id = p.id
         WHERE cp.personnel_id IS NOT NULL
+        AND (cp.direction = 'out' OR cp.medical_ok)
         AND cp.created_at::date = CURRENT_DATE
         AND (p.id IS NULL OR p.is_demo_data = %s)
         ORDER BY cp.personnel_id, cp.created_at DESC
@@ -321,16 +395,12 @@ def get_on_site(params, event):
     on_site = []
     for r in rows:
         if r[3] == 'in':
-            org_type_labels = {
-                'rudnik': 'Рудник', 'guest': 'Гость',
-                'contractor': 'Подрядная организация', 'gov': 'Гос.органы'
-            }
             on_site.append({
                 'personnel_id': r[0], 'personal_code': r[1], 'full_name': r[2],
                 'checkpoint_name': r[4], 'entered_at': r[5],
                 'position': r[6] or '—', 'department': r[7] or '—',
                 'organization': r[8] or '—',
-                'organization_type': org_type_labels.get(r[9] or '', r[9] or '—'),
+                'organization_type': ORG_TYPE_LABELS.get(r[9] or '', r[9] or '—'),
                 'tab_number': r[10] or ''
             })
 
@@ -1,43 +1,10 @@
 import json
-import os
-from datetime import datetime, date as date_type
-import psycopg2
-
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
-
-def parse_qr_code(raw):
-    try:
-        data = json.loads(raw)
-        return data.get('code', raw)
-    except (json.JSONDecodeError, AttributeError):
-        return raw.strip()
+from core import get_db, instrumented, json_response, is_demo_request, parse_qr_code, idempotent, run_batch
 
+FUNCTION_NAME = 'dispatcher'
+READ_ACTIONS = ('list', '', 'stats')
+
+@instrumented(FUNCTION_NAME, READ_ACTIONS)
 def handler(event, context):
     """Диспетчерская — выдача/возврат фонарей и самоспасателей, поиск сотрудников, чат"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -48,6 +15,9 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'GET' and action in ('list', ''):
         return get_lanterns(params, event)
     elif method == 'GET' and action == 'stats':
@@ -57,7 +27,7 @@ def handler(event, context):
     elif method == 'GET' and action == 'available':
         return get_available_lanterns()
     elif method == 'POST' and action == 'issue':
-        return issue_lantern(body)
+        return idempotent(event, body, 'dispatcher.issue', issue_lantern)
     elif method == 'POST' and action == 'issue-by-code':
         return issue_by_code(body)
     elif method == 'POST' and action == 'return':
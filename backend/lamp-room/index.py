@@ -1,43 +1,10 @@
 import json
-import os
-from datetime import datetime, date as date_type
-import psycopg2
-
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+from core import get_db, instrumented, json_response, is_demo_request, parse_qr_code, idempotent, run_batch
 
-def parse_qr_code(raw):
-    try:
-        data = json.loads(raw)
-        return data.get('code', raw)
-    except (json.JSONDecodeError, AttributeError):
-        return raw.strip()
+FUNCTION_NAME = 'lamp-room'
+READ_ACTIONS = ('list', 'stats', 'denials', 'repairs')
 
+@instrumented(FUNCTION_NAME, READ_ACTIONS)
 def handler(event, context):
     """Ламповая — выдача и приём фонарей и самоспасателей, учёт недопусков"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -50,6 +17,9 @@ def handler(event, context):
     if event.get('body'):
         body = json.loads(event['body'])
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'GET' and action == 'list':
         return get_issues(params, event)
     elif method == 'GET' and action == 'stats':
@@ -63,7 +33,7 @@ def handler(event, context):
     elif method == 'POST' and action == 'identify':
         return identify_person(body)
     elif method == 'POST' and action == 'issue':
-        return issue_item(body)
+        return idempotent(event, body, 'lamp-room.issue', issue_item)
     elif method == 'POST' and action == 'return':
         return return_item(body)
     elif method == 'POST' and action == 'deny':
@@ -1,57 +1,11 @@
 import json
-import os
 import csv
 import io
-from datetime import datetime, time, date as date_type
-import psycopg2
-
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
-
-def csv_response(csv_text):
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'text/csv; charset=utf-8',
-            'Content-Disposition': 'attachment; filename="medical_report.csv"',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': csv_text
-    }
+from datetime import datetime
+from core import SHIFT_LABELS, DIRECTION_LABELS, get_db, instrumented, json_response, csv_response, is_demo_request, parse_qr_code, idempotent, run_batch
 
-def parse_qr_code(raw):
-    try:
-        data = json.loads(raw)
-        return data.get('code', raw)
-    except (json.JSONDecodeError, AttributeError):
-        return raw.strip()
+FUNCTION_NAME = 'medical'
+READ_ACTIONS = ('list', '', 'stats', 'export')
 
 def get_shift_schedule():
     conn = get_db()
@@ -69,15 +23,22 @@ def parse_hm(s):
     parts = s.split(':')
     return int(parts[0]), int(parts[1])
 
+_shift_tz = []
+
+def shift_timezone():
+    """Часовой пояс смен; pytz пробуется один раз на экземпляр, а не на каждый скан"""
+    if not _shift_tz:
+        try:
+            import pytz
+            _shift_tz.append(pytz.timezone('Asia/Yakutsk'))
+        except Exception:
+            _shift_tz.append(None)
+    return _shift_tz[0]
+
 def detect_shift():
     """Определяет текущую смену и направление по времени"""
-    now = datetime.utcnow()
-    try:
-        import pytz
-        tz = pytz.timezone('Asia/Yakutsk')
-        now = datetime.now(tz)
-    except Exception:
-        pass
+    tz = shift_timezone()
+    now = datetime.now(tz) if tz else datetime.utcnow()
 
     schedule = get_shift_schedule()
     day_start_h, day_start_m = parse_hm(schedule.get('day_start', '05:00'))
@@ -109,16 +70,13 @@ def detect_shift():
 
     return shift_type, check_direction, str(shift_date)
 
-SHIFT_LABELS = {'day': 'Дневная', 'night': 'Ночная'}
-DIRECTION_LABELS = {'to_shift': 'На смену', 'from_shift': 'Со смены'}
-
 def auto_reset_if_needed():
     """Сбрасывает medical_status всех сотрудников в pending при начале новой смены"""
     shift_type, check_direction, shift_date = detect_shift()
     if check_direction != 'to_shift':
         return
 
-    conn = get_db()
+    conn = get_db(primary=True)
     cur = conn.cursor()
     try:
         cur.execute("""
@@ -158,6 +116,7 @@ def auto_reset_if_needed():
         cur.close()
         conn.close()
 
+@instrumented(FUNCTION_NAME, READ_ACTIONS)
 def handler(event, context):
     """Медицинский контроль — предсменные/послесменные осмотры, смены, история, экспорт, автосброс"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -168,6 +127,9 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     auto_reset_if_needed()
 
     if method == 'GET' and action in ('list', ''):
@@ -181,7 +143,7 @@ def handler(event, context):
     elif method == 'POST' and action == 'add':
         return add_check(body)
     elif method == 'POST' and action == 'scan':
-        return scan_medical(body)
+        return idempotent(event, body, 'medical.scan', scan_medical)
     elif method == 'POST' and action == 'deny':
         return deny_medical(body)
     elif method == 'GET' and action == 'schedule':
@@ -450,7 +412,6 @@ def get_personnel_list(params, event):
 
     return json_response(200, {'personnel': items, 'total': len(items)})
 
-
 def scan_medical(body):
     raw_code = body.get('code', '').strip()
     if not raw_code:
@@ -750,4 +711,4 @@ def export_csv(params, event):
             r[12] or '', r[13] or '', r[14]
         ])
 
-    return csv_response(output.getvalue())
\ No newline at end of file
+    return csv_response(output.getvalue(), 'medical_report.csv')
\ No newline at end of file
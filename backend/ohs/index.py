@@ -1,36 +1,9 @@
 import json
-import os
 import base64
 from datetime import datetime, date as date_type
-import psycopg2
-
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+from core import get_db, instrumented, json_response, not_modified, run_batch
+
+FUNCTION_NAME = 'ohs'
 
 def col_letter(col_idx):
     result = ''
@@ -225,7 +198,7 @@ def get_documents(params):
     conn.close()
     return json_response(200, {'documents': rows})
 
-def get_document(params):
+def get_document(params, event):
     doc_id = params.get('id', '')
     if not doc_id:
         return json_response(400, {'error': 'ID документа не указан'})
@@ -246,6 +219,13 @@ def get_document(params):
     cols = [desc[0] for desc in cur.description]
     doc = dict(zip(cols, doc_row))
 
+    etag = '"doc-%s-%s"' % (doc['id'], (doc['updated_at'] or doc['created_at']).strftime('%Y%m%d%H%M%S%f'))
+    unchanged = not_modified(event, etag)
+    if unchanged:
+        cur.close()
+        conn.close()
+        return unchanged
+
     cur.execute("""
         SELECT id, sheet_name, sheet_index, headers, rows_data, formulas, merged_cells, column_widths, row_count, col_count
         FROM ohs_sheets WHERE document_id = %s ORDER BY sheet_index
@@ -257,7 +237,9 @@ def get_document(params):
     conn.close()
 
     doc['sheets_data'] = sheets
-    return json_response(200, doc)
+    response = json_response(200, doc)
+    response['headers']['ETag'] = etag
+    return response
 
 def update_cell(body):
     doc_id = body.get('document_id')
@@ -325,6 +307,7 @@ def delete_document(body):
     conn.close()
     return json_response(200, {'success': True})
 
+@instrumented(FUNCTION_NAME)
 def handler(event, context):
     """ОТ и ПБ — загрузка Excel-документов, парсинг листов с формулами, электронный реестр"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -335,6 +318,9 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'POST' and action == 'upload':
         return upload_document(body)
 
@@ -342,7 +328,7 @@ def handler(event, context):
         return get_documents(params)
 
     if method == 'GET' and action == 'document':
-        return get_document(params)
+        return get_document(params, event)
 
     if method == 'PUT' and action == 'cell':
         return update_cell(body)
@@ -1,38 +1,12 @@
 import json
-import os
-from datetime import datetime, date as date_type
-import psycopg2
+from core import get_db, instrumented, json_response, is_demo_request, run_batch
 
 PROTECTED_CODE = 'АД-001'
 
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+FUNCTION_NAME = 'personnel'
+READ_ACTIONS = ('list', '', 'stats', 'history')
 
+@instrumented(FUNCTION_NAME, READ_ACTIONS)
 def handler(event, context):
     """Управление персоналом рудника — список, добавление, обновление статусов"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -43,6 +17,9 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'GET' and action in ('list', ''):
         return get_personnel(params, event)
     elif method == 'GET' and action == 'stats':
@@ -220,6 +197,13 @@ def add_person(body):
         'message': 'Сотрудник добавлен'
     })
 
+STATUS_LABELS = {
+    'on_shift': 'вышел на смену',
+    'arrived': 'прибыл',
+    'departed': 'убыл',
+    'business_trip': 'командировка'
+}
+
 def update_status(body):
     person_id = body.get('id')
     new_status = body.get('status', '')
@@ -248,13 +232,7 @@ def update_status(body):
         conn.close()
         return json_response(404, {'error': 'Сотрудник не найден'})
 
-    status_labels = {
-        'on_shift': 'вышел на смену',
-        'arrived': 'прибыл',
-        'departed': 'убыл',
-        'business_trip': 'командировка'
-    }
-    label = status_labels.get(new_status, new_status)
+    label = STATUS_LABELS.get(new_status, new_status)
 
     cur.execute("""
         INSERT INTO events (event_type, description, personnel_id)
@@ -304,6 +282,8 @@ def search_personnel(params, event):
 
     return json_response(200, {'results': results, 'total': len(results)})
 
+MEDICAL_LABELS = {'passed': 'пройден', 'failed': 'не пройден', 'pending': 'ожидает'}
+
 def edit_person(body):
     person_id = body.get('id')
     if not person_id:
@@ -349,9 +329,8 @@ def edit_person(body):
     """ % (', '.join(set_parts), int(person_id)))
 
     if new_medical and new_medical != old_medical:
-        medical_labels = {'passed': 'пройден', 'failed': 'не пройден', 'pending': 'ожидает'}
-        old_label = medical_labels.get(old_medical, old_medical)
-        new_label = medical_labels.get(new_medical, new_medical)
+        old_label = MEDICAL_LABELS.get(old_medical, old_medical)
+        new_label = MEDICAL_LABELS.get(new_medical, new_medical)
 
         if new_medical == 'passed':
             check_status = 'passed'
@@ -397,6 +376,20 @@ def edit_person(body):
 
     return json_response(200, {'message': 'Данные обновлены'})
 
+TYPE_LABELS = {
+    'scan_checkin': 'КПП — отмечен',
+    'scan_denied': 'КПП — отказ',
+    'medical_pass': 'Медосмотр пройден',
+    'medical_fail': 'Медосмотр не пройден',
+    'arrival': 'Прибытие',
+    'departure': 'Убытие',
+    'status_change': 'Смена статуса',
+    'edit': 'Изменение данных',
+    'shift_start': 'Начало смены',
+    'lantern_issued': 'Выдан фонарь',
+    'lantern_returned': 'Возвращён фонарь'
+}
+
 def get_history(params):
     person_id = params.get('id', '')
     if not person_id:
@@ -416,26 +409,12 @@ def get_history(params):
     cur.close()
     conn.close()
 
-    type_labels = {
-        'scan_checkin': 'КПП — отмечен',
-        'scan_denied': 'КПП — отказ',
-        'medical_pass': 'Медосмотр пройден',
-        'medical_fail': 'Медосмотр не пройден',
-        'arrival': 'Прибытие',
-        'departure': 'Убытие',
-        'status_change': 'Смена статуса',
-        'edit': 'Изменение данных',
-        'shift_start': 'Начало смены',
-        'lantern_issued': 'Выдан фонарь',
-        'lantern_returned': 'Возвращён фонарь'
-    }
-
     events = []
     for r in rows:
         events.append({
             'id': r[0],
             'type': r[1],
-            'type_label': type_labels.get(r[1], r[1]),
+            'type_label': TYPE_LABELS.get(r[1], r[1]),
             'description': r[2],
             'created_at': r[3]
         })
@@ -1,54 +1,13 @@
 import json
-import os
 import csv
 import io
-from datetime import datetime, date as date_type, timedelta
-import psycopg2
-from decimal import Decimal
-
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    if isinstance(obj, Decimal):
-        return float(obj)
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+from datetime import date as date_type
+from core import SHIFT_LABELS, DIRECTION_LABELS, get_db, instrumented, json_response, csv_response, is_demo_request, run_batch
 
-def csv_response(csv_text, filename):
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'text/csv; charset=utf-8',
-            'Content-Disposition': 'attachment; filename="%s"' % filename,
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': csv_text
-    }
+FUNCTION_NAME = 'reports'
+READ_ACTIONS = ('attendance', 'medical', 'equipment', 'housing', 'personnel-summary', 'events-log', 'export')
 
+@instrumented(FUNCTION_NAME, READ_ACTIONS)
 def handler(event, context):
     """Формирование и экспорт отчётной документации — посещаемость, медосмотры, оборудование, персонал, события"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -58,6 +17,9 @@ def handler(event, context):
     params = event.get('queryStringParameters') or {}
     action = params.get('action', '')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, json.loads(event.get('body') or '{}'), handler.__wrapped__)
+
     if method == 'GET' and action == 'attendance':
         return report_attendance(params, event)
     elif method == 'GET' and action == 'medical':
@@ -200,9 +162,6 @@ def report_medical(params, event):
     cur.close()
     conn.close()
 
-    shift_labels = {'day': 'Дневная', 'night': 'Ночная'}
-    dir_labels = {'to_shift': 'На смену', 'from_shift': 'Со смены'}
-
     items = []
     for r in rows:
         items.append({
@@ -210,8 +169,8 @@ def report_medical(params, event):
             'department': r[3], 'organization': r[4] or '',
             'tab_number': r[5] or '',
             'status': r[6], 'check_type': r[7],
-            'shift_type': r[8], 'shift_label': shift_labels.get(r[8] or '', ''),
-            'check_direction': r[9], 'direction_label': dir_labels.get(r[9] or '', ''),
+            'shift_type': r[8], 'shift_label': SHIFT_LABELS.get(r[8] or '', ''),
+            'check_direction': r[9], 'direction_label': DIRECTION_LABELS.get(r[9] or '', ''),
             'shift_date': r[10],
             'blood_pressure': r[11], 'pulse': r[12],
             'alcohol_level': float(r[13]) if r[13] else 0,
@@ -347,6 +306,10 @@ def report_housing(params):
         }
     })
 
+ORG_TYPE_LABELS = {'rudnik': 'Рудник', 'guest': 'Гость', 'contractor': 'Подрядная', 'gov': 'Гос.органы'}
+CATEGORY_LABELS = {'mine': 'Рудничный', 'office': 'Офисный', 'contractor': 'Подрядчик', 'guest': 'Гость', 'gov': 'Гос.органы'}
+PERSONNEL_STATUS_LABELS = {'arrived': 'На объекте', 'departed': 'Убыл', 'on_shift': 'На смене', 'day_off': 'Выходной', 'sick_leave': 'Больничный', 'vacation': 'Отпуск', 'business_trip': 'Командировка'}
+
 def report_personnel_summary(params, event):
     conn = get_db()
     cur = conn.cursor()
@@ -387,19 +350,15 @@ def report_personnel_summary(params, event):
     cur.close()
     conn.close()
 
-    org_labels = {'rudnik': 'Рудник', 'guest': 'Гость', 'contractor': 'Подрядная', 'gov': 'Гос.органы'}
-    cat_labels = {'mine': 'Рудничный', 'office': 'Офисный', 'contractor': 'Подрядчик', 'guest': 'Гость', 'gov': 'Гос.органы'}
-    status_labels = {'arrived': 'На объекте', 'departed': 'Убыл', 'on_shift': 'На смене', 'day_off': 'Выходной', 'sick_leave': 'Больничный', 'vacation': 'Отпуск', 'business_trip': 'Командировка'}
-
     items = []
     for r in rows:
         items.append({
             'id': r[0], 'personal_code': r[1], 'full_name': r[2],
             'position': r[3], 'department': r[4],
-            'category': r[5], 'category_label': cat_labels.get(r[5], r[5]),
+            'category': r[5], 'category_label': CATEGORY_LABELS.get(r[5], r[5]),
             'organization': r[6] or '', 'organization_type': r[7] or '',
-            'org_type_label': org_labels.get(r[7] or '', ''),
-            'status': r[8], 'status_label': status_labels.get(r[8], r[8]),
+            'org_type_label': ORG_TYPE_LABELS.get(r[7] or '', ''),
+            'status': r[8], 'status_label': PERSONNEL_STATUS_LABELS.get(r[8], r[8]),
             'medical_status': r[9], 'shift': r[10] or '',
             'room': r[11] or '', 'phone': r[12] or '', 'created_at': r[13],
             'tab_number': r[14] or ''
@@ -418,6 +377,14 @@ def report_personnel_summary(params, event):
         }
     })
 
+EVENT_TYPE_LABELS = {
+    'checkin': 'Вход', 'checkout': 'Выход', 'medical_pass': 'Медосмотр пройден',
+    'medical_deny': 'Медосмотр не пройден', 'medical_reset': 'Автосброс медосмотров',
+    'medical_change': 'Изменение медстатуса', 'lantern_issued': 'Выдача фонаря',
+    'lantern_returned': 'Возврат фонаря', 'status_change': 'Смена статуса',
+    'person_added': 'Добавлен сотрудник', 'person_edited': 'Редактирование сотрудника'
+}
+
 def report_events_log(params, event):
     df, dt = date_range(params)
     event_type = params.get('event_type', '')
@@ -454,19 +421,11 @@ def report_events_log(params, event):
     cur.close()
     conn.close()
 
-    type_labels = {
-        'checkin': 'Вход', 'checkout': 'Выход', 'medical_pass': 'Медосмотр пройден',
-        'medical_deny': 'Медосмотр не пройден', 'medical_reset': 'Автосброс медосмотров',
-        'medical_change': 'Изменение медстатуса', 'lantern_issued': 'Выдача фонаря',
-        'lantern_returned': 'Возврат фонаря', 'status_change': 'Смена статуса',
-        'person_added': 'Добавлен сотрудник', 'person_edited': 'Редактирование сотрудника'
-    }
-
     items = []
     for r in rows:
         items.append({
             'id': r[0], 'event_type': r[1],
-            'type_label': type_labels.get(r[1], r[1]),
+            'type_label': EVENT_TYPE_LABELS.get(r[1], r[1]),
             'description': r[2], 'created_at': r[3],
             'person_name': r[4], 'person_code': r[5]
         })
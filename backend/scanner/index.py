@@ -1,36 +1,9 @@
 import json
-import os
-from datetime import datetime, date as date_type
-import psycopg2
-
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+from core import ORG_TYPE_LABELS, MEDICAL_LABELS, get_db, instrumented, json_response, is_demo_request, parse_qr_code, idempotent, run_batch
 
+FUNCTION_NAME = 'scanner'
+
+@instrumented(FUNCTION_NAME)
 def handler(event, context):
     """Сканирование QR-кодов и личных кодов — идентификация и отметка персонала"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -41,21 +14,26 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'POST' and action == 'identify':
         return identify(body)
     elif method == 'POST' and action == 'checkin':
-        return checkin(body)
+        return idempotent(event, body, 'scanner.checkin', checkin)
     elif method == 'GET' and action == 'recent':
         return get_recent(event)
 
     return json_response(404, {'error': 'Маршрут не найден'})
 
-def parse_qr_code(raw):
-    try:
-        data = json.loads(raw)
-        return data.get('code', raw)
-    except (json.JSONDecodeError, AttributeError):
-        return raw.strip()
+CATEGORY_LABELS = {
+    'mine': 'Рудничный', 'contractor': 'Подрядчик',
+    'business_trip': 'Командированный', 'guest': 'Гость', 'user': 'Пользователь'
+}
+STATUS_LABELS = {
+    'on_shift': 'На смене', 'arrived': 'Прибыл', 'departed': 'Убыл',
+    'business_trip': 'Командировка', 'active': 'Активен'
+}
 
 def identify(body):
     raw_code = body.get('code', '').strip()
@@ -95,26 +73,8 @@ def identify(body):
     if not row:
         return json_response(404, {'error': 'Сотрудник с кодом %s не найден' % code})
 
-    category_labels = {
-        'mine': 'Рудничный', 'contractor': 'Подрядчик',
-        'business_trip': 'Командированный', 'guest': 'Гость', 'user': 'Пользователь'
-    }
-    status_labels = {
-        'on_shift': 'На смене', 'arrived': 'Прибыл', 'departed': 'Убыл',
-        'business_trip': 'Командировка', 'active': 'Активен'
-    }
-    medical_labels = {
-        'passed': 'Пройден', 'failed': 'Не пройден',
-        'pending': 'Ожидает', 'expiring': 'Истекает'
-    }
-
     medical_ok = row[7] in ('passed', 'expiring')
 
-    org_type_labels = {
-        'rudnik': 'Рудник', 'guest': 'Гость',
-        'contractor': 'Подрядная организация', 'gov': 'Гос.органы'
-    }
-
     return json_response(200, {
         'person': {
             'id': row[0],
@@ -122,14 +82,14 @@ def identify(body):
             'full_name': row[2],
             'position': row[3],
             'department': row[4],
-            'category': category_labels.get(row[5], row[5]),
-            'status': status_labels.get(row[6], row[6]),
-            'medical_status': medical_labels.get(row[7], row[7]),
+            'category': CATEGORY_LABELS.get(row[5], row[5]),
+            'status': STATUS_LABELS.get(row[6], row[6]),
+            'medical_status': MEDICAL_LABELS.get(row[7], row[7]),
             'medical_ok': medical_ok,
             'room': row[8] or '—',
             'shift': row[9] or '—',
             'organization': row[10] or '',
-            'organization_type': org_type_labels.get(row[11] or '', row[11] or '')
+            'organization_type': ORG_TYPE_LABELS.get(row[11] or '', row[11] or '')
         }
     })
 
@@ -1,36 +1,15 @@
 import json
 import os
-from datetime import datetime, date as date_type
-import psycopg2
-
-def is_demo_request(event):
-    headers = event.get('headers') or {}
-    return headers.get('X-Demo', headers.get('x-demo', '')) == 'true'
-
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def serialize_default(obj):
-    if isinstance(obj, datetime):
-        if obj.tzinfo is None:
-            return obj.isoformat() + '+00:00'
-        return obj.isoformat()
-    if isinstance(obj, (date_type,)):
-        return obj.isoformat()
-    return str(obj)
-
-def json_response(status, body):
-    return {
-        'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo'
-        },
-        'body': json.dumps(body, ensure_ascii=False, default=serialize_default)
-    }
+import io
+from datetime import datetime
+from core import CATEGORY_LABELS, ORG_TYPE_LABELS, MEDICAL_LABELS, get_db, instrumented, json_response, is_demo_request, parse_qr_code, TTLCache, run_batch, scan_auth_error, journal_stats
+
+FUNCTION_NAME = 'security'
+READ_ACTIONS = ('journal', 'stats', 'export')
+
+SCAN_ROLES = ('admin', 'security')
 
+@instrumented(FUNCTION_NAME, READ_ACTIONS)
 def handler(event, context):
     """СБ — проверка подлинности пропусков, данные сотрудников, журнал проверок"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -41,25 +20,29 @@ def handler(event, context):
     action = params.get('action', '')
     body = json.loads(event.get('body', '{}') or '{}')
 
+    if method == 'POST' and action == 'batch':
+        return run_batch(event, body, handler.__wrapped__)
+
     if method == 'POST' and action == 'verify':
+        denied = scan_auth_error(event, SCAN_ROLES)
+        if denied:
+            return denied
         return verify_pass(body)
     elif method == 'GET' and action == 'person':
         return get_person_full(params, event)
     elif method == 'GET' and action == 'journal':
         return get_journal(params)
     elif method == 'GET' and action == 'stats':
-        return get_stats()
+        return get_stats(event)
     elif method == 'GET' and action == 'export':
         return export_journal(params)
 
     return json_response(404, {'error': 'Маршрут не найден'})
 
-def parse_qr_code(raw):
-    try:
-        data = json.loads(raw)
-        return data.get('code', raw)
-    except (json.JSONDecodeError, AttributeError):
-        return raw.strip()
+STATUS_LABELS = {
+    'on_shift': 'На смене', 'arrived': 'Прибыл', 'departed': 'Убыл',
+    'business_trip': 'Командировка'
+}
 
 def verify_pass(body):
     raw_code = body.get('code', '').strip()
@@ -79,7 +62,7 @@ def verify_pass(body):
         SELECT p.id, p.personal_code, p.full_name, p.position, p.department,
                p.category, p.status, p.medical_status, p.room, p.shift,
                p.organization, p.organization_type, p.phone, p.tabular_number,
-               p.qr_code, p.created_at
+               p.qr_code, p.created_at, p.is_demo_data
         FROM personnel p
         WHERE (p.personal_code = '%s' OR p.qr_code = '%s') AND p.is_hidden = FALSE
         LIMIT 1
@@ -110,10 +93,11 @@ def verify_pass(body):
     result = 'valid' if medical_ok else 'medical_issue'
 
     cur.execute("""
-        INSERT INTO security_checks (personnel_id, personal_code, full_name, check_type, result, notes, checked_by)
-        VALUES (%d, '%s', '%s', 'pass_verification', '%s', '%s', '%s')
+        INSERT INTO security_checks (personnel_id, personal_code, full_name, check_type, result, notes, checked_by, is_demo_data)
+        VALUES (%d, '%s', '%s', 'pass_verification', '%s', '%s', '%s', %s)
         RETURNING id
-    """ % (person_id, row[1].replace("'", "''"), safe_name, result, notes.replace("'", "''"), checked_by.replace("'", "''")))
+    """ % (person_id, row[1].replace("'", "''"), safe_name, result, notes.replace("'", "''"), checked_by.replace("'", "''"),
+           'TRUE' if row[16] else 'FALSE'))
     check_id = cur.fetchone()[0]
 
     cur.execute("""
@@ -121,26 +105,10 @@ def verify_pass(body):
         VALUES ('security_check', 'СБ: %s — пропуск %s', %d)
     """ % (safe_name, 'подтверждён' if result == 'valid' else 'ВНИМАНИЕ: медосмотр', person_id))
 
-    category_labels = {
-        'mine': 'Рудничный', 'contractor': 'Подрядчик',
-        'business_trip': 'Командированный', 'guest': 'Гость'
-    }
-    status_labels = {
-        'on_shift': 'На смене', 'arrived': 'Прибыл', 'departed': 'Убыл',
-        'business_trip': 'Командировка'
-    }
-    medical_labels = {
-        'passed': 'Пройден', 'failed': 'Не пройден',
-        'pending': 'Ожидает', 'expiring': 'Истекает'
-    }
-    org_type_labels = {
-        'rudnik': 'Рудник', 'guest': 'Гость',
-        'contractor': 'Подрядная организация', 'gov': 'Гос.органы'
-    }
-
     conn.commit()
     cur.close()
     conn.close()
+    bump_dossier_version(person_id)
 
     return json_response(200, {
         'result': result,
@@ -152,14 +120,14 @@ def verify_pass(body):
             'full_name': row[2],
             'position': row[3] or '—',
             'department': row[4] or '—',
-            'category': category_labels.get(row[5], row[5]),
-            'status': status_labels.get(row[6], row[6]),
-            'medical_status': medical_labels.get(row[7], row[7] or '—'),
+            'category': CATEGORY_LABELS.get(row[5], row[5]),
+            'status': STATUS_LABELS.get(row[6], row[6]),
+            'medical_status': MEDICAL_LABELS.get(row[7], row[7] or '—'),
             'medical_ok': medical_ok,
             'room': row[8] or '—',
             'shift': row[9] or '—',
             'organization': row[10] or '—',
-            'organization_type': org_type_labels.get(row[11] or '', row[11] or '—'),
+            'organization_type': ORG_TYPE_LABELS.get(row[11] or '', row[11] or '—'),
             'phone': row[12] or '—',
             'tabular_number': row[13] or '—',
             'qr_code': row[14] or '',
@@ -167,262 +135,331 @@ def verify_pass(body):
         }
     })
 
+DOSSIER_CACHE_TTL = int(os.environ.get('SECURITY_DOSSIER_CACHE_TTL', '5'))
+DOSSIER_CACHE_MAX = 500
+
+DOSSIER_SECTIONS = {
+    'security_checks': """
+        SELECT id, check_type, result, notes, checked_by,
+               created_at AT TIME ZONE 'UTC' AS created_at
+        FROM security_checks
+        WHERE personnel_id = p.id
+        ORDER BY created_at DESC LIMIT 10
+    """,
+    'checkpoint_passes': """
+        SELECT id, direction, checkpoint_name, medical_ok,
+               created_at AT TIME ZONE 'UTC' AS created_at
+        FROM checkpoint_passes
+        WHERE personnel_id = p.id
+        ORDER BY created_at DESC LIMIT 10
+    """,
+    'events': """
+        SELECT id, event_type, description,
+               created_at AT TIME ZONE 'UTC' AS created_at
+        FROM events
+        WHERE personnel_id = p.id AND is_hidden = FALSE
+        ORDER BY created_at DESC LIMIT 20
+    """,
+}
+
+_dossier_cache = TTLCache(DOSSIER_CACHE_TTL, max_size=DOSSIER_CACHE_MAX)
+_dossier_versions = {}
+
+def bump_dossier_version(person_id):
+    """Отмечает, что данные сотрудника изменились и кэш досье устарел"""
+    _dossier_versions[person_id] = _dossier_versions.get(person_id, 0) + 1
+
+def format_dossier_section(name, rows):
+    if name == 'security_checks':
+        return [{
+            'id': c['id'], 'check_type': c['check_type'],
+            'result': RESULT_LABELS.get(c['result'], c['result']),
+            'result_raw': c['result'],
+            'notes': c['notes'] or '', 'checked_by': c['checked_by'] or '',
+            'created_at': c['created_at']
+        } for c in rows]
+    if name == 'checkpoint_passes':
+        return [{
+            'id': p['id'],
+            'direction': 'Вход' if p['direction'] == 'in' else 'Выход',
+            'direction_raw': p['direction'],
+            'checkpoint_name': p['checkpoint_name'],
+            'medical_ok': p['medical_ok'],
+            'created_at': p['created_at']
+        } for p in rows]
+    return [{
+        'id': e['id'], 'type': e['event_type'], 'description': e['description'], 'created_at': e['created_at']
+    } for e in rows]
+
 def get_person_full(params, event):
+    """Досье сотрудника: карточка и выбранные разделы одним запросом, с коротким кэшем.
+
+    sections — список через запятую из security_checks, checkpoint_passes, events (по умолчанию все).
+    """
     person_id = params.get('id', '')
     code = params.get('code', '')
 
     if not person_id and not code:
         return json_response(400, {'error': 'Укажите id или code'})
 
-    conn = get_db()
-    cur = conn.cursor()
+    requested = params.get('sections', '')
+    if requested:
+        sections = [s.strip() for s in requested.split(',') if s.strip()]
+        unknown = [s for s in sections if s not in DOSSIER_SECTIONS]
+        if unknown:
+            return json_response(400, {'error': 'Неизвестные разделы: %s' % ', '.join(unknown)})
+    else:
+        sections = list(DOSSIER_SECTIONS)
+    sections = [s for s in DOSSIER_SECTIONS if s in sections]
+
+    demo = is_demo_request(event)
+    cache_key = (demo, person_id, code, tuple(sections))
+    cached = _dossier_cache.get(cache_key)
+    if cached and _dossier_versions.get(cached[0], 0) == cached[1]:
+        return json_response(200, cached[2])
 
-    demo_filter = "AND p.is_demo_data = TRUE" if is_demo_request(event) else "AND p.is_demo_data = FALSE"
+    demo_filter = "AND p.is_demo_data = TRUE" if demo else "AND p.is_demo_data = FALSE"
 
     if person_id:
-        cur.execute("""
-            SELECT p.id, p.personal_code, p.full_name, p.position, p.department,
-                   p.category, p.status, p.medical_status, p.room, p.shift,
-                   p.organization, p.organization_type, p.phone, p.tabular_number,
-                   p.qr_code, p.created_at
-            FROM personnel p
-            WHERE p.id = %d AND p.is_hidden = FALSE %s
-        """ % (int(person_id), demo_filter))
+        lookup = "p.id = %d" % int(person_id)
     else:
         safe_code = code.replace("'", "''")
-        cur.execute("""
-            SELECT p.id, p.personal_code, p.full_name, p.position, p.department,
-                   p.category, p.status, p.medical_status, p.room, p.shift,
-                   p.organization, p.organization_type, p.phone, p.tabular_number,
-                   p.qr_code, p.created_at
-            FROM personnel p
-            WHERE (p.personal_code = '%s' OR p.qr_code = '%s') AND p.is_hidden = FALSE %s
-            LIMIT 1
-        """ % (safe_code, safe_code, demo_filter))
-
-    row = cur.fetchone()
-    if not row:
-        cur.close()
-        conn.close()
-        return json_response(404, {'error': 'Сотрудник не найден'})
-
-    pid = row[0]
+        lookup = "(p.personal_code = '%s' OR p.qr_code = '%s')" % (safe_code, safe_code)
 
-    cur.execute("""
-        SELECT id, check_type, result, notes, checked_by, created_at
-        FROM security_checks
-        WHERE personnel_id = %d
-        ORDER BY created_at DESC LIMIT 10
-    """ % pid)
-    checks = cur.fetchall()
+    section_selects = ''.join(
+        ",\n               (SELECT COALESCE(json_agg(s), '[]'::json) FROM (%s) s)" % DOSSIER_SECTIONS[name]
+        for name in sections
+    )
 
-    cur.execute("""
-        SELECT id, direction, checkpoint_name, medical_ok, created_at
-        FROM checkpoint_passes
-        WHERE personnel_id = %d
-        ORDER BY created_at DESC LIMIT 10
-    """ % pid)
-    passes = cur.fetchall()
+    conn = get_db()
+    cur = conn.cursor()
 
     cur.execute("""
-        SELECT id, event_type, description, created_at
-        FROM events
-        WHERE personnel_id = %d AND is_hidden = FALSE
-        ORDER BY created_at DESC LIMIT 20
-    """ % pid)
-    events = cur.fetchall()
+        SELECT p.id, p.personal_code, p.full_name, p.position, p.department,
+               p.category, p.status, p.medical_status, p.room, p.shift,
+               p.organization, p.organization_type, p.phone, p.tabular_number,
+               p.qr_code, p.created_at%s
+        FROM personnel p
+        WHERE %s AND p.is_hidden = FALSE %s
+        LIMIT 1
+    """ % (section_selects, lookup, demo_filter))
 
+    row = cur.fetchone()
     cur.close()
     conn.close()
 
-    category_labels = {
-        'mine': 'Рудничный', 'contractor': 'Подрядчик',
-        'business_trip': 'Командированный', 'guest': 'Гость'
-    }
-    status_labels = {
-        'on_shift': 'На смене', 'arrived': 'Прибыл', 'departed': 'Убыл',
-        'business_trip': 'Командировка'
-    }
-    medical_labels = {
-        'passed': 'Пройден', 'failed': 'Не пройден',
-        'pending': 'Ожидает', 'expiring': 'Истекает'
-    }
-    org_type_labels = {
-        'rudnik': 'Рудник', 'guest': 'Гость',
-        'contractor': 'Подрядная организация', 'gov': 'Гос.органы'
-    }
-    result_labels = {
-        'valid': 'Подтверждён', 'medical_issue': 'Проблема с медосмотром',
-        'not_found': 'Не найден', 'expired': 'Просрочен'
-    }
+    if not row:
+        return json_response(404, {'error': 'Сотрудник не найден'})
 
-    return json_response(200, {
+    result = {
         'person': {
             'id': row[0],
             'personal_code': row[1],
             'full_name': row[2],
             'position': row[3] or '—',
             'department': row[4] or '—',
-            'category': category_labels.get(row[5], row[5]),
-            'status': status_labels.get(row[6], row[6]),
-            'medical_status': medical_labels.get(row[7], row[7] or '—'),
+            'category': CATEGORY_LABELS.get(row[5], row[5]),
+            'status': STATUS_LABELS.get(row[6], row[6]),
+            'medical_status': MEDICAL_LABELS.get(row[7], row[7] or '—'),
             'medical_ok': row[7] in ('passed', 'expiring'),
             'room': row[8] or '—',
             'shift': row[9] or '—',
             'organization': row[10] or '—',
-            'organization_type': org_type_labels.get(row[11] or '', row[11] or '—'),
+            'organization_type': ORG_TYPE_LABELS.get(row[11] or '', row[11] or '—'),
             'phone': row[12] or '—',
             'tabular_number': row[13] or '—',
             'qr_code': row[14] or '',
             'registered_at': row[15]
-        },
-        'security_checks': [{
-            'id': c[0], 'check_type': c[1],
-            'result': result_labels.get(c[2], c[2]),
-            'result_raw': c[2],
-            'notes': c[3] or '', 'checked_by': c[4] or '',
-            'created_at': c[5]
-        } for c in checks],
-        'checkpoint_passes': [{
-            'id': p[0],
-            'direction': 'Вход' if p[1] == 'in' else 'Выход',
-            'direction_raw': p[1],
-            'checkpoint_name': p[2],
-            'medical_ok': p[3],
-            'created_at': p[4]
-        } for p in passes],
-        'events': [{
-            'id': e[0], 'type': e[1], 'description': e[2], 'created_at': e[3]
-        } for e in events]
-    })
+        }
+    }
+    for i, name in enumerate(sections):
+        result[name] = format_dossier_section(name, row[16 + i] or [])
 
-def get_journal(params):
-    date_from = params.get('date_from', '')
-    date_to = params.get('date_to', '')
-    result_filter = params.get('result', '')
-    page = int(params.get('page', '1'))
-    per_page = int(params.get('per_page', '50'))
-    offset = (page - 1) * per_page
+    _dossier_cache.set(cache_key, (row[0], _dossier_versions.get(row[0], 0), result))
 
-    conn = get_db()
-    cur = conn.cursor()
+    return json_response(200, result)
+
+JOURNAL_COUNT_TTL = int(os.environ.get('SECURITY_JOURNAL_COUNT_TTL', '60'))
+EXPORT_FETCH_SIZE = 2000
+EXPORT_MAX_ROWS = int(os.environ.get('SECURITY_EXPORT_MAX_ROWS', '30000'))
+
+_journal_counts = TTLCache(JOURNAL_COUNT_TTL, max_size=200)
 
+RESULT_LABELS = {
+    'valid': 'Подтверждён', 'medical_issue': 'Проблема с медосмотром',
+    'not_found': 'Не найден', 'expired': 'Просрочен'
+}
+
+def journal_where(params):
     where = "WHERE 1=1"
+    date_from = params.get('date_from', '')
+    date_to = params.get('date_to', '')
+    result_filter = params.get('result', '')
     if date_from:
         where += " AND sc.created_at >= '%s 00:00:00'" % date_from.replace("'", "''")
     if date_to:
         where += " AND sc.created_at <= '%s 23:59:59'" % date_to.replace("'", "''")
     if result_filter:
         where += " AND sc.result = '%s'" % result_filter.replace("'", "''")
+    return where
+
+def encode_cursor(created_at, row_id):
+    return '%s_%d' % (created_at.isoformat(), row_id)
+
+def decode_cursor(cursor):
+    ts, row_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(ts), int(row_id)
+
+def journal_total(cur, where, mode):
+    """Количество записей журнала: точное с кэшем на JOURNAL_COUNT_TTL или оценка планировщика"""
+    if mode == 'none':
+        return None
+    if mode == 'approx' and where == "WHERE 1=1":
+        cur.execute("SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = 'security_checks'")
+        row = cur.fetchone()
+        return row[0] if row else 0
+    cached = _journal_counts.get(where)
+    if cached is not None:
+        return cached
+    cur.execute("SELECT COUNT(*) FROM security_checks sc %s" % where)
+    return _journal_counts.set(where, cur.fetchone()[0])
 
-    cur.execute("""
-        SELECT COUNT(*) FROM security_checks sc %s
-    """ % where)
-    total = cur.fetchone()[0]
+def get_journal(params):
+    """Журнал проверок: постранично (page) или по курсору (created_at, id) без OFFSET.
+
+    В режиме курсора итог по умолчанию не считается (count=none): точный COUNT съел бы выигрыш от keyset.
+    """
+    cursor = params.get('cursor', '')
+    keyset_mode = bool(cursor) or params.get('paging') == 'keyset'
+    count_mode = params.get('count', 'none' if keyset_mode else 'exact')
+    try:
+        page = max(int(params.get('page', '1')), 1)
+        per_page = min(max(int(params.get('per_page', '50')), 1), 500)
+    except ValueError:
+        return json_response(400, {'error': 'page и per_page должны быть числами'})
+
+    where = journal_where(params)
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    total = journal_total(cur, where, count_mode)
+
+    if keyset_mode:
+        keyset = where
+        if cursor:
+            try:
+                cur_ts, cur_id = decode_cursor(cursor)
+            except ValueError:
+                cur.close()
+                conn.close()
+                return json_response(400, {'error': 'Некорректный cursor'})
+            keyset += " AND (sc.created_at, sc.id) < ('%s', %d)" % (cur_ts.isoformat(), cur_id)
+        limit_sql = "LIMIT %d" % (per_page + 1)
+    else:
+        keyset = where
+        limit_sql = "LIMIT %d OFFSET %d" % (per_page + 1, (page - 1) * per_page)
 
     cur.execute("""
         SELECT sc.id, sc.personnel_id, sc.personal_code, sc.full_name,
                sc.check_type, sc.result, sc.notes, sc.checked_by, sc.created_at
         FROM security_checks sc
         %s
-        ORDER BY sc.created_at DESC
-        LIMIT %d OFFSET %d
-    """ % (where, per_page, offset))
+        ORDER BY sc.created_at DESC, sc.id DESC
+        %s
+    """ % (keyset, limit_sql))
     rows = cur.fetchall()
 
     cur.close()
     conn.close()
 
-    result_labels = {
-        'valid': 'Подтверждён', 'medical_issue': 'Проблема с медосмотром',
-        'not_found': 'Не найден', 'expired': 'Просрочен'
-    }
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
 
     items = [{
         'id': r[0], 'personnel_id': r[1], 'personal_code': r[2],
         'full_name': r[3], 'check_type': r[4],
-        'result': result_labels.get(r[5], r[5]),
+        'result': RESULT_LABELS.get(r[5], r[5]),
         'result_raw': r[5],
         'notes': r[6] or '', 'checked_by': r[7] or '',
         'created_at': r[8]
     } for r in rows]
 
-    return json_response(200, {
+    result = {
         'items': items, 'total': total,
         'page': page, 'per_page': per_page,
-        'pages': (total + per_page - 1) // per_page if per_page > 0 else 1
-    })
+        'has_more': has_more,
+        'next_cursor': encode_cursor(rows[-1][8], rows[-1][0]) if has_more and rows else None,
+    }
+    if total is not None:
+        result['pages'] = (total + per_page - 1) // per_page if per_page > 0 else 1
+    return json_response(200, result)
 
-def get_stats():
+def get_stats(event):
     conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT COUNT(*) FROM security_checks WHERE created_at::date = CURRENT_DATE")
-    today_checks = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM security_checks WHERE result = 'valid' AND created_at::date = CURRENT_DATE")
-    today_valid = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM security_checks WHERE result != 'valid' AND created_at::date = CURRENT_DATE")
-    today_issues = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM security_checks")
-    total_checks = cur.fetchone()[0]
+    stats = journal_stats(cur, 'security_checks', is_demo_request(event), [
+        ('today_checks', 'TRUE'),
+        ('today_valid', "result = 'valid'"),
+        ('today_issues', "result != 'valid'"),
+    ])
 
     cur.close()
     conn.close()
 
     return json_response(200, {
-        'today_checks': today_checks,
-        'today_valid': today_valid,
-        'today_issues': today_issues,
-        'total_checks': total_checks
+        'today_checks': stats['today_checks'],
+        'today_valid': stats['today_valid'],
+        'today_issues': stats['today_issues'],
+        'total_checks': stats['total']
     })
 
 def export_journal(params):
-    date_from = params.get('date_from', '')
-    date_to = params.get('date_to', '')
+    """CSV-выгрузка журнала: строки читаются серверным курсором порциями, CSV собирается в памяти.
 
-    conn = get_db()
-    cur = conn.cursor()
+    Ответ функции ограничен по размеру, поэтому в выгрузку попадает не больше EXPORT_MAX_ROWS
+    последних записей; обрезанный файл помечается заголовком X-Export-Truncated.
+    """
+    export_params = {'date_from': params.get('date_from', ''), 'date_to': params.get('date_to', '')}
+    where = journal_where(export_params)
 
-    where = "WHERE 1=1"
-    if date_from:
-        where += " AND sc.created_at >= '%s 00:00:00'" % date_from.replace("'", "''")
-    if date_to:
-        where += " AND sc.created_at <= '%s 23:59:59'" % date_to.replace("'", "''")
+    conn = get_db()
+    cur = conn.cursor(name='security_export')
+    cur.itersize = EXPORT_FETCH_SIZE
 
     cur.execute("""
         SELECT sc.personal_code, sc.full_name, sc.result, sc.notes, sc.checked_by, sc.created_at
         FROM security_checks sc
         %s
-        ORDER BY sc.created_at DESC
-        LIMIT 5000
-    """ % where)
-    rows = cur.fetchall()
+        ORDER BY sc.created_at DESC, sc.id DESC
+        LIMIT %d
+    """ % (where, EXPORT_MAX_ROWS + 1))
+
+    out = io.StringIO()
+    out.write('Код;ФИО;Результат;Примечание;Проверил;Дата и время')
+    truncated = False
+    for i, r in enumerate(cur):
+        if i == EXPORT_MAX_ROWS:
+            truncated = True
+            break
+        dt = r[5].strftime('%d.%m.%Y %H:%M') if r[5] else ''
+        out.write('\n%s;%s;%s;%s;%s;%s' % (
+            r[0], r[1], RESULT_LABELS.get(r[2], r[2]), r[3] or '', r[4] or '', dt
+        ))
     cur.close()
     conn.close()
 
-    result_labels = {
-        'valid': 'Подтверждён', 'medical_issue': 'Проблема с медосмотром',
-        'not_found': 'Не найден', 'expired': 'Просрочен'
+    headers = {
+        'Content-Type': 'text/csv; charset=utf-8',
+        'Content-Disposition': 'attachment; filename="security_journal.csv"',
+        'Access-Control-Allow-Origin': '*'
     }
-
-    lines = ['Код;ФИО;Результат;Примечание;Проверил;Дата и время']
-    for r in rows:
-        dt = r[5].strftime('%d.%m.%Y %H:%M') if r[5] else ''
-        lines.append('%s;%s;%s;%s;%s;%s' % (
-            r[0], r[1], result_labels.get(r[2], r[2]), r[3] or '', r[4] or '', dt
-        ))
-
-    csv_content = '\n'.join(lines)
-
+    if truncated:
+        headers['X-Export-Truncated'] = str(EXPORT_MAX_ROWS)
+        headers['Access-Control-Expose-Headers'] = 'X-Export-Truncated'
     return {
         'statusCode': 200,
-        'headers': {
-            'Content-Type': 'text/csv; charset=utf-8',
-            'Content-Disposition': 'attachment; filename="security_journal.csv"',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': csv_content
+        'headers': headers,
+        'body': out.getvalue()
     }
\ No newline at end of file
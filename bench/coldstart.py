@@ -0,0 +1,130 @@
+"""Холодный старт backend-функций: время импорта index.py в свежем интерпретаторе.
+
+Каждая функция импортируется в отдельном процессе с `python -X importtime`, как при первом
+вызове нового экземпляра. Отчёт — медиана по повторам и самые тяжёлые прямые импорты.
+С --budget-ms процесс завершается с ошибкой, если какая-то функция не укладывается в бюджет.
+С --action дополнительно замеряется первый вызов handler после импорта (нужна DATABASE_URL).
+
+    python bench/coldstart.py --repeats 5 --budget-ms 100
+    DATABASE_URL=postgresql://localhost/mine_bench python bench/coldstart.py --function medical --action shift
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+IMPORT_BUDGET_MS = 100
+
+FIRST_REQUEST = """
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+index.handler({'httpMethod': 'GET', 'queryStringParameters': {'action': sys.argv[1]}, 'headers': {}}, None)
+done = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_request_ms': (done - imported) * 1000}))
+"""
+
+
+def function_names():
+    return sorted(n for n in os.listdir(BACKEND) if os.path.isfile(os.path.join(BACKEND, n, 'index.py')))
+
+
+def parse_importtime(stderr):
+    """Строки `import time: self | cumulative | name` -> (мкс всего index, прямые импорты index)"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        name = parts[2].rstrip()
+        entries.append((len(name) - len(name.lstrip()), name.strip(), int(parts[1])))
+    root = [e for e in entries if e[1] == 'index']
+    if not root:
+        return 0, []
+    depth = root[-1][0]
+    # прямые импорты index печатаются перед ним с отступом на уровень глубже
+    children = []
+    for e in reversed(entries[:entries.index(root[-1])]):
+        if e[0] <= depth:
+            break
+        if e[0] == depth + 2:
+            children.append((e[1], e[2]))
+    return root[-1][2], sorted(children, key=lambda c: -c[1])
+
+
+def measure(name, repeats):
+    env = dict(os.environ, REQUEST_LOG='0')
+    totals, children = [], {}
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import index'],
+                              cwd=os.path.join(BACKEND, name), env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError('%s: %s' % (name, proc.stderr.strip().splitlines()[-1]))
+        total_us, direct = parse_importtime(proc.stderr)
+        totals.append(total_us / 1000)
+        for module, us in direct:
+            children.setdefault(module, []).append(us / 1000)
+    heaviest = sorted(((m, statistics.median(v)) for m, v in children.items()), key=lambda c: -c[1])[:5]
+    return {'import_ms': round(statistics.median(totals), 1), 'max_ms': round(max(totals), 1),
+            'heaviest': [{'module': m, 'ms': round(ms, 1)} for m, ms in heaviest]}
+
+
+def measure_first_request(name, action):
+    proc = subprocess.run([sys.executable, '-c', FIRST_REQUEST, action], cwd=os.path.join(BACKEND, name),
+                          env=dict(os.environ, REQUEST_LOG='0'), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError('%s: %s' % (name, proc.stderr.strip().splitlines()[-1]))
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {k: round(v, 1) for k, v in result.items()}
+
+
+def run(functions, repeats, budget_ms, action=None):
+    """Замеры по функциям и список превысивших бюджет"""
+    results, over = {}, []
+    for name in functions:
+        results[name] = measure(name, repeats)
+        if action:
+            results[name].update(measure_first_request(name, action))
+        if budget_ms and results[name]['import_ms'] > budget_ms:
+            over.append(name)
+    return results, over
+
+
+def print_report(results, budget_ms):
+    print('%-12s %10s %10s  %s' % ('function', 'import', 'max', 'heaviest imports'))
+    for name, r in results.items():
+        heavy = ', '.join('%s %.1f' % (h['module'], h['ms']) for h in r['heaviest'][:3])
+        mark = ' !' if budget_ms and r['import_ms'] > budget_ms else ''
+        line = '%-12s %8.1fms %8.1fms  %s%s' % (name, r['import_ms'], r['max_ms'], heavy, mark)
+        if 'first_request_ms' in r:
+            line += '  first request %.1fms' % r['first_request_ms']
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время холодного старта backend-функций')
+    parser.add_argument('--function', action='append', choices=function_names(), help='по умолчанию все')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS, help='0 — без проверки')
+    parser.add_argument('--action', help='замерить и первый вызов handler с этим action (GET)')
+    parser.add_argument('--out', help='куда записать результаты в JSON')
+    args = parser.parse_args()
+
+    results, over = run(args.function or function_names(), args.repeats, args.budget_ms, args.action)
+    print_report(results, args.budget_ms)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump({'budget_ms': args.budget_ms, 'functions': results}, f, ensure_ascii=False, indent=2)
+    if over:
+        sys.exit('Импорт дольше %.0f мс: %s' % (args.budget_ms, ', '.join(over)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+"""Генератор синтетических данных в масштабе продуктивной базы для локальных замеров.
+
+Заполняет персонал, заезды АХО, медосмотры, проходы КПП, проверки СБ, выдачи и недопуски
+ламповой, события, уведомления и листы ОТиПБ. Данные детерминированы: одинаковые --seed и
+--anchor дают одинаковый набор. Загрузка идёт через COPY порциями, без построчных INSERT.
+
+Сгенерированный персонал получает личные коды с префиксом ГН-, по ним --reset удаляет
+прошлую генерацию вместе со всеми зависимыми строками.
+
+    DATABASE_URL=postgresql://localhost/mine_bench python bench/generate.py --scale 1 --seed 42 --reset
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import psycopg2
+
+CODE_PREFIX = 'ГН-'
+COPY_CHUNK = 50000
+
+BASE_VOLUMES = {
+    'personnel': 20000,
+    'aho_batches': 40,
+    'aho_arrivals': 12000,
+    'medical_checks': 500000,
+    'checkpoint_passes': 200000,
+    'security_checks': 50000,
+    'lamp_room_issues': 200000,
+    'lamp_room_denials': 5000,
+    'events': 1000000,
+    'notifications': 20000,
+    'ohs_documents': 20,
+}
+
+SURNAMES = ['Иванов', 'Петров', 'Сидоров', 'Козлов', 'Морозов', 'Волков', 'Соколов', 'Лебедев', 'Новиков',
+            'Фёдоров', 'Егоров', 'Павлов', 'Семёнов', 'Голубев', 'Виноградов', 'Богданов', 'Воробьёв',
+            'Кузнецов', 'Михайлов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Захаров', 'Зайцев']
+FIRST_NAMES = ['Алексей', 'Виталий', 'Кирилл', 'Дмитрий', 'Сергей', 'Андрей', 'Иван', 'Михаил', 'Павел',
+               'Николай', 'Евгений', 'Олег', 'Роман', 'Юрий', 'Артём', 'Игорь', 'Владимир', 'Денис']
+PATRONYMICS = ['Сергеевич', 'Иванович', 'Николаевич', 'Михайлович', 'Петрович', 'Андреевич',
+               'Викторович', 'Олегович', 'Юрьевич', 'Алексеевич', 'Павлович', 'Романович']
+POSITIONS = ['Горнорабочий', 'Проходчик', 'Электрослесарь', 'Машинист ПДМ', 'Взрывник', 'Маркшейдер',
+             'Горный мастер', 'Крепильщик', 'Геолог', 'Монтажник', 'Сварщик', 'Механик участка']
+DEPARTMENTS = ['Участок №%d' % i for i in range(1, 13)] + ['Геология', 'Энергослужба', 'Вентиляция']
+ORGANIZATIONS = [('Рудник', 'rudnik')] + [('ООО Подряд-%d' % i, 'contractor') for i in range(1, 31)] + \
+                [('Гостехнадзор', 'gov'), ('Гости', 'guest')]
+CATEGORIES = [('mine', 70), ('contractor', 20), ('business_trip', 7), ('guest', 3)]
+PERSON_STATUSES = [('on_shift', 40), ('arrived', 35), ('departed', 20), ('business_trip', 5)]
+MEDICAL_STATUSES = [('passed', 80), ('failed', 4), ('pending', 12), ('expiring', 4)]
+EVENT_TYPES = ['checkpoint_in', 'checkpoint_out', 'medical_check', 'medical_denied', 'lamp_issue',
+               'lamp_return', 'security_check', 'scan_checkin', 'aho_check_in', 'aho_check_out']
+CHECKPOINTS = ['КПП-1', 'КПП-2', 'КПП-Ствол', 'КПП-Вахта']
+
+
+def weighted(rng, choices):
+    total = sum(w for _, w in choices)
+    pick = rng.uniform(0, total)
+    for value, weight in choices:
+        pick -= weight
+        if pick <= 0:
+            return value
+    return choices[-1][0]
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cur, table, columns, rows):
+    """COPY строк порциями по COPY_CHUNK; rows может быть генератором"""
+    sql = 'COPY %s (%s) FROM STDIN' % (table, ', '.join(columns))
+    total = 0
+    buf = io.StringIO()
+    pending = 0
+    for row in rows:
+        buf.write('\t'.join(copy_value(v) for v in row))
+        buf.write('\n')
+        pending += 1
+        if pending >= COPY_CHUNK:
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+            total += pending
+            buf = io.StringIO()
+            pending = 0
+    if pending:
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+        total += pending
+    return total
+
+
+class Generator:
+    def __init__(self, cur, volumes, seed, anchor, days):
+        self.cur = cur
+        self.volumes = volumes
+        self.rng = random.Random(seed)
+        self.anchor = anchor
+        self.days = days
+        self.people = []
+
+    def moment(self, recent_bias=2.0):
+        """Момент в пределах истории, со сгущением к опорной дате — свежих строк больше, как в жизни"""
+        offset = self.days * 86400 * (self.rng.random() ** recent_bias)
+        return self.anchor - timedelta(seconds=offset)
+
+    def full_name(self):
+        return '%s %s %s' % (self.rng.choice(SURNAMES), self.rng.choice(FIRST_NAMES), self.rng.choice(PATRONYMICS))
+
+    def personnel(self):
+        rng = self.rng
+
+        def rows():
+            for i in range(1, self.volumes['personnel'] + 1):
+                organization, organization_type = rng.choice(ORGANIZATIONS)
+                created = self.moment(1.0)
+                yield (
+                    '%s%06d' % (CODE_PREFIX, i), self.full_name(), rng.choice(POSITIONS), rng.choice(DEPARTMENTS),
+                    weighted(rng, CATEGORIES), '+7900%07d' % rng.randrange(10 ** 7), str(rng.randrange(100, 600)),
+                    weighted(rng, PERSON_STATUSES), 'QR-%s%06d' % (CODE_PREFIX, i), weighted(rng, MEDICAL_STATUSES),
+                    rng.choice(['A', 'B', 'C', 'D']), organization, organization_type, 'Т%06d' % i, created, created
+                )
+
+        count = copy_rows(self.cur, 'personnel', [
+            'personal_code', 'full_name', 'position', 'department', 'category', 'phone', 'room', 'status',
+            'qr_code', 'medical_status', 'shift', 'organization', 'organization_type', 'tabular_number',
+            'created_at', 'updated_at'
+        ], rows())
+        self.cur.execute("""
+            SELECT id, personal_code, full_name, medical_status, organization, organization_type, position, department
+            FROM personnel WHERE personal_code LIKE '%s%%' ORDER BY id
+        """ % CODE_PREFIX)
+        self.people = self.cur.fetchall()
+        return count
+
+    def person(self):
+        return self.rng.choice(self.people)
+
+    def aho(self):
+        rng = self.rng
+        batches = []
+        for i in range(self.volumes['aho_batches']):
+            arrival = (self.anchor - timedelta(days=rng.randrange(self.days))).date()
+            batches.append(('gen-%04d' % i, 'заезд_%04d.xlsx' % i, arrival, arrival + timedelta(days=rng.choice([14, 21, 30]))))
+        per_batch = max(self.volumes['aho_arrivals'] // max(len(batches), 1), 1)
+
+        def arrivals():
+            for batch_id, _, arrival, departure in batches:
+                for _ in range(per_batch):
+                    p = self.person()
+                    status = rng.choice(['expected', 'arrived', 'arrived', 'departed'])
+                    check_in = datetime.combine(arrival, datetime.min.time()) + timedelta(hours=rng.randrange(6, 20)) \
+                        if status != 'expected' else None
+                    check_out = datetime.combine(departure, datetime.min.time()) if status == 'departed' else None
+                    yield (batch_id, p[0], p[2], p[6], p[7], p[4], p[5], '', arrival, departure, status,
+                           check_in, check_out, p[3], p[1], check_in or datetime.combine(arrival, datetime.min.time()))
+
+        count = copy_rows(self.cur, 'aho_arrivals', [
+            'batch_id', 'personnel_id', 'full_name', 'position', 'department', 'organization', 'organization_type',
+            'phone', 'arrival_date', 'departure_date', 'arrival_status', 'check_in_at', 'check_out_at',
+            'medical_status', 'personal_code', 'created_at'
+        ], arrivals())
+        copy_rows(self.cur, 'aho_batches', [
+            'batch_id', 'file_name', 'total_count', 'arrival_date', 'departure_date'
+        ], ((b[0], b[1], per_batch, b[2], b[3]) for b in batches))
+        self.cur.execute("""
+            UPDATE aho_batches b SET
+                arrived_count = (SELECT COUNT(*) FROM aho_arrivals a WHERE a.batch_id = b.batch_id AND a.arrival_status = 'arrived'),
+                departed_count = (SELECT COUNT(*) FROM aho_arrivals a WHERE a.batch_id = b.batch_id AND a.arrival_status = 'departed')
+            WHERE b.batch_id LIKE 'gen-%'
+        """)
+        return count
+
+    def medical_checks(self):
+        rng = self.rng
+
+        def rows():
+            for _ in range(self.volumes['medical_checks']):
+                p = self.person()
+                at = self.moment()
+                passed = rng.random() < 0.95
+                shift_type = 'day' if 6 <= at.hour < 18 else 'night'
+                yield (p[0], rng.choice(['pre_shift', 'post_shift']), 'passed' if passed else 'failed',
+                       '%d/%d' % (rng.randrange(110, 150), rng.randrange(70, 95)), rng.randrange(55, 100),
+                       '0.00' if passed else '%.2f' % rng.uniform(0.1, 0.8), '%.1f' % rng.uniform(36.2, 37.4),
+                       'Смирнова Е.В.', at, shift_type, rng.choice(['to_shift', 'from_shift']), at.date())
+
+        return copy_rows(self.cur, 'medical_checks', [
+            'personnel_id', 'check_type', 'status', 'blood_pressure', 'pulse', 'alcohol_level', 'temperature',
+            'doctor_name', 'checked_at', 'shift_type', 'check_direction', 'shift_date'
+        ], rows())
+
+    def checkpoint_passes(self):
+        rng = self.rng
+
+        def rows():
+            for _ in range(self.volumes['checkpoint_passes']):
+                p = self.person()
+                ok = p[3] in ('passed', 'expiring')
+                direction = rng.choice(['in', 'out'])
+                denied = direction == 'in' and not ok
+                yield (p[0], p[1], p[2], direction, rng.choice(CHECKPOINTS), ok,
+                       'ОТКАЗ: медосмотр не пройден' if denied else '', self.moment())
+
+        return copy_rows(self.cur, 'checkpoint_passes', [
+            'personnel_id', 'personal_code', 'full_name', 'direction', 'checkpoint_name', 'medical_ok', 'notes',
+            'created_at'
+        ], rows())
+
+    def security_checks(self):
+        rng = self.rng
+
+        def rows():
+            for _ in range(self.volumes['security_checks']):
+                p = self.person()
+                result = 'valid' if p[3] in ('passed', 'expiring') else 'medical_issue'
+                if rng.random() < 0.02:
+                    yield (None, 'НЕТ-%05d' % rng.randrange(10 ** 5), 'НЕ НАЙДЕН', 'pass_verification',
+                           'not_found', '', 'СБ-пост', self.moment())
+                else:
+                    yield (p[0], p[1], p[2], 'pass_verification', result, '', 'СБ-пост', self.moment())
+
+        return copy_rows(self.cur, 'security_checks', [
+            'personnel_id', 'personal_code', 'full_name', 'check_type', 'result', 'notes', 'checked_by', 'created_at'
+        ], rows())
+
+    def lamp_room(self):
+        rng = self.rng
+        horizon = self.anchor - timedelta(hours=14)
+
+        def issues():
+            for _ in range(self.volumes['lamp_room_issues']):
+                p = self.person()
+                issued = self.moment()
+                returned = issued + timedelta(hours=rng.uniform(6, 13))
+                open_issue = issued > horizon and rng.random() < 0.6
+                yield (p[0], p[1], p[2], rng.choice(['lantern', 'rescuer', 'both', 'both']),
+                       'Ф-%04d' % rng.randrange(1, 3000), 'СС-%04d' % rng.randrange(1, 3000),
+                       'issued' if open_issue else 'returned', issued, None if open_issue else returned,
+                       'normal' if rng.random() < 0.97 else 'damaged', 'Ламповая-1')
+
+        count = copy_rows(self.cur, 'lamp_room_issues', [
+            'person_id', 'person_code', 'person_name', 'item_type', 'lantern_number', 'rescuer_number', 'status',
+            'issued_at', 'returned_at', 'condition', 'issued_by'
+        ], issues())
+
+        def denials():
+            for _ in range(self.volumes['lamp_room_denials']):
+                p = self.person()
+                yield (p[0], p[1], p[2], rng.choice(['Медосмотр не пройден', 'Нет допуска', 'Алкоголь']),
+                       self.moment(), 'Ламповая-1')
+
+        copy_rows(self.cur, 'lamp_room_denials', [
+            'person_id', 'person_code', 'person_name', 'reason', 'denied_at', 'denied_by'
+        ], denials())
+        return count
+
+    def events(self):
+        rng = self.rng
+
+        def rows():
+            for _ in range(self.volumes['events']):
+                p = self.person()
+                event_type = rng.choice(EVENT_TYPES)
+                yield (event_type, '%s: %s' % (event_type, p[2]), p[0], self.moment())
+
+        return copy_rows(self.cur, 'events', ['event_type', 'description', 'personnel_id', 'created_at'], rows())
+
+    def notifications(self):
+        rng = self.rng
+
+        def rows():
+            for _ in range(self.volumes['notifications']):
+                p = self.person()
+                created = self.moment()
+                yield (rng.choice(['medical_denied', 'lamp_denied', 'checkpoint_denied']), 'Недопуск',
+                       'Недопуск: %s' % p[2], p[2], p[1], created < self.anchor - timedelta(days=1), created)
+
+        return copy_rows(self.cur, 'notifications', [
+            'type', 'title', 'message', 'person_name', 'person_code', 'is_read', 'created_at'
+        ], rows())
+
+    def ohs(self):
+        rng = self.rng
+        count = 0
+        for i in range(self.volumes['ohs_documents']):
+            headers = ['№', 'ФИО', 'Должность', 'Подразделение', 'Дата инструктажа', 'Подпись']
+            self.cur.execute("""
+                INSERT INTO ohs_documents (title, category, file_name, sheets)
+                VALUES ('Реестр инструктажей %d', 'employee_registry', 'registry_%d.xlsx', '["Лист 1", "Лист 2", "Лист 3"]')
+                RETURNING id
+            """ % (i + 1, i + 1))
+            document_id = self.cur.fetchone()[0]
+            sheets = []
+            for s in range(3):
+                body = []
+                for r in range(rng.randrange(300, 1500)):
+                    p = self.person()
+                    body.append([str(r + 1), p[2], p[6], p[7],
+                                 (self.anchor - timedelta(days=rng.randrange(self.days))).strftime('%d.%m.%Y'), ''])
+                sheets.append((document_id, 'Лист %d' % (s + 1), s, headers, body, {}, [], {}, len(body), len(headers)))
+                count += 1
+            copy_rows(self.cur, 'ohs_sheets', [
+                'document_id', 'sheet_name', 'sheet_index', 'headers', 'rows_data', 'formulas', 'merged_cells',
+                'column_widths', 'row_count', 'col_count'
+            ], sheets)
+        return count
+
+
+def reset(cur):
+    """Удаляет прошлую генерацию: всё, что ссылается на персонал с префиксом ГН-, и его самого"""
+    people = "SELECT id FROM personnel WHERE personal_code LIKE '%s%%'" % CODE_PREFIX
+    codes = "SELECT personal_code FROM personnel WHERE personal_code LIKE '%s%%'" % CODE_PREFIX
+    for table, column in [('room_occupancy', 'personnel_id'), ('aho_arrivals', 'personnel_id'),
+                          ('medical_checks', 'personnel_id'), ('checkpoint_passes', 'personnel_id'),
+                          ('security_checks', 'personnel_id'), ('lamp_room_issues', 'person_id'),
+                          ('lamp_room_denials', 'person_id'), ('events', 'personnel_id'),
+                          ('lanterns', 'assigned_to')]:
+        if table == 'lanterns':
+            cur.execute("UPDATE lanterns SET assigned_to = NULL WHERE assigned_to IN (%s)" % people)
+        else:
+            cur.execute("DELETE FROM %s WHERE %s IN (%s)" % (table, column, people))
+    cur.execute("DELETE FROM security_checks WHERE personal_code LIKE 'НЕТ-%' AND checked_by = 'СБ-пост'")
+    cur.execute("DELETE FROM notifications WHERE person_code IN (%s)" % codes)
+    cur.execute("DELETE FROM aho_batches WHERE batch_id LIKE 'gen-%'")
+    cur.execute("DELETE FROM ohs_sheets WHERE document_id IN (SELECT id FROM ohs_documents WHERE file_name LIKE 'registry\\_%' AND title LIKE 'Реестр инструктажей %')")
+    cur.execute("DELETE FROM ohs_documents WHERE file_name LIKE 'registry\\_%' AND title LIKE 'Реестр инструктажей %'")
+    cur.execute("DELETE FROM personnel WHERE personal_code LIKE '%s%%'" % CODE_PREFIX)
+
+
+STEPS = ['personnel', 'aho', 'medical_checks', 'checkpoint_passes', 'security_checks', 'lamp_room', 'events',
+         'notifications', 'ohs']
+
+ANALYZE_TABLES = ['personnel', 'aho_arrivals', 'aho_batches', 'medical_checks', 'checkpoint_passes',
+                  'security_checks', 'lamp_room_issues', 'lamp_room_denials', 'events', 'notifications',
+                  'ohs_documents', 'ohs_sheets']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетические данные для нагрузочных замеров')
+    parser.add_argument('--scale', type=float, default=1.0, help='множитель объёмов BASE_VOLUMES')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--anchor', help='опорная дата YYYY-MM-DD, по умолчанию сегодня')
+    parser.add_argument('--days', type=int, default=90, help='глубина истории в днях')
+    parser.add_argument('--reset', action='store_true', help='удалить прошлую генерацию перед загрузкой')
+    parser.add_argument('--only', nargs='*', choices=STEPS, help='загрузить только указанные разделы')
+    for table in BASE_VOLUMES:
+        parser.add_argument('--%s' % table.replace('_', '-'), type=int, dest=table, help='точный объём %s' % table)
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        sys.exit('Укажите DATABASE_URL локальной базы')
+
+    volumes = {t: getattr(args, t) or max(int(n * args.scale), 1) for t, n in BASE_VOLUMES.items()}
+    anchor = datetime.combine(date.fromisoformat(args.anchor), datetime.min.time()) + timedelta(hours=12) \
+        if args.anchor else datetime.now().replace(microsecond=0)
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    if args.reset:
+        started = time.perf_counter()
+        reset(cur)
+        conn.commit()
+        print('reset: %.1fs' % (time.perf_counter() - started))
+
+    gen = Generator(cur, volumes, args.seed, anchor, args.days)
+    steps = args.only or STEPS
+    if 'personnel' not in steps:
+        cur.execute("""
+            SELECT id, personal_code, full_name, medical_status, organization, organization_type, position, department
+            FROM personnel WHERE personal_code LIKE '%s%%' ORDER BY id
+        """ % CODE_PREFIX)
+        gen.people = cur.fetchall()
+        if not gen.people:
+            sys.exit('Нет сгенерированного персонала — запустите без --only или с --only personnel')
+
+    for step in steps:
+        started = time.perf_counter()
+        count = getattr(gen, step)()
+        conn.commit()
+        print('%-18s %9d rows  %.1fs' % (step, count, time.perf_counter() - started))
+
+    conn.autocommit = True
+    for table in ANALYZE_TABLES:
+        cur.execute('ANALYZE %s' % table)
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""Нагрузочный прогон облачных функций backend/* в одном процессе против локальной Postgres.
+
+Каждый handler вызывается напрямую, как его вызывает платформа. Задержка снимается снаружи,
+число запросов к БД и время в БД — из счётчиков @instrumented. База должна быть заполнена
+генератором данных; сценарии берут из неё личные коды и даты.
+
+    DATABASE_URL=postgresql://localhost/mine_bench python bench/run.py --scenario all \\
+        --iterations 200 --workers 4 --out bench/results/current.json --baseline bench/results/baseline.json
+
+С --import-budget-ms прогон заодно проверяет время холодного импорта функций (bench/coldstart.py).
+"""
+import argparse
+import base64
+import importlib.util
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from multiprocessing import Pool
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+os.environ.setdefault('REQUEST_LOG', '0')
+
+_modules = {}
+
+
+def load_function(name):
+    """index.py функции как отдельный модуль со своей копией core — у каждой функции свои кэши и пул, как в облаке"""
+    if name not in _modules:
+        directory = os.path.join(BACKEND, name)
+        spec = importlib.util.spec_from_file_location('bench_%s' % name.replace('-', '_'),
+                                                      os.path.join(directory, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules.pop('core', None)
+        sys.path.insert(0, directory)
+        try:
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.remove(directory)
+        _modules[name] = (module, sys.modules.pop('core'))
+    return _modules[name]
+
+
+def call(name, method, action, params=None, body=None, headers=None):
+    """Один вызов handler; возвращает (статус, мс, запросов, мс в БД, байт ответа)"""
+    module, core = load_function(name)
+    query = dict(params or {})
+    query['action'] = action
+    event = {
+        'httpMethod': method,
+        'queryStringParameters': query,
+        'headers': headers or {},
+        'body': json.dumps(body) if body is not None else None,
+    }
+    started = time.perf_counter()
+    response = module.handler(event, None)
+    elapsed = (time.perf_counter() - started) * 1000
+    stats = core._request_stats
+    body_text = response.get('body') or ''
+    return response['statusCode'], elapsed, stats['queries'], stats['db_ms'], len(body_text)
+
+
+def load_fixtures():
+    """Личные коды, на которых строятся сценарии сканирования"""
+    conn = load_function('personnel')[1].get_db()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT personal_code FROM personnel
+        WHERE is_hidden = FALSE AND is_demo_data = FALSE AND status != 'archived'
+        ORDER BY random() LIMIT 5000
+    """)
+    codes = [r[0] for r in cur.fetchall()]
+    cur.close()
+    conn.close()
+    if not codes:
+        sys.exit('В базе нет персонала — сначала запустите bench/generate.py')
+    return {'codes': codes}
+
+
+def step_scan_storm(rng, fixtures):
+    """Пересменка: поток сканов на КПП, медосмотре и сканере по случайным сотрудникам"""
+    code = rng.choice(fixtures['codes'])
+    kind = rng.random()
+    if kind < 0.5:
+        return 'checkpoint.pass', ('checkpoint', 'POST', 'pass', None,
+                                   {'code': code, 'direction': rng.choice(['in', 'out']), 'checkpoint_name': 'КПП-1'})
+    if kind < 0.8:
+        return 'medical.scan', ('medical', 'POST', 'scan', None, {'code': code})
+    return 'scanner.checkin', ('scanner', 'POST', 'checkin', None, {'code': code})
+
+
+DASHBOARD_CALLS = [
+    ('events.dashboard', ('events', 'GET', 'dashboard', None, None)),
+    ('personnel.stats', ('personnel', 'GET', 'stats', None, None)),
+    ('medical.stats', ('medical', 'GET', 'stats', None, None)),
+    ('checkpoint.stats', ('checkpoint', 'GET', 'stats', None, None)),
+    ('security.stats', ('security', 'GET', 'stats', None, None)),
+    ('aho.stats', ('aho', 'GET', 'stats', None, None)),
+    ('events.list', ('events', 'GET', 'list', {'limit': '50'}, None)),
+]
+
+
+def step_dashboard(rng, fixtures):
+    """Опрос дашбордов: статистика всех разделов и лента событий"""
+    return rng.choice(DASHBOARD_CALLS)
+
+
+def step_report_export(rng, fixtures):
+    """Месячные отчёты и их выгрузка в CSV"""
+    today = date.today()
+    params = {'date_from': str(today - timedelta(days=30)), 'date_to': str(today)}
+    report = rng.choice(['attendance', 'medical', 'equipment', 'personnel-summary', 'events-log'])
+    if rng.random() < 0.5:
+        return 'reports.%s' % report, ('reports', 'GET', report, params, None)
+    params['report_type'] = report
+    return 'reports.export', ('reports', 'GET', 'export', params, None)
+
+
+def build_aho_workbook(rng, rows):
+    import openpyxl
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['ФИО', 'Табельный №', 'Должность', 'Подразделение', 'Организация', 'Телефон'])
+    for i in range(rows):
+        ws.append(['Нагрузочный Тест %05d' % rng.randrange(100000), 'Т%06d' % i, 'Проходчик',
+                   'Участок %d' % rng.randrange(1, 12), 'ООО Подряд-%d' % rng.randrange(1, 30),
+                   '+7900%07d' % rng.randrange(10000000)])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def step_aho_upload(rng, fixtures):
+    """Загрузка заезда АХО на 2000 строк"""
+    if 'aho_file' not in fixtures:
+        fixtures['aho_file'] = build_aho_workbook(rng, 2000)
+    today = date.today()
+    return 'aho.upload', ('aho', 'POST', 'upload', None, {
+        'file': fixtures['aho_file'], 'file_name': 'bench.xlsx',
+        'arrival_date': str(today), 'departure_date': str(today + timedelta(days=14)),
+        'organization_type': 'contractor'
+    })
+
+
+SCENARIOS = {
+    'scan-storm': (step_scan_storm, 1.0),
+    'dashboard': (step_dashboard, 1.0),
+    'report-export': (step_report_export, 0.1),
+    'aho-upload': (step_aho_upload, 0.01),
+}
+
+
+def run_worker(args):
+    """Прогон сценария в отдельном процессе; возвращает сырые замеры по шагам"""
+    scenario, iterations, seed = args
+    rng = random.Random(seed)
+    fixtures = load_fixtures()
+    step, _ = SCENARIOS[scenario]
+    samples = {}
+    for _ in range(iterations):
+        name, (function, method, action, params, body) = step(rng, fixtures)
+        status, ms, queries, db_ms, size = call(function, method, action, params, body)
+        samples.setdefault(name, []).append((status, ms, queries, db_ms, size))
+    return samples
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(int(round(p / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(samples, wall_seconds):
+    result = {}
+    for name, rows in sorted(samples.items()):
+        latencies = [r[1] for r in rows]
+        result[name] = {
+            'count': len(rows),
+            'errors': sum(1 for r in rows if r[0] >= 500),
+            'client_errors': sum(1 for r in rows if 400 <= r[0] < 500),
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'mean_queries': round(statistics.mean(r[2] for r in rows), 2),
+            'mean_db_ms': round(statistics.mean(r[3] for r in rows), 1),
+            'mean_bytes': int(statistics.mean(r[4] for r in rows)),
+            'rps': round(len(rows) / wall_seconds, 1) if wall_seconds else 0,
+        }
+    return result
+
+
+def print_report(scenario, summary, baseline):
+    print('\n== %s' % scenario)
+    print('%-28s %7s %6s %6s %9s %9s %9s %8s %9s' % ('step', 'count', 'err', '4xx', 'p50', 'p95', 'p99', 'queries', 'vs base'))
+    for name, s in summary.items():
+        delta = ''
+        base = (baseline or {}).get(scenario, {}).get(name)
+        if base and base['p95_ms']:
+            delta = '%+.0f%%' % ((s['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100)
+        print('%-28s %7d %6d %6d %9.1f %9.1f %9.1f %8.2f %9s' % (
+            name, s['count'], s['errors'], s['client_errors'], s['p50_ms'], s['p95_ms'], s['p99_ms'],
+            s['mean_queries'], delta))
+    rejected = [name for name, s in summary.items() if s['client_errors'] * 10 > s['count']]
+    if rejected:
+        print('Больше 10%% ответов 4xx (SCAN_REQUIRE_AUTH, данные генератора?) — задержки не показательны: %s'
+              % ', '.join(rejected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон backend-функций')
+    parser.add_argument('--scenario', default='all', choices=['all'] + sorted(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=200, help='вызовов на процесс для сценария с весом 1')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='куда записать результаты в JSON')
+    parser.add_argument('--baseline', help='результаты прошлого прогона для сравнения p95')
+    parser.add_argument('--import-budget-ms', type=float, default=0,
+                        help='бюджет холодного импорта index.py каждой функции; 0 — не проверять')
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        sys.exit('Укажите DATABASE_URL локальной базы')
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scenarios']
+
+    scenarios = sorted(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    results = {}
+    for scenario in scenarios:
+        iterations = max(int(args.iterations * SCENARIOS[scenario][1]), 1)
+        jobs = [(scenario, iterations, args.seed * 1000 + w) for w in range(args.workers)]
+        started = time.perf_counter()
+        if args.workers > 1:
+            with Pool(args.workers) as pool:
+                parts = pool.map(run_worker, jobs)
+        else:
+            parts = [run_worker(jobs[0])]
+        wall = time.perf_counter() - started
+        samples = {}
+        for part in parts:
+            for name, rows in part.items():
+                samples.setdefault(name, []).extend(rows)
+        results[scenario] = summarize(samples, wall)
+        print_report(scenario, results[scenario], baseline)
+
+    cold_start, over_budget = None, []
+    if args.import_budget_ms:
+        import coldstart
+        print('\n== cold-start (бюджет %.0f мс)' % args.import_budget_ms)
+        cold_start, over_budget = coldstart.run(coldstart.function_names(), 3, args.import_budget_ms)
+        coldstart.print_report(cold_start, args.import_budget_ms)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump({'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'args': vars(args), 'scenarios': results,
+                       'cold_start': cold_start}, f, ensure_ascii=False, indent=2)
+
+    if over_budget:
+        sys.exit('Импорт дольше %.0f мс: %s' % (args.import_budget_ms, ', '.join(over_budget)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_aho_arrivals_visible_status ON aho_arrivals(arrival_status) WHERE is_hidden = FALSE;
@@ -0,0 +1,2 @@
+ALTER TABLE rooms DROP CONSTRAINT IF EXISTS rooms_room_number_key;
+ALTER TABLE rooms ADD CONSTRAINT rooms_building_room_number_key UNIQUE (building_id, room_number);
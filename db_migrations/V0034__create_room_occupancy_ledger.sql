@@ -0,0 +1,27 @@
+
+CREATE TABLE IF NOT EXISTS room_occupancy (
+    id SERIAL PRIMARY KEY,
+    room_id INTEGER NOT NULL REFERENCES rooms(id),
+    arrival_id INTEGER NOT NULL REFERENCES aho_arrivals(id),
+    personnel_id INTEGER REFERENCES personnel(id),
+    assigned_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    released_at TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_room_occupancy_active_arrival ON room_occupancy(arrival_id) WHERE released_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_room_occupancy_active_room ON room_occupancy(room_id) WHERE released_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_rooms_free_beds ON rooms(building_id, occupied DESC, floor, room_number) WHERE is_active = TRUE AND occupied < capacity;
+
+INSERT INTO room_occupancy (room_id, arrival_id, personnel_id, assigned_at)
+SELECT DISTINCT ON (a.id) r.id, a.id, a.personnel_id, COALESCE(a.check_in_at, a.updated_at)
+FROM aho_arrivals a
+JOIN buildings b ON b.name = a.building
+JOIN rooms r ON r.building_id = b.id AND r.room_number = a.room
+WHERE a.arrival_status = 'arrived' AND a.is_hidden = FALSE
+  AND a.room IS NOT NULL AND a.room != '' AND r.is_active = TRUE
+ORDER BY a.id, r.id;
+
+UPDATE rooms r SET occupied = (
+    SELECT COUNT(*) FROM room_occupancy o WHERE o.room_id = r.id AND o.released_at IS NULL
+)
+WHERE r.is_demo_data = FALSE;
@@ -0,0 +1,4 @@
+DROP INDEX IF EXISTS idx_sessions_token;
+CREATE INDEX IF NOT EXISTS idx_sessions_token_live ON sessions(token) INCLUDE (user_id, expires_at, is_demo);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id);
@@ -0,0 +1,11 @@
+
+CREATE TABLE IF NOT EXISTS token_revocations (
+    id SERIAL PRIMARY KEY,
+    jti VARCHAR(64),
+    user_id INTEGER REFERENCES users(id),
+    revoked_before BIGINT,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_token_revocations_expires ON token_revocations(expires_at);
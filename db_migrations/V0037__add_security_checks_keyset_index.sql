@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_security_checks_created_id ON security_checks(created_at DESC, id DESC);
@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS idx_checkpoint_passes_demo_created ON checkpoint_passes(is_demo_data, created_at);
+CREATE INDEX IF NOT EXISTS idx_security_checks_demo_created ON security_checks(is_demo_data, created_at);
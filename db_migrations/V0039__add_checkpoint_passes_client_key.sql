@@ -0,0 +1,3 @@
+ALTER TABLE checkpoint_passes ADD COLUMN client_key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_checkpoint_passes_client_key ON checkpoint_passes(client_key) WHERE client_key IS NOT NULL;
@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS slow_queries (
+    id SERIAL PRIMARY KEY,
+    function_name VARCHAR(50) NOT NULL,
+    action VARCHAR(100) NOT NULL DEFAULT '',
+    duration_ms NUMERIC(12, 1) NOT NULL,
+    normalized_sql TEXT NOT NULL,
+    plan JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_slow_queries_created ON slow_queries(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_slow_queries_function_action ON slow_queries(function_name, action);
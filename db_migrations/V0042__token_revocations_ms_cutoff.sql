@@ -0,0 +1,4 @@
+ALTER TABLE token_revocations DROP CONSTRAINT IF EXISTS token_revocations_user_id_fkey;
+
+UPDATE token_revocations SET revoked_before = revoked_before * 1000
+WHERE revoked_before IS NOT NULL AND revoked_before < 100000000000;
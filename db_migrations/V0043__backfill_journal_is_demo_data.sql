@@ -0,0 +1,7 @@
+UPDATE checkpoint_passes cp SET is_demo_data = TRUE
+FROM personnel p
+WHERE cp.personnel_id = p.id AND p.is_demo_data = TRUE AND cp.is_demo_data = FALSE;
+
+UPDATE security_checks sc SET is_demo_data = TRUE
+FROM personnel p
+WHERE sc.personnel_id = p.id AND p.is_demo_data = TRUE AND sc.is_demo_data = FALSE;
@@ -0,0 +1,16 @@
+INSERT INTO room_occupancy (room_id, arrival_id, personnel_id, assigned_at)
+SELECT DISTINCT ON (a.id) r.id, a.id, a.personnel_id, COALESCE(a.check_in_at, a.updated_at)
+FROM aho_arrivals a
+JOIN buildings b ON b.name = a.building
+JOIN rooms r ON r.building_id = b.id AND r.room_number = a.room
+WHERE a.arrival_status IN ('expected', 'arrived') AND a.is_hidden = FALSE
+  AND a.room IS NOT NULL AND a.room != '' AND r.is_active = TRUE
+  AND NOT EXISTS (
+      SELECT 1 FROM room_occupancy o WHERE o.arrival_id = a.id AND o.released_at IS NULL
+  )
+ORDER BY a.id, r.id;
+
+UPDATE rooms r SET occupied = (
+    SELECT COUNT(*) FROM room_occupancy o WHERE o.room_id = r.id AND o.released_at IS NULL
+)
+WHERE r.is_demo_data = FALSE;
@@ -0,0 +1,851 @@
+"""Общее ядро backend-функций: подключение к БД, инструментирование, JSON-ответы, сжатие, кэши.
+
+Источник — shared/core.py. В каталог каждой функции кладётся копия (python shared/vendor.py),
+потому что функции разворачиваются по отдельности и видят только свой каталог.
+"""
+import json
+import os
+import functools
+import random
+import re
+from time import perf_counter, monotonic, time
+import base64
+import gzip
+import hashlib
+import hmac
+from datetime import datetime, date as date_type
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+psycopg2 = None
+brotli = None
+
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '') == '1'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '500'))
+EXPLAIN_SAMPLE_RATE = float(os.environ.get('EXPLAIN_SAMPLE_RATE', '0'))
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '2'))
+DB_POOL_IDLE_SECONDS = float(os.environ.get('DB_POOL_IDLE_SECONDS', '60'))
+DB_POOL_PING_SECONDS = float(os.environ.get('DB_POOL_PING_SECONDS', '5'))
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+BATCH_MAX = int(os.environ.get('BATCH_MAX', '20'))
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+DB_READ_MAX_LAG_SECONDS = float(os.environ.get('DB_READ_MAX_LAG_SECONDS', '5'))
+DB_READ_LAG_CHECK_SECONDS = float(os.environ.get('DB_READ_LAG_CHECK_SECONDS', '5'))
+DB_READ_RETRY_SECONDS = float(os.environ.get('DB_READ_RETRY_SECONDS', '30'))
+DB_READ_CONNECT_TIMEOUT = int(os.environ.get('DB_READ_CONNECT_TIMEOUT', '2'))
+TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+SIGNED_TOKEN_PREFIX = 'v1.'
+REVOCATION_CACHE_TTL = int(os.environ.get('AUTH_REVOCATION_CACHE_TTL', '30'))
+TOKEN_MAX_DAYS = 7
+SCAN_REQUIRE_AUTH = os.environ.get('SCAN_REQUIRE_AUTH', '') == '1'
+JOURNAL_STATS_TTL = int(os.environ.get('JOURNAL_STATS_TTL', '10'))
+JOURNAL_HISTORY_TTL = int(os.environ.get('JOURNAL_HISTORY_TTL', '3600'))
+
+CATEGORY_LABELS = {
+    'mine': 'Рудничный', 'contractor': 'Подрядчик',
+    'business_trip': 'Командированный', 'guest': 'Гость'
+}
+ORG_TYPE_LABELS = {
+    'rudnik': 'Рудник', 'guest': 'Гость',
+    'contractor': 'Подрядная организация', 'gov': 'Гос.органы'
+}
+MEDICAL_LABELS = {
+    'passed': 'Пройден', 'failed': 'Не пройден',
+    'pending': 'Ожидает', 'expiring': 'Истекает'
+}
+SHIFT_LABELS = {'day': 'Дневная', 'night': 'Ночная'}
+DIRECTION_LABELS = {'to_shift': 'На смену', 'from_shift': 'Со смены'}
+
+_request_stats = {}
+
+def reset_request_stats():
+    _request_stats.update(action='', connections=0, reused=0, connect_ms=0.0, queries=0, db_ms=0.0, rows=0,
+                          replica=False)
+
+reset_request_stats()
+
+def normalize_sql(query):
+    """Текст запроса без литералов и лишних пробелов — для группировки одинаковых запросов"""
+    text = re.sub(r"'(?:[^']|'')*'", '?', query)
+    text = re.sub(r'\b\d+(?:\.\d+)?\b', '?', text)
+    return ' '.join(text.split())
+
+def explainable(normalized):
+    """EXPLAIN ANALYZE выполняет запрос повторно, поэтому только для чтения и без блокировок строк"""
+    upper = normalized.upper()
+    if not (upper.startswith('SELECT') or upper.startswith('WITH')):
+        return False
+    return not re.search(r'\b(INSERT|UPDATE|DELETE|FOR SHARE|FOR UPDATE|NEXTVAL|SETVAL)\b', upper)
+
+def report_slow_query(cur, query, vars, elapsed_ms):
+    """Запрос дольше SLOW_QUERY_MS: строка в лог, а для доли EXPLAIN_SAMPLE_RATE — план в slow_queries.
+
+    EXPLAIN выполняется на той базе, где шёл запрос, план записывается на основную.
+    """
+    function_name = _request_stats.get('function', '')
+    text = query if vars is None else cur.mogrify(query, vars).decode()
+    normalized = normalize_sql(text)
+    print(json.dumps({
+        'slow_query': True, 'function': function_name, 'action': _request_stats['action'],
+        'ms': round(elapsed_ms, 1), 'sql': normalized[:2000]
+    }, ensure_ascii=False))
+
+    if cur.name or random.random() >= EXPLAIN_SAMPLE_RATE or not explainable(normalized):
+        return
+    try:
+        conn = psycopg2.connect(DATABASE_READ_URL if cur.connection.replica else os.environ['DATABASE_URL'])
+        try:
+            explain = conn.cursor()
+            explain.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + text)
+            plan = json.dumps(explain.fetchone()[0], ensure_ascii=False)
+            conn.rollback()
+            if cur.connection.replica:
+                conn.close()
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                explain = conn.cursor()
+            explain.execute("""
+                INSERT INTO slow_queries (function_name, action, duration_ms, normalized_sql, plan)
+                VALUES ('%s', '%s', %.1f, '%s', '%s'::jsonb)
+            """ % (function_name, _request_stats['action'].replace("'", "''"), elapsed_ms,
+                   normalized.replace("'", "''"), plan.replace("'", "''")))
+            conn.commit()
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        print(json.dumps({'slow_query_explain_error': str(e)[:200], 'function': function_name}, ensure_ascii=False))
+
+TimedCursor = None
+PooledConnection = None
+_pool = []
+_read_pool = []
+_batch = {'conn': None, 'snapshot': False}
+_routing = {'read_actions': frozenset(), 'read': False}
+_replica = {'checked_at': None, 'retry_at': 0.0, 'lag': None}
+
+def load_psycopg2():
+    """psycopg2 (libpq) загружается при первом обращении к БД, а не при холодном старте.
+
+    Preflight OPTIONS и ответы из кэша экземпляра обходятся без него.
+    """
+    global psycopg2, TimedCursor, PooledConnection
+    if psycopg2 is not None:
+        return psycopg2
+    import psycopg2 as module
+
+    class TimedCursor(module.extensions.cursor):
+        """Курсор, считающий запросы, время в БД и выбранные строки текущего запроса"""
+
+        def timed(self, method, *args):
+            started = perf_counter()
+            try:
+                return method(*args)
+            finally:
+                _request_stats['db_ms'] += (perf_counter() - started) * 1000
+
+        def execute(self, query, vars=None):
+            _request_stats['queries'] += 1
+            started = perf_counter()
+            result = self.timed(super().execute, query, vars)
+            elapsed_ms = (perf_counter() - started) * 1000
+            if elapsed_ms >= SLOW_QUERY_MS:
+                report_slow_query(self, query, vars, elapsed_ms)
+            return result
+
+        def fetchone(self):
+            row = self.timed(super().fetchone)
+            if row is not None:
+                _request_stats['rows'] += 1
+            return row
+
+        def fetchmany(self, size=None):
+            rows = self.timed(super().fetchmany, self.arraysize if size is None else size)
+            _request_stats['rows'] += len(rows)
+            return rows
+
+        def fetchall(self):
+            rows = self.timed(super().fetchall)
+            _request_stats['rows'] += len(rows)
+            return rows
+
+        def __iter__(self):
+            while True:
+                rows = self.fetchmany(self.itersize)
+                if not rows:
+                    return
+                yield from rows
+
+    class PooledConnection(module.extensions.connection):
+        """close() возвращает соединение в пул тёплого экземпляра вместо разрыва"""
+
+        replica = False
+
+        def close(self):
+            # общее соединение пакета (run_batch) не закрывается и не откатывается подзапросами и их
+            # помощниками: незафиксированное ещё нужно вызывающему обработчику, а откат после
+            # подзапроса и возврат в пул делает сам run_batch
+            if self is _batch['conn']:
+                return
+            if not release_connection(self):
+                super().close()
+
+        def commit(self):
+            """В пакете из одних GET фиксация на общем соединении закончила бы снимок — это ошибка подзапроса"""
+            if self is _batch['conn'] and _batch['snapshot']:
+                raise RuntimeError('commit() в пакете чтения: запись должна идти через get_db(primary=True)')
+            super().commit()
+
+        def rollback(self):
+            """В пакете из одних GET откатывается только текущий подзапрос, снимок сохраняется"""
+            if self is _batch['conn'] and _batch['snapshot']:
+                try:
+                    module.extensions.cursor(self).execute('ROLLBACK TO SAVEPOINT batch_item')
+                    return
+                except module.Error:
+                    pass
+            super().rollback()
+
+    psycopg2 = module
+    return psycopg2
+
+def release_connection(conn):
+    """Откатывает незавершённую транзакцию и кладёт соединение в пул; False — закрыть по-настоящему"""
+    pool = _read_pool if conn.replica else _pool
+    if conn.closed or len(pool) >= DB_POOL_SIZE:
+        return False
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        return False
+    pool.append((monotonic(), conn))
+    return True
+
+def pooled_connection(pool=_pool):
+    """Соединение из пула: простоявшее дольше DB_POOL_IDLE_SECONDS закрывается, после DB_POOL_PING_SECONDS проверяется"""
+    while pool:
+        released_at, conn = pool.pop()
+        idle = monotonic() - released_at
+        if conn.closed or idle > DB_POOL_IDLE_SECONDS:
+            psycopg2.extensions.connection.close(conn)
+            continue
+        if idle > DB_POOL_PING_SECONDS:
+            try:
+                ping = psycopg2.extensions.cursor(conn)
+                ping.execute('SELECT 1')
+                ping.close()
+                conn.rollback()
+            except psycopg2.Error:
+                psycopg2.extensions.connection.close(conn)
+                continue
+        return conn
+    return None
+
+def replica_lag(conn):
+    """Отставание реплики в секундах; 0 — если догнала мастер или это вовсе не реплика"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+    """)
+    lag = float(cur.fetchone()[0])
+    cur.close()
+    conn.rollback()
+    return lag
+
+def replica_connection():
+    """Соединение с DATABASE_READ_URL или None, если реплика не задана, недоступна или отстала.
+
+    Отставание проверяется не чаще раза в DB_READ_LAG_CHECK_SECONDS; после ошибки подключения
+    или отставания больше DB_READ_MAX_LAG_SECONDS реплика не используется DB_READ_RETRY_SECONDS.
+    """
+    if not DATABASE_READ_URL or monotonic() < _replica['retry_at']:
+        return None
+    conn = pooled_connection(_read_pool)
+    if conn is not None:
+        _request_stats['reused'] += 1
+    else:
+        started = perf_counter()
+        try:
+            conn = psycopg2.connect(DATABASE_READ_URL, connection_factory=PooledConnection,
+                                    cursor_factory=TimedCursor, connect_timeout=DB_READ_CONNECT_TIMEOUT)
+            conn.replica = True
+            conn.set_session(readonly=True)
+        except psycopg2.Error as e:
+            _replica['retry_at'] = monotonic() + DB_READ_RETRY_SECONDS
+            print(json.dumps({'replica_unavailable': str(e)[:200], 'function': _request_stats.get('function')},
+                             ensure_ascii=False))
+            return None
+        finally:
+            _request_stats['connect_ms'] += (perf_counter() - started) * 1000
+        _request_stats['connections'] += 1
+    if _replica['checked_at'] is None or monotonic() - _replica['checked_at'] > DB_READ_LAG_CHECK_SECONDS:
+        try:
+            _replica['lag'] = replica_lag(conn)
+        except psycopg2.Error:
+            _replica['lag'] = None
+        _replica['checked_at'] = monotonic()
+        if _replica['lag'] is None or _replica['lag'] > DB_READ_MAX_LAG_SECONDS:
+            _replica['retry_at'] = monotonic() + DB_READ_RETRY_SECONDS
+            print(json.dumps({'replica_lagging': _replica['lag'], 'function': _request_stats.get('function')},
+                             ensure_ascii=False))
+            conn.close()
+            return None
+    _request_stats['replica'] = True
+    return conn
+
+def get_db(primary=False):
+    """Соединение с БД. Для действий из read_actions (@instrumented) — с репликой, если она в порядке.
+
+    primary=True — всегда мастер и своё соединение, а не общее соединение пакета со снимком:
+    для записи, которую функция делает попутно при чтении.
+    """
+    load_psycopg2()
+    pinned = _batch['conn']
+    if pinned is not None and not (primary and (pinned.replica or _batch['snapshot'])):
+        _request_stats['reused'] += 1
+        return pinned
+    if _routing['read'] and not primary:
+        conn = replica_connection()
+        if conn is not None:
+            return conn
+    conn = pooled_connection()
+    if conn is not None:
+        _request_stats['reused'] += 1
+        return conn
+    started = perf_counter()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=PooledConnection,
+                            cursor_factory=TimedCursor)
+    _request_stats['connections'] += 1
+    _request_stats['connect_ms'] += (perf_counter() - started) * 1000
+    return conn
+
+def instrumented(function_name, read_actions=()):
+    """Замер обработки запроса: длительность, подключение, запросы и время в БД, строки, размер ответа.
+
+    Пишет одну JSON-строку в лог на запрос (REQUEST_LOG) и при SERVER_TIMING=1 добавляет заголовок Server-Timing.
+    Ответ проходит через finalize_response (ETag, 304, сжатие). GET-действия из read_actions
+    get_db() ведёт на DATABASE_READ_URL, если она задана.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(event, context):
+            reset_request_stats()
+            _request_stats['function'] = function_name
+            _request_stats['action'] = (event.get('queryStringParameters') or {}).get('action', '')
+            _routing['read_actions'] = frozenset(read_actions)
+            _routing['read'] = event.get('httpMethod', 'GET') == 'GET' and _request_stats['action'] in read_actions
+            started = perf_counter()
+            response = None
+            try:
+                response = finalize_response(event, func(event, context))
+                return response
+            finally:
+                _routing['read'] = False
+                total_ms = (perf_counter() - started) * 1000
+                body = (response or {}).get('body') or ''
+                stats = {
+                    'function': function_name,
+                    'method': event.get('httpMethod', 'GET'),
+                    'action': _request_stats['action'],
+                    'status': (response or {}).get('statusCode', 500),
+                    'total_ms': round(total_ms, 1),
+                    'connect_ms': round(_request_stats['connect_ms'], 1),
+                    'connections': _request_stats['connections'],
+                    'reused': _request_stats['reused'],
+                    'queries': _request_stats['queries'],
+                    'db_ms': round(_request_stats['db_ms'], 1),
+                    'rows': _request_stats['rows'],
+                    'replica': _request_stats['replica'],
+                    'response_bytes': len(body.encode()) if isinstance(body, str) else len(body),
+                }
+                if REQUEST_LOG:
+                    print(json.dumps(stats, ensure_ascii=False))
+                if SERVER_TIMING and response is not None:
+                    headers = response.setdefault('headers', {})
+                    headers['Server-Timing'] = 'connect;dur=%.1f, db;dur=%.1f;desc="%d queries", app;dur=%.1f, total;dur=%.1f' % (
+                        stats['connect_ms'], stats['db_ms'], stats['queries'],
+                        max(total_ms - stats['connect_ms'] - stats['db_ms'], 0), total_ms)
+                    headers['Timing-Allow-Origin'] = '*'
+                    expose_header(headers, 'Server-Timing')
+        return wrapper
+    return decorator
+
+def serialize_default(obj):
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            return obj.isoformat() + '+00:00'
+        return obj.isoformat()
+    if isinstance(obj, (date_type,)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+def encode_json(body):
+    """orjson сам кодирует datetime/date без вызова serialize_default на каждое значение"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(body, default=serialize_default,
+                                option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS).decode()
+        except (TypeError, orjson.JSONEncodeError):
+            pass
+    return json.dumps(body, ensure_ascii=False, default=serialize_default)
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Demo, Idempotency-Key'
+}
+
+def json_response(status, body):
+    return {
+        'statusCode': status,
+        'headers': dict(CORS_HEADERS, **{'Content-Type': 'application/json'}),
+        'body': encode_json(body)
+    }
+
+def csv_response(csv_text, filename):
+    return {
+        'statusCode': 200,
+        'headers': dict(CORS_HEADERS, **{
+            'Content-Type': 'text/csv; charset=utf-8',
+            'Content-Disposition': 'attachment; filename="%s"' % filename
+        }),
+        'body': csv_text
+    }
+
+def request_header(event, name):
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+def is_demo_request(event):
+    return request_header(event, 'X-Demo') == 'true'
+
+def etag_matches(event, etag):
+    """If-None-Match совпадает с ETag; W/ и суффикс кодировки (-gzip, -br) не учитываются"""
+    header = request_header(event, 'If-None-Match').strip()
+    if not header:
+        return False
+    if header == '*':
+        return True
+    base = etag.strip('"')
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        for suffix in ('-gzip', '-br'):
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)]
+        if tag == base:
+            return True
+    return False
+
+def expose_header(headers, name):
+    """Дописывает заголовок в Access-Control-Expose-Headers, не затирая уже открытые обработчиком"""
+    exposed = headers.get('Access-Control-Expose-Headers')
+    if not exposed:
+        headers['Access-Control-Expose-Headers'] = name
+    elif name.lower() not in [h.strip().lower() for h in exposed.split(',')]:
+        headers['Access-Control-Expose-Headers'] = exposed + ', ' + name
+
+def not_modified(event, etag):
+    """304 без тела, если у клиента уже есть эта версия данных; иначе None"""
+    if not etag_matches(event, etag):
+        return None
+    response = json_response(304, '')
+    response['body'] = ''
+    response['headers']['ETag'] = etag
+    response['headers']['Cache-Control'] = 'no-cache'
+    expose_header(response['headers'], 'ETag')
+    return response
+
+def accepted_encodings(event):
+    result = set()
+    for part in request_header(event, 'Accept-Encoding').lower().split(','):
+        coding, _, q = part.strip().partition(';')
+        q = q.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            result.add(coding.strip())
+    return result
+
+def load_brotli():
+    """brotli необязателен и нужен только для сжатия крупных ответов — импорт при первом таком ответе"""
+    global brotli
+    if brotli is None:
+        try:
+            import brotli as module
+        except ImportError:
+            module = False
+        brotli = module
+    return brotli
+
+def finalize_response(event, response):
+    """Сильный ETag и 304 для успешных GET, сжатие gzip/br ответов от COMPRESS_MIN_BYTES.
+
+    ETag, выставленный обработчиком по версии данных, сохраняется; иначе считается хеш тела.
+    Сжатое тело отдаётся в base64 с isBase64Encoded, как требует платформа функций.
+    """
+    body = response.get('body')
+    if not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+    headers = response.setdefault('headers', {})
+    if event.get('httpMethod', 'GET') == 'GET' and response.get('statusCode') == 200:
+        etag = headers.get('ETag') or '"%s"' % hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+        expose_header(headers, 'ETag')
+        if etag_matches(event, etag):
+            response['statusCode'] = 304
+            response['body'] = ''
+            return response
+    raw = body.encode()
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return response
+    headers['Vary'] = 'Accept-Encoding'
+    accepted = accepted_encodings(event)
+    if 'br' in accepted and load_brotli():
+        encoding, compressed = 'br', brotli.compress(raw, quality=5)
+    elif 'gzip' in accepted:
+        encoding, compressed = 'gzip', gzip.compress(raw, compresslevel=6, mtime=0)
+    else:
+        return response
+    response['body'] = base64.b64encode(compressed).decode()
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if 'ETag' in headers:
+        headers['ETag'] = '%s-%s"' % (headers['ETag'][:-1], encoding)
+    return response
+
+class TTLCache:
+    """Кэш тёплого экземпляра функции: запись живёт ttl секунд, при переполнении кэш очищается целиком"""
+
+    def __init__(self, ttl, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.items = {}
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        if monotonic() >= item[0]:
+            self.items.pop(key, None)
+            return None
+        return item[1]
+
+    def set(self, key, value, ttl=None):
+        if key not in self.items and len(self.items) >= self.max_size:
+            self.items.clear()
+        self.items[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+        return value
+
+    def pop(self, key):
+        item = self.items.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        self.items.clear()
+
+_revocations = {'loaded_at': 0.0, 'jti': set(), 'users': {}}
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def b64url_decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def sign_token_body(body):
+    return b64url(hmac.new(TOKEN_SECRET.encode(), body.encode(), hashlib.sha256).digest())
+
+def get_auth_token(event):
+    headers = event.get('headers') or {}
+    for key in ['X-Authorization', 'x-authorization', 'Authorization', 'authorization']:
+        val = headers.get(key, '')
+        if val:
+            return val.replace('Bearer ', '') if val.startswith('Bearer ') else val
+    return ''
+
+def load_revocations():
+    """Список отозванных токенов, кэшируется на REVOCATION_CACHE_TTL секунд"""
+    if monotonic() - _revocations['loaded_at'] < REVOCATION_CACHE_TTL:
+        return _revocations
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT jti, user_id, revoked_before FROM token_revocations WHERE expires_at > NOW()")
+    jti = set()
+    users = {}
+    for r in cur.fetchall():
+        if r[0]:
+            jti.add(r[0])
+        if r[1] and r[2]:
+            users[r[1]] = max(users.get(r[1], 0), r[2])
+    cur.close()
+    conn.close()
+    _revocations.update({'loaded_at': monotonic(), 'jti': jti, 'users': users})
+    return _revocations
+
+def verify_signed_token(token):
+    """Локальная проверка подписанного токена auth без запроса к таблице сессий"""
+    if not TOKEN_SECRET or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        body, sig = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        if not hmac.compare_digest(sig, sign_token_body(body)):
+            return None
+        payload = json.loads(b64url_decode(body))
+    except (ValueError, TypeError):
+        return None
+    if payload.get('exp', 0) < time():
+        return None
+    revoked = load_revocations()
+    if payload.get('jti') in revoked['jti'] or token_issued_ms(payload) <= revoked['users'].get(payload.get('uid'), 0):
+        return None
+    return payload
+
+def token_issued_ms(payload):
+    """iat в миллисекундах; токены, выданные до перехода на мс, несут секунды"""
+    iat = payload.get('iat', 0)
+    return iat * 1000 if iat < 10 ** 11 else iat
+
+def revoke_token(cur, payload):
+    """Отзыв одного подписанного токена (выход)"""
+    cur.execute("""
+        INSERT INTO token_revocations (jti, user_id, expires_at)
+        VALUES ('%s', %d, '%s')
+    """ % (payload['jti'].replace("'", "''"), int(payload['uid']), datetime.fromtimestamp(payload['exp']).isoformat()))
+    _revocations['jti'].add(payload['jti'])
+
+def revoke_user_tokens(cur, users_where):
+    """Отзыв подписанных токенов пользователей из users под условием, выданных до текущей миллисекунды.
+
+    Запись живёт TOKEN_MAX_DAYS — дольше токен не действует.
+    """
+    if not TOKEN_SECRET:
+        return
+    cutoff = int(time() * 1000)
+    cur.execute("""
+        INSERT INTO token_revocations (user_id, revoked_before, expires_at)
+        SELECT id, %d, NOW() + INTERVAL '%d days' FROM users WHERE %s
+        RETURNING user_id
+    """ % (cutoff, TOKEN_MAX_DAYS, users_where))
+    for (user_id,) in cur.fetchall():
+        _revocations['users'][user_id] = max(_revocations['users'].get(user_id, 0), cutoff)
+
+def scan_auth_error(event, roles):
+    """Ответ 401/403, если включён SCAN_REQUIRE_AUTH и роль токена не из roles; иначе None"""
+    if not SCAN_REQUIRE_AUTH:
+        return None
+    payload = verify_signed_token(get_auth_token(event))
+    if not payload:
+        return json_response(401, {'error': 'Требуется авторизация'})
+    if payload.get('role') not in roles:
+        return json_response(403, {'error': 'Недостаточно прав для регистрации прохода'})
+    return None
+
+_journal_stats_cache = TTLCache(JOURNAL_STATS_TTL)
+
+def journal_stats(cur, table, demo, counters, extras=()):
+    """Счётчики журнала за сегодня одним проходом по диапазону created_at и итог по всей таблице.
+
+    counters — пары (имя, условие FILTER), extras — пары (имя, выражение над CTE today).
+    Демо-разделение — по собственному столбцу is_demo_data журнала, его ставят при записи
+    из personnel.is_demo_data. Итог = записи до сегодняшнего дня (меняются редко, кэшируются
+    на JOURNAL_HISTORY_TTL в пределах дня) + сегодняшние из того же прохода.
+    """
+    cached = _journal_stats_cache.get((table, demo))
+    if cached:
+        return cached
+
+    demo_val = 'TRUE' if demo else 'FALSE'
+    selects = ['COUNT(*) FILTER (WHERE %s)' % cond for _, cond in counters] + [expr for _, expr in extras]
+    cur.execute("""
+        WITH today AS (
+            SELECT * FROM %s
+            WHERE created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1
+              AND is_demo_data = %s
+        )
+        SELECT %s, COUNT(*), CURRENT_DATE FROM today
+    """ % (table, demo_val, ', '.join(selects)))
+    row = cur.fetchone()
+    names = [n for n, _ in counters] + [n for n, _ in extras]
+    stats = dict(zip(names, row))
+
+    history_key = (table, demo, row[len(names) + 1])
+    before = _journal_stats_cache.get(history_key)
+    if before is None:
+        cur.execute("SELECT COUNT(*) FROM %s WHERE is_demo_data = %s AND created_at < CURRENT_DATE" % (table, demo_val))
+        before = _journal_stats_cache.set(history_key, cur.fetchone()[0], JOURNAL_HISTORY_TTL)
+    stats['total'] = before + row[len(names)]
+
+    return _journal_stats_cache.set((table, demo), stats)
+
+def parse_qr_code(raw):
+    try:
+        data = json.loads(raw)
+        return data.get('code', raw)
+    except (json.JSONDecodeError, AttributeError):
+        return raw.strip()
+
+def get_idempotency_key(event, body):
+    for name in ['Idempotency-Key', 'X-Idempotency-Key']:
+        value = request_header(event, name)
+        if value:
+            return str(value).strip()[:200]
+    return str(body.get('idempotency_key') or '').strip()[:200]
+
+def idempotent(event, body, scope, func):
+    """Повтор запроса с тем же ключом идемпотентности возвращает сохранённый первый ответ.
+
+    Ключ — заголовок Idempotency-Key или поле idempotency_key; без ключа запрос выполняется как обычно.
+    Ключ резервируется до выполнения, поэтому параллельный повтор получает 409, а не второй проход.
+    Заодно удаляется небольшая порция просроченных ключей.
+    """
+    key = get_idempotency_key(event, body)
+    if not key:
+        return func(body)
+
+    where = "scope = '%s' AND idem_key = '%s'" % (scope, key.replace("'", "''"))
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("""
+        WITH purge AS (
+            DELETE FROM idempotency_keys WHERE ctid IN (
+                SELECT ctid FROM idempotency_keys
+                WHERE expires_at < NOW() AND NOT (%(where)s)
+                LIMIT 50
+            )
+        )
+        INSERT INTO idempotency_keys (scope, idem_key, expires_at)
+        VALUES ('%(scope)s', '%(key)s', NOW() + INTERVAL '%(ttl)d hours')
+        ON CONFLICT (scope, idem_key) DO UPDATE
+            SET status_code = NULL, response = NULL, created_at = NOW(), expires_at = EXCLUDED.expires_at
+            WHERE idempotency_keys.expires_at < NOW()
+               OR (idempotency_keys.status_code IS NULL AND idempotency_keys.created_at < NOW() - INTERVAL '1 minute')
+        RETURNING 1
+    """ % {'where': where, 'scope': scope, 'key': key.replace("'", "''"), 'ttl': IDEMPOTENCY_TTL_HOURS})
+    reserved = cur.fetchone()
+    stored = None
+    if not reserved:
+        cur.execute("SELECT status_code, response FROM idempotency_keys WHERE %s" % where)
+        stored = cur.fetchone()
+    conn.commit()
+
+    if not reserved:
+        cur.close()
+        conn.close()
+        if stored and stored[0] is not None:
+            response = json_response(stored[0], {})
+            response['body'] = stored[1]
+            response['headers']['Idempotent-Replayed'] = 'true'
+            return response
+        return json_response(409, {'error': 'Запрос с этим ключом ещё обрабатывается'})
+
+    try:
+        response = func(body)
+    except Exception:
+        cur.execute("DELETE FROM idempotency_keys WHERE %s" % where)
+        conn.commit()
+        cur.close()
+        conn.close()
+        raise
+
+    if response['statusCode'] >= 500:
+        cur.execute("DELETE FROM idempotency_keys WHERE %s" % where)
+    else:
+        cur.execute("""
+            UPDATE idempotency_keys SET status_code = %d, response = '%s' WHERE %s
+        """ % (response['statusCode'], response['body'].replace("'", "''"), where))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    return response
+
+def run_batch(event, body, handler):
+    """Несколько действий функции одним вызовом: {"requests": [{"id", "method", "action", "params", "body"}]}.
+
+    Подзапросы выполняются по порядку на одном соединении. Если все они GET, чтение идёт
+    в одной транзакции REPEATABLE READ, то есть из одного снимка данных: каждый подзапрос
+    под своим SAVEPOINT, ошибка откатывает только его, а попутные записи (get_db(primary=True))
+    идут через отдельное соединение; commit() на общем соединении здесь — ошибка подзапроса.
+    В смешанном пакете каждый подзапрос сам фиксирует свою транзакцию, как при отдельном вызове;
+    незафиксированный остаток откатывается после подзапроса. close() подзапросов на общем
+    соединении ничего не делает. handler — обработчик
+    функции без @instrumented (handler.__wrapped__), чтобы замер и сжатие были на весь пакет.
+    """
+    requests = body.get('requests')
+    if not isinstance(requests, list) or not requests:
+        return json_response(400, {'error': 'Нет подзапросов'})
+    if len(requests) > BATCH_MAX:
+        return json_response(400, {'error': 'Не более %d подзапросов за раз' % BATCH_MAX})
+    for item in requests:
+        if not isinstance(item, dict) or not item.get('action'):
+            return json_response(400, {'error': 'У каждого подзапроса должен быть action'})
+        if item['action'] == 'batch':
+            return json_response(400, {'error': 'Вложенный batch не поддерживается'})
+        if str(item.get('method') or 'GET').upper() not in ('GET', 'POST', 'PUT', 'DELETE'):
+            return json_response(400, {'error': 'Недопустимый метод: %s' % item.get('method')})
+
+    headers = {k: v for k, v in (event.get('headers') or {}).items()
+               if k.lower() not in ('if-none-match', 'accept-encoding', 'idempotency-key', 'x-idempotency-key')}
+    snapshot = all(str(item.get('method') or 'GET').upper() == 'GET' for item in requests)
+
+    _routing['read'] = snapshot and all(item['action'] in _routing['read_actions'] for item in requests)
+    conn = get_db()
+    _batch.update(conn=conn, snapshot=snapshot)
+    parts = []
+    try:
+        if snapshot:
+            cur = conn.cursor()
+            cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            cur.close()
+        for i, item in enumerate(requests):
+            params = dict(item.get('params') or {})
+            params['action'] = item['action']
+            sub_event = dict(event, httpMethod=str(item.get('method') or 'GET').upper(), headers=headers,
+                             queryStringParameters=params,
+                             body=json.dumps(item['body']) if item.get('body') is not None else None)
+            if snapshot:
+                cur = conn.cursor()
+                cur.execute('SAVEPOINT batch_item')
+                cur.close()
+            try:
+                response = handler(sub_event, None)
+            except Exception as e:
+                response = json_response(500, {'error': str(e)})
+            if not snapshot or response['statusCode'] >= 500:
+                conn.rollback()
+            result = '{"id":%s,"action":%s,"status":%d' % (
+                encode_json(item.get('id', i)), encode_json(item['action']), response['statusCode'])
+            content_type = (response.get('headers') or {}).get('Content-Type', '')
+            if response.get('isBase64Encoded'):
+                result += ',"isBase64Encoded":true,"body":%s}' % encode_json(response.get('body') or '')
+            elif content_type.startswith('application/json') and response.get('body'):
+                result += ',"body":%s}' % response['body']
+            else:
+                result += ',"body":%s}' % encode_json(response.get('body') or '')
+            parts.append(result)
+    finally:
+        _batch.update(conn=None, snapshot=False)
+        conn.close()
+
+    response = json_response(200, {})
+    response['body'] = '{"results":[%s]}' % ','.join(parts)
+    return response
@@ -0,0 +1,55 @@
+"""Раскладывает shared/core.py по каталогам backend-функций.
+
+Каждая функция разворачивается из своего каталога и не видит соседние, поэтому ядро
+копируется в backend/<функция>/core.py. Копии правятся только через shared/core.py.
+
+    python shared/vendor.py          # обновить копии
+    python shared/vendor.py --check  # убедиться, что копии совпадают с источником
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, 'shared', 'core.py')
+BACKEND = os.path.join(ROOT, 'backend')
+
+HEADER = '# Копия shared/core.py — не редактировать, обновлять через python shared/vendor.py\n'
+
+
+def function_dirs():
+    for name in sorted(os.listdir(BACKEND)):
+        if os.path.isfile(os.path.join(BACKEND, name, 'index.py')):
+            yield name
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Копирование общего ядра в каталоги функций')
+    parser.add_argument('--check', action='store_true', help='только проверить, не записывая')
+    args = parser.parse_args()
+
+    with open(SOURCE, encoding='utf-8') as f:
+        expected = HEADER + f.read()
+
+    stale = []
+    for name in function_dirs():
+        target = os.path.join(BACKEND, name, 'core.py')
+        current = None
+        if os.path.exists(target):
+            with open(target, encoding='utf-8') as f:
+                current = f.read()
+        if current == expected:
+            continue
+        stale.append(name)
+        if not args.check:
+            with open(target, 'w', encoding='utf-8') as f:
+                f.write(expected)
+
+    if args.check and stale:
+        sys.exit('core.py расходится с shared/core.py: %s' % ', '.join(stale))
+    if not args.check:
+        print('Обновлено: %s' % (', '.join(stale) if stale else 'ничего'))
+
+
+if __name__ == '__main__':
+    main()
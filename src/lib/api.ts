@@ -50,6 +50,13 @@ const DEMO_ALLOWED_ACTIONS = [
   "personnel_list", "recent", "person",
 ];
 
+type BatchItem = {
+  action: string;
+  method?: string;
+  params?: Record<string, string>;
+  body?: Record<string, unknown>;
+};
+
 async function request(
   base: string,
   path: string,
@@ -65,7 +72,9 @@ async function request(
   if (localStorage.getItem("mc_demo") === "true" && method !== "GET") {
     const action = params?.action || "";
     const isAdminDemoAction = action.startsWith("demo-");
-    if (!isAdminDemoAction && !["login", "login-code", "logout", "demo-enter"].includes(action)) {
+    const isReadBatch = action === "batch" &&
+      ((body?.requests as BatchItem[] | undefined) || []).every((r) => !r.method || r.method === "GET");
+    if (!isAdminDemoAction && !isReadBatch && !["login", "login-code", "logout", "demo-enter"].includes(action)) {
       throw new Error("Демо-режим: сохранение данных доступно только в приобретённой версии");
     }
   }
@@ -111,6 +120,16 @@ async function request(
   return data;
 }
 
+async function batchRequest(base: string, requests: BatchItem[]) {
+  const data = await request(base, "", { method: "POST", body: { requests }, params: { action: "batch" } });
+  return (data.results as { status: number; body: typeof data }[]).map((r) => {
+    if (r.status >= 400) {
+      throw new Error(r.body?.error || "Ошибка сервера");
+    }
+    return r.body;
+  });
+}
+
 export const authApi = {
   register: (body: Record<string, unknown>) =>
     request(API.auth, "", { method: "POST", body, params: { action: "register" } }),
@@ -297,6 +316,13 @@ export const scannerApi = {
 };
 
 export const lampRoomApi = {
+  getPageData: (params?: Record<string, string>) =>
+    batchRequest(API.lampRoom, [
+      { action: "list", params },
+      { action: "stats" },
+      { action: "denials" },
+      { action: "repairs" },
+    ]),
   getIssues: (params?: Record<string, string>) =>
     request(API.lampRoom, "", { params: { action: "list", ...params } }),
   getStats: () =>
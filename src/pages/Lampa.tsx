@@ -216,12 +216,7 @@ const Lampa = () => {
       setError("");
       const p: Record<string, string> = {};
       if (filterStatus !== "all") p.status = filterStatus;
-      const [issuesRes, statsRes, denialsRes, repairsRes] = await Promise.all([
-        lampRoomApi.getIssues(p),
-        lampRoomApi.getStats(),
-        lampRoomApi.getDenials(),
-        lampRoomApi.getRepairs(),
-      ]);
+      const [issuesRes, statsRes, denialsRes, repairsRes] = await lampRoomApi.getPageData(p);
       setIssues(issuesRes.issues || []);
       setStats(statsRes);
       setDenials(denialsRes.denials || []);